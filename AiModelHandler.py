@@ -1,24 +1,39 @@
+import asyncio
+import hashlib
 import json
 from pathlib import Path
 import time
-from typing import Self
-
-from google import genai
-from google.api_core import exceptions
-from google.genai.errors import ClientError
+from typing import TYPE_CHECKING, Any, Self
 
 from Configuration import Configuration
 from FileCache import FileCache
 from Logger import LogLevel, log
+from Metrics import metrics
 from common import calculate_backoff
 
+# The Gemini SDK is slow to import and isn't needed at all while every ticket is an IRCTC ticket. It gets imported on the first
+# ticket that has to be parsed by the AI model
+if TYPE_CHECKING:
+    from google import genai
+
 
 class Model:
     def __init__(self: Self) -> None:
         self._client = None
 
+        # The async client's connections belong to the event loop they were opened in. Every batch of the async engine runs in a
+        # loop of its own, so a client is created per loop
+        self._async_client: tuple[asyncio.AbstractEventLoop, "genai.Client"] | None = None
+
+    # The client is created again from the credentials in the configuration on the next parse
+    def reset(self: Self) -> None:
+        self._client = None
+        self._async_client = None
+
     @staticmethod
-    def _get_client(config: Configuration) -> genai.Client:
+    def _get_client(config: Configuration) -> "genai.Client":
+        from google import genai
+
         log(LogLevel.Status, config, "Initializing AI Model")
 
         try:
@@ -33,62 +48,126 @@ class Model:
                 f"{config.ai_model_credentials_path} is corrupted." "Must be of the format: {api_key: <YOUR_API_KEY_HERE>}")
             raise
 
-    def parse(self: Self, ticket_fp: Path, prompt: str, config: Configuration) -> str:
-        if self._client is None:
-            self._client = self._get_client(config)
-
+    # digest is the SHA-1 of the ticket's contents, when it has already been worked out
+    def parse(self: Self, ticket_fp: Path, prompt: str, config: Configuration, digest: str | None = None) -> str:
         def impl(config: Configuration) -> str:
+            models = self._get_models(config)
             log(LogLevel.Status, config, f"Asking {config.ai_model} for help")
 
             for attempt in range(config.max_retries_for_network_requests):
                 try:
-                    if self._client is None:
-                        raise Exception(f"self._client in None in {__file__}")
-
-                    response = self._client.models.generate_content(
-                        model=config.ai_model,
-                        contents=[
-                            genai.types.Part.from_bytes(
-                                data=ticket_fp.read_bytes(),
-                                mime_type="application/pdf"
-                            ),
-                            prompt
-                        ],
-                        config=genai.types.GenerateContentConfig(
-                            temperature=0.1)
-                    )
-
-                    if response.text is None:
-                        raise Exception("Response was obtained as None")
-
-                    return response.text
-                except exceptions.ResourceExhausted as error:
-                    log(LogLevel.Warning, config,
-                        f"API quota exhausted: {error}")
-
-                except exceptions.GoogleAPIError as error:
-                    log(LogLevel.Warning, config, f"Google API Error: {error}")
-
-                except ClientError as error:
-                    if error.code == 429:
-                        models = ["gemini-2.5-flash",
-                                  "gemini-2.5-flash-lite", "gemini-3-flash"]
-                        log(LogLevel.Warning, config,
-                            f"Exceeded quota for current model. Trying a new one: {models[attempt % len(models)]}...")
-                        config.ai_model = models[attempt % len(models)]
-                    else:
-                        log(LogLevel.Warning, config,
-                            f"Some client error occured: {error}")
-
+                    with metrics.span("gemini_request"):
+                        return self._response_text(models.generate_content(
+                            **self._request(ticket_fp, prompt, config)))
                 except Exception as error:
-                    log(LogLevel.Warning, config,
-                        f"Some error occured: {error}")
-
-                log(LogLevel.Status, config,
-                    f"Retrying in {calculate_backoff(attempt)} seconds")
+                    self._handle_error(error, attempt, config)
                 time.sleep(calculate_backoff(attempt))
 
             raise Exception(
                 f"Failure to parse ticket from AI Model after {config.max_retries_for_network_requests} retries")
 
-        return FileCache(ticket_fp.stem, impl, lambda x: x, lambda x: x, config).data
+        return FileCache("ai", self._cache_code(ticket_fp, digest), impl, lambda x: x, lambda x: x, config).data
+
+    # Same as parse but over the async Gemini client with the backoff awaited, so that it doesn't hold up the event loop
+    # Reading the ticket and the cache (which can wait on another process's lock) happen on worker threads for the same reason
+    # limit bounds the number of requests in flight
+    async def parse_async(self: Self, ticket_fp: Path, prompt: str, config: Configuration, limit: asyncio.Semaphore, digest: str | None = None) -> str:
+        code = await asyncio.to_thread(self._cache_code, ticket_fp, digest)
+        cached = await asyncio.to_thread(FileCache.lookup, "ai", code, lambda x: x, config)
+        if cached is not None:
+            return cached
+
+        models = self._get_async_models(config)
+        log(LogLevel.Status, config, f"Asking {config.ai_model} for help")
+
+        # The ticket is read once. The model is set again before every attempt since _handle_error switches it when out of quota
+        request = await asyncio.to_thread(self._request, ticket_fp, prompt, config)
+        for attempt in range(config.max_retries_for_network_requests):
+            request["model"] = config.ai_model
+            try:
+                async with limit:
+                    with metrics.span("gemini_request"):
+                        text = self._response_text(await models.generate_content(**request))
+            except Exception as error:
+                self._handle_error(error, attempt, config)
+                await asyncio.sleep(calculate_backoff(attempt))
+                continue
+
+            return await asyncio.to_thread(lambda: FileCache("ai", code, lambda config: text, lambda x: x, lambda x: x, config).data)
+
+        raise Exception(
+            f"Failure to parse ticket from AI Model after {config.max_retries_for_network_requests} retries")
+
+    # Keyed by the contents of the ticket as well since tickets of different tenants (or a ticket replaced by a newer one) can
+    # share a file name. The ticket is only read when digest isn't given
+    @staticmethod
+    def _cache_code(ticket_fp: Path, digest: str | None = None) -> str:
+        if digest is None:
+            digest = hashlib.sha1(ticket_fp.read_bytes()).hexdigest()
+        return f"{ticket_fp.stem}-{digest[:16]}"
+
+    def _get_models(self: Self, config: Configuration) -> Any:
+        if self._client is None:
+            self._client = self._get_client(config)
+        return self._client.models
+
+    # Nothing is awaited between checking for the client and creating it, so the coroutines of a batch share a single one
+    def _get_async_models(self: Self, config: Configuration) -> Any:
+        loop = asyncio.get_running_loop()
+        if self._async_client is None or self._async_client[0] is not loop:
+            self._async_client = (loop, self._get_client(config))
+        return self._async_client[1].aio.models
+
+    @staticmethod
+    def _request(ticket_fp: Path, prompt: str, config: Configuration) -> dict:
+        from google import genai
+
+        return {
+            "model": config.ai_model,
+            "contents": [
+                genai.types.Part.from_bytes(
+                    data=ticket_fp.read_bytes(),
+                    mime_type="application/pdf"
+                ),
+                prompt
+            ],
+            "config": genai.types.GenerateContentConfig(temperature=0.1),
+        }
+
+    @staticmethod
+    def _response_text(response: Any) -> str:
+        if response.text is None:
+            raise Exception("Response was obtained as None")
+        return response.text
+
+    # Logs a failed request before it's retried. Running out of quota for a model switches to another one
+    @staticmethod
+    def _handle_error(error: Exception, attempt: int, config: Configuration) -> None:
+        from google.api_core import exceptions
+        from google.genai.errors import ClientError
+
+        if isinstance(error, exceptions.ResourceExhausted):
+            log(LogLevel.Warning, config,
+                f"API quota exhausted: {error}")
+
+        elif isinstance(error, exceptions.GoogleAPIError):
+            log(LogLevel.Warning, config, f"Google API Error: {error}")
+
+        elif isinstance(error, ClientError):
+            if error.code == 429:
+                models = ["gemini-2.5-flash",
+                          "gemini-2.5-flash-lite", "gemini-3-flash"]
+                log(LogLevel.Warning, config,
+                    f"Exceeded quota for current model. Trying a new one: {models[attempt % len(models)]}...")
+                config.ai_model = models[attempt % len(models)]
+            else:
+                log(LogLevel.Warning, config,
+                    f"Some client error occured: {error}")
+
+        else:
+            log(LogLevel.Warning, config,
+                f"Some error occured: {error}")
+
+        log(LogLevel.Status, config,
+            f"Retrying in {calculate_backoff(attempt)} seconds")
+        metrics.count("retries", service="gemini")
@@ -0,0 +1,156 @@
+import asyncio
+from datetime import datetime
+from pathlib import Path
+import time
+from typing import TYPE_CHECKING, Self
+
+from AiModelHandler import Model
+from Configuration import Configuration
+from DoneScheduler import DoneScheduler
+from Logger import LogLevel, log
+from Metrics import metrics
+from RailRadarHandler import RailRadarHandler
+from Ticket import Ticket
+from TicketFolderHandler import TicketFolderHandler, TicketResult
+from TicketJournal import journal
+
+if TYPE_CHECKING:
+    from GServicesHandler import GServicesHandler
+
+
+# Processes a batch of tickets as coroutines on a single event loop instead of a thread per ticket, so that hundreds of tickets can
+# be waiting on the network at once. RailRadar is called over httpx (when installed) and Gemini over its async client. The Google
+# API client library can only block, so its calls are made on the loop's worker threads. Backoff between retries is awaited
+# Up to async_tickets_in_flight tickets are processed at a time, with at most route_prefetch_workers, gemini_concurrency and
+# google_api_concurrency requests in flight to RailRadar, Gemini and the Google APIs respectively
+# The steps are the same as TicketFolderHandler's (and so is the journal), minus the per ticket notifications batches don't send
+# Anything touching the disk (the journal, the caches, the route store, moving tickets) is done on the loop's worker threads
+class AsyncEngine:
+    def __init__(self: Self, gsh: "GServicesHandler", model: Model, done_scheduler: DoneScheduler | None, config: Configuration) -> None:
+        self._gsh = gsh
+        self._model = model
+        self._done_scheduler = done_scheduler
+        self._config = config
+
+    def process_batch(self: Self, ticket_fps: list[Path]) -> list[TicketResult]:
+        return asyncio.run(self._process_batch(ticket_fps))
+
+    async def _process_batch(self: Self, ticket_fps: list[Path]) -> list[TicketResult]:
+        config = self._config
+
+        # Semaphores belong to the event loop they're first used in, hence created in it
+        self._tickets = asyncio.Semaphore(
+            max(1, config.async_tickets_in_flight))
+        self._gemini = asyncio.Semaphore(max(1, config.gemini_concurrency))
+        self._google = asyncio.Semaphore(
+            max(1, config.google_api_concurrency))
+
+        ticket_texts, train_numbers = await asyncio.to_thread(TicketFolderHandler._extract_texts, ticket_fps, config)
+        await RailRadarHandler.prefetch_async(train_numbers, config)
+
+        return list(await asyncio.gather(*(self._process_ticket(ticket_fp, ticket_texts.get(ticket_fp)) for ticket_fp in ticket_fps)))
+
+    async def _process_ticket(self: Self, ticket_fp: Path, ticket_text: str | None) -> TicketResult:
+        async with self._tickets:
+            start = time.perf_counter()
+            with metrics.span("ticket"):
+                result, link = await self._process_ticket_steps(ticket_fp, ticket_text)
+            metrics.count("tickets", result=result)
+            return TicketResult(ticket_fp, result, link, time.perf_counter() - start)
+
+    async def _process_ticket_steps(self: Self, ticket_fp: Path, ticket_text: str | None) -> tuple[str, str | None]:
+        config = self._config
+        log(LogLevel.Status, config, f"Processing {ticket_fp}")
+
+        # The journal and the done schedule write to disk, which would hold up every other ticket if done on the event loop
+        checkpoint = await asyncio.to_thread(journal.begin, ticket_fp, config)
+
+        if checkpoint.data is not None:
+            log(LogLevel.Status, config,
+                "\tResuming from where the last attempt at the ticket stopped")
+            metrics.count("journal_resumes")
+            ticket = Ticket.from_data(ticket_fp, checkpoint.data)
+        else:
+            try:
+                with metrics.span("parse"):
+                    ticket = await self._parse(ticket_fp, ticket_text, checkpoint.digest)
+            except Exception as error:
+                log(LogLevel.Error, config,
+                    f"Failure to parse ticket: {error}")
+                log(LogLevel.Error, config,
+                    "Unimplemented feature of user intervention to supply correct info. Skipping ticket...")
+                return "parse_failed", None
+
+            checkpoint.data = ticket.data
+            await asyncio.to_thread(journal.save, checkpoint, config)
+
+        try:
+            link = checkpoint.link
+            if link is None:
+                with metrics.span("calendar_lookup"):
+                    link = await self._gsh.calendar.event_exists_async(ticket.ttc_id, config, self._google)
+
+            if link:
+                log(LogLevel.Status, config,
+                    f"\tFound the event at {link}. Not creating it again")
+                result = "already_present"
+
+                if datetime.now() > ticket.arrival and await asyncio.to_thread(
+                        DoneScheduler.mark_as_done, ticket_fp, ticket.arrival, config.done_folder, config):
+                    result = "done"
+            else:
+                upload_response = checkpoint.upload
+                if upload_response:
+                    log(LogLevel.Status, config,
+                        f"\tAlready uploaded {ticket_fp} to {upload_response.webViewLink}")
+                else:
+                    log(LogLevel.Status, config,
+                        f"\tUploading {ticket_fp} to Google Drive")
+                    with metrics.span("drive_upload"):
+                        upload_response = await self._gsh.drive.upload_pdf_async(ticket_fp, config, self._google)
+
+                    if upload_response:
+                        log(LogLevel.Status, config,
+                            f"\tUploaded {ticket_fp} to {upload_response.webViewLink}")
+                        checkpoint.upload = upload_response
+                        await asyncio.to_thread(journal.save, checkpoint, config)
+                    else:
+                        log(LogLevel.Warning, config,
+                            f"Failure to upload {ticket_fp}")
+
+                log(LogLevel.Status, config, "\tCreating event")
+                with metrics.span("calendar_insert"):
+                    link = await self._gsh.calendar.insert_event_async(ticket.ttc_id, ticket.summary, ticket.from_where, ticket.description,
+                                                                       upload_response, ticket.departure, ticket.arrival, ticket.color, config, self._google)
+                log(LogLevel.Status, config, f"\tEvent created at {link}")
+                checkpoint.link = link
+                await asyncio.to_thread(journal.save, checkpoint, config)
+                result = "created"
+
+            if result != "done" and self._done_scheduler is not None:
+                await asyncio.to_thread(self._done_scheduler.schedule, ticket_fp, ticket.arrival, ticket.from_where, ticket.to_where, config.done_folder)
+        except Exception as error:
+            log(LogLevel.Error, config,
+                "Failure to perform some Google API call. Skipping ticket...")
+            return "api_failed", None
+
+        await asyncio.to_thread(journal.clear, ticket_fp, config)
+        log(LogLevel.Status, config, f"Finished processing {ticket_fp}")
+        return result, link
+
+    # IRCTC tickets only need their routes, which have been prefetched, so they're parsed on a worker thread in case a route still
+    # has to be fetched. Every other ticket is parsed by the AI model without blocking
+    async def _parse(self: Self, ticket_fp: Path, ticket_text: str | None, digest: str | None) -> Ticket:
+        config = self._config
+
+        if ticket_text is None:
+            ticket_text = await asyncio.to_thread(Ticket.extract_text, ticket_fp, config)
+
+        if Ticket.is_irctc_ticket(ticket_text):
+            return await asyncio.to_thread(Ticket, ticket_fp, self._model, config, ticket_text, digest)
+
+        log(LogLevel.Status, config,
+            "Couldn't identify the type of ticket to parse. Parsing with AI Model.")
+        with metrics.span("ai_parse"):
+            response = await self._model.parse_async(ticket_fp, Ticket.ai_prompt(), config, self._gemini, digest)
+        return Ticket.from_data(ticket_fp, Ticket.travel_data_from_ai_response(response, config))
@@ -0,0 +1,105 @@
+from datetime import datetime, timedelta
+import os
+from pathlib import Path
+import threading
+from typing import Self
+
+from Configuration import CacheNamespace, Configuration
+from Logger import LogLevel, log
+
+
+# Keeps the cache folder in check from a background thread so that startup never waits on it
+# Every cache_sweep_interval entries older than their namespace's refresh_time are removed, and then the least recently accessed
+# entries are removed till the namespace fits in its disk_bytes budget
+# Files left behind by writes and locks, like the temporary file of a process that died mid write, are removed once they're old
+class CacheSweeper(threading.Thread):
+    _entry_suffixes = (".txt", ".txt.gz", ".txt.zst")
+    _leftover_suffixes = (".tmp", ".lock")
+    _leftover_age = timedelta(hours=1)
+
+    # The lock file of a shard folder, which FileCache keeps using
+    _shard_lock_name = ".lock"
+
+    def __init__(self: Self, config: Configuration) -> None:
+        super().__init__(name="cache-sweeper", daemon=True)
+        self.config = config
+        self._stop_event = threading.Event()
+
+    def run(self: Self) -> None:
+        while not self._stop_event.is_set():
+            self.sweep(self.config)
+            self._stop_event.wait(
+                self.config.cache_sweep_interval.total_seconds())
+
+    def stop(self: Self) -> None:
+        self._stop_event.set()
+
+    @staticmethod
+    def sweep(config: Configuration) -> None:
+        try:
+            # Files left over from before the cache was split into namespaces
+            for file in config.cache_folder.glob("*.txt"):
+                if file.is_file() and datetime.now() - datetime.fromtimestamp(file.stat().st_mtime) > config.cache_data_refresh_time:
+                    file.unlink(missing_ok=True)
+
+            # Train routes live in the route store which keeps track of its own freshness
+            with os.scandir(config.cache_folder) as folders:
+                for folder in folders:
+                    if folder.is_dir():
+                        CacheSweeper._sweep_namespace(
+                            Path(folder.path), config.get_cache_namespace(folder.name), config)
+        except FileNotFoundError:
+            pass  # Nothing has been cached yet
+        except Exception as error:
+            log(LogLevel.Warning, config,
+                f"Failure to cleanup outdated cache file: {error}")
+
+    @staticmethod
+    def _sweep_namespace(folder: Path, namespace: CacheNamespace, config: Configuration) -> None:
+        now = datetime.now().timestamp()
+        refresh_seconds = None if namespace.refresh_time is None else namespace.refresh_time.total_seconds()
+
+        # (last access time, size, path) of every entry that is still fresh
+        entries = []
+        removed = 0
+        leftovers = 0
+        for path, stat in CacheSweeper._scan(folder):
+            if path.name.endswith(CacheSweeper._leftover_suffixes):
+                if now - stat.st_mtime > CacheSweeper._leftover_age.total_seconds():
+                    path.unlink(missing_ok=True)
+                    leftovers += 1
+            elif refresh_seconds is not None and now - stat.st_mtime > refresh_seconds:
+                path.unlink(missing_ok=True)
+                removed += 1
+            else:
+                entries.append((stat.st_atime, stat.st_size, path))
+
+        if namespace.disk_bytes is not None:
+            total = sum(size for _, size, _ in entries)
+            for _, size, path in sorted(entries):
+                if total <= namespace.disk_bytes:
+                    break
+                path.unlink(missing_ok=True)
+                total -= size
+                removed += 1
+
+        if removed:
+            log(LogLevel.Status, config,
+                f"Removed {removed} entries from cache '{namespace.name}'")
+        if leftovers:
+            log(LogLevel.Status, config,
+                f"Removed {leftovers} leftover lock and temporary files from cache '{namespace.name}'")
+
+    @staticmethod
+    def _scan(folder: Path) -> list[tuple[Path, os.stat_result]]:
+        found = []
+        try:
+            with os.scandir(folder) as entries:
+                for entry in entries:
+                    if entry.is_dir(follow_symlinks=False):
+                        found.extend(CacheSweeper._scan(Path(entry.path)))
+                    elif entry.name.endswith(CacheSweeper._entry_suffixes + CacheSweeper._leftover_suffixes) and entry.name != CacheSweeper._shard_lock_name:
+                        found.append((Path(entry.path), entry.stat()))
+        except FileNotFoundError:
+            pass
+        return found
@@ -5,8 +5,8 @@ from pathlib import Path
 from datetime import timedelta
 from enum import Enum
 
-from common import ReminderNotificationType, CalendarEventColor, stringify_enum
-from Logger import log, LogLevel
+from common import CacheCompression, ReminderNotificationType, CalendarEventColor, WatchMode, stringify_enum
+from Logger import LogFormat, log, LogLevel
 
 
 class TimedeltaDict(TypedDict):
@@ -19,6 +19,28 @@ class TravellerDict(TypedDict):
     color: str
 
 
+class CacheNamespaceDict(TypedDict, total=False):
+    name: str
+    refresh_time: TimedeltaDict
+    memory_entries: int
+    disk_bytes: int
+    compression: str
+
+
+class TenantDict(TypedDict, total=False):
+    # Besides the name, any of _TENANT_KEYS with the same meaning as at the top level of config.toml
+    name: str
+    ticket_folder: str
+    done_folder: str
+    gapi_credentials_path: str
+    gapi_token_path: str
+    calendar_id: str
+    reminder_notification_type: str
+    reminders: list[TimedeltaDict]
+    event_color: str
+    traveller: list[TravellerDict]
+
+
 class ConfigurationDict(TypedDict, total=False):
     # This is what we will get on parsing config.toml
 
@@ -27,11 +49,15 @@ class ConfigurationDict(TypedDict, total=False):
     rail_radar_credentials_path: str
     ai_model_credentials_path: str
     log_folder: str
+    log_level: str
+    log_format: str
+    log_max_bytes: int
 
     cache_folder: str
     ticket_folder: str
     done_folder: str
     configuration_folder: str
+    profile_folder: str
 
     calendar_id: str
     reminder_notification_type: str
@@ -40,19 +66,69 @@ class ConfigurationDict(TypedDict, total=False):
     traveller: list[TravellerDict]
 
     cache_data_refresh_time: TimedeltaDict
+    cache_namespace: list[CacheNamespaceDict]
+    cache_sweep_interval: TimedeltaDict
+    route_preload_count: int
+    route_memory_entries: int
+    route_stale_while_revalidate: bool
+    route_max_staleness: TimedeltaDict
+    route_prefetch_workers: int
+    rail_radar_base_url: str
     max_retries_for_network_requests: int
 
+    async_engine: bool
+    async_tickets_in_flight: int
+    gemini_concurrency: int
+    google_api_concurrency: int
+
     file_transfer_timeout: TimedeltaDict
     file_transfer_polling_interval: TimedeltaDict
 
+    notify_each_ticket: bool
+    ticket_summary_window: TimedeltaDict
+
+    done_folder_sharding: bool
+
+    watch_mode: str
+    poll_interval: TimedeltaDict
+    poll_full_rescan_interval: TimedeltaDict
+    poll_prune_folders: list[str]
+
     ai_model: str
 
+    metrics_file: str
+    metrics_port: int
+
+    job_queue: bool
+    job_queue_path: str
+    job_queue_workers: int
+    job_visibility_timeout: TimedeltaDict
+    job_max_attempts: int
+
+    tenant: list[TenantDict]
+
+
+# Paths which are None by default
+_OPTIONAL_PATH_KEYS = ["metrics_file", "job_queue_path"]
+
+# What a tenant can set for itself. Everything else (caches, logs, the AI model, RailRadar...) is shared by all the tenants
+_TENANT_KEYS = ["ticket_folder", "done_folder", "gapi_credentials_path", "gapi_token_path", "calendar_id",
+                "reminder_notification_type", "reminders", "event_color", "traveller"]
+
 
 @dataclass
 class Traveller:
     name: list[str]
     color: CalendarEventColor
 
+@dataclass
+class CacheNamespace:
+    name: str
+    refresh_time: timedelta | None  # None means the entries never go stale
+    memory_entries: int  # How many entries are kept in memory in front of the files
+    disk_bytes: int | None  # Total size the cache files of this namespace may take up. None means unbounded
+    compression: CacheCompression = CacheCompression.none
+
 # This is what the consumers of this module will use
 @dataclass
 class Configuration:
@@ -61,11 +137,15 @@ class Configuration:
     rail_radar_credentials_path: Path
     ai_model_credentials_path: Path
     log_folder: Path | None
+    log_level: LogLevel
+    log_format: LogFormat
+    log_max_bytes: int
 
     cache_folder: Path
     ticket_folder: Path
     done_folder: Path
     configuration_folder: Path
+    profile_folder: Path
 
     calendar_id: str
     reminder_notification_type: ReminderNotificationType
@@ -74,21 +154,61 @@ class Configuration:
     traveller: list[Traveller]
 
     cache_data_refresh_time: timedelta
+    cache_namespace: list[CacheNamespace]
+    cache_sweep_interval: timedelta
+    route_preload_count: int
+    route_memory_entries: int  # Routes kept in memory at most. The rest are read from the route store when needed
+    route_stale_while_revalidate: bool
+    route_max_staleness: timedelta
+    route_prefetch_workers: int
+    rail_radar_base_url: str
     max_retries_for_network_requests: int
 
+    # Batches of tickets are processed as coroutines instead of on threads. See AsyncEngine
+    async_engine: bool
+    async_tickets_in_flight: int
+    gemini_concurrency: int  # Requests in flight to each service with the async engine
+    google_api_concurrency: int
+
     file_transfer_timeout: timedelta
     file_transfer_polling_interval: timedelta
 
+    # Without it, the tickets added while the program is running are summed up in one notification per ticket_summary_window
+    notify_each_ticket: bool
+    ticket_summary_window: timedelta
+
+    done_folder_sharding: bool  # Tickets are put in a folder per year and month inside done_folder
+
+    # Only for watch_mode polling. See ScandirObserver
+    watch_mode: WatchMode
+    poll_interval: timedelta
+    poll_full_rescan_interval: timedelta
+    poll_prune_folders: list[Path]  # Never scanned, like archives. done_folder is always left out
+
     ai_model: str
 
+    metrics_file: Path | None
+    metrics_port: int
+
+    job_queue: bool
+    job_queue_path: Path | None  # None means jobs.sqlite3 in cache_folder
+    job_queue_workers: int
+    job_visibility_timeout: timedelta
+    job_max_attempts: int
+
+    # Users whose tickets are handled by this one program. Empty unless config.toml has [[tenant]] entries
+    tenant: list[TenantDict]
+
+    # The keys in config_dict are applied over base, which is the default configuration unless given
     @classmethod
-    def from_config_dict(cls: type[Self], config_dict: ConfigurationDict) -> Self:
-        config = cast(Self, copy.copy(DEFAULT_CONFIG))
+    def from_config_dict(cls: type[Self], config_dict: ConfigurationDict, base: "Configuration | None" = None) -> Self:
+        config = cast(Self, copy.copy(DEFAULT_CONFIG if base is None else base))
 
         if "log_folder" in config_dict:
             config.log_folder = Path(config_dict["log_folder"])
 
-        log(LogLevel.Status, config, f"config.toml found. Loading configuration.")
+        if base is None:
+            log(LogLevel.Status, config, f"config.toml found. Loading configuration.")
 
         for key, value in config_dict.items():
             config_attr = getattr(config, key, None)
@@ -113,6 +233,14 @@ class Configuration:
                             log(LogLevel.Status, config,
                                 f"\tConfigured {key} -> {[str(val) for val in getattr(config, key)]}")
 
+                        case "cache_namespace":
+                            log(LogLevel.Status, config,
+                                f"Configuring cache namespaces...")
+                            setter([_to_cache_namespace(val) for val in value if _is_valid_cachenamespacedict(
+                                val, config)], False)
+                            log(LogLevel.Status, config,
+                                f"\tConfigured {key} -> {getattr(config, key)}")
+
                         case "traveller":
                             log(LogLevel.Status, config,
                                 f"Configuring travellers...")
@@ -121,11 +249,24 @@ class Configuration:
                             log(LogLevel.Status, config,
                                 f"\tConfigured {key} -> {getattr(config, key)}")
 
+                        case "poll_prune_folders":
+                            setter([Path(val) for val in value if type(val) is str], False)
+                            log(LogLevel.Status, config,
+                                f"Configured {key} -> {[str(val) for val in getattr(config, key)]}")
+
+                        case "tenant":
+                            log(LogLevel.Status, config,
+                                f"Configuring tenants...")
+                            setter([val for val in value if _is_valid_tenantdict(
+                                val, config)], False)
+                            log(LogLevel.Status, config,
+                                f"\tConfigured {key} -> {[tenant["name"] for tenant in getattr(config, key)]}")
+
                 else:
                     setter(value)
 
             elif type(value) is str:
-                if isinstance(config_attr, Path):
+                if isinstance(config_attr, Path) or key in _OPTIONAL_PATH_KEYS:
                     setter(Path(value))
 
                 elif isinstance(config_attr, Enum):
@@ -159,6 +300,25 @@ class Configuration:
                 return traveller.color
         return self.event_color
 
+    def get_cache_namespace(self: Self, name: str) -> CacheNamespace:
+        for namespace in self.cache_namespace:
+            if namespace.name == name:
+                return namespace
+        for namespace in DEFAULT_CONFIG.cache_namespace:
+            if namespace.name == name:
+                return namespace
+        return CacheNamespace(name, self.cache_data_refresh_time, 64, None, CacheCompression.none)
+
+    # The configuration of a single tenant: this configuration with the tenant's own keys applied over it
+    def get_tenant(self: Self, name: str) -> "Configuration":
+        for tenant in self.tenant:
+            if tenant["name"] == name:
+                config = Configuration.from_config_dict(cast(ConfigurationDict, {
+                    key: value for key, value in tenant.items() if key != "name"}), self)
+                config.tenant = []
+                return config
+        raise KeyError(f"No tenant named '{name}'")
+
 
 
 def _is_valid_timedeltadict(data: TimedeltaDict | dict, config: Configuration) -> bool:
@@ -227,10 +387,69 @@ def _to_traveller(data: TravellerDict) -> Traveller:
     return Traveller([data["name"].lower()] if isinstance(data["name"], str) else [name.lower() for name in data["name"]], CalendarEventColor[data["color"]])
 
 
+def _is_valid_tenantdict(data: TenantDict, config: Configuration) -> bool:
+    def error(msg: str) -> bool:
+        log(LogLevel.Warning, config,
+            f"Failure to process tenant: {data}. {msg}")
+        return False
+
+    if "name" not in data or type(data["name"]) is not str:
+        return error("Each tenant must have a 'name' of type str")
+
+    if "ticket_folder" not in data or type(data["ticket_folder"]) is not str:
+        return error("Each tenant must have its own 'ticket_folder'")
+
+    if "gapi_token_path" not in data or type(data["gapi_token_path"]) is not str:
+        return error("Each tenant must have its own 'gapi_token_path'")
+
+    unknown = [key for key in data if key != "name" and key not in _TENANT_KEYS]
+    if unknown:
+        return error(f"{", ".join(unknown)} can't be set per tenant. Only these can: {", ".join(_TENANT_KEYS)}")
+
+    return True
+
+
+def _is_valid_cachenamespacedict(data: CacheNamespaceDict, config: Configuration) -> bool:
+    def error(msg: str) -> bool:
+        log(LogLevel.Warning, config,
+            f"Failure to process cache namespace: {data}. {msg}")
+        return False
+
+    if "name" not in data or type(data["name"]) is not str:
+        return error("Each cache namespace must have a 'name' of type str")
+
+    if "refresh_time" in data and not (type(data["refresh_time"]) is dict and _is_valid_timedeltadict(data["refresh_time"], config)):
+        return error("'refresh_time' must be a duration with a 'magnitude' and a 'unit'")
+
+    if "memory_entries" in data and (type(data["memory_entries"]) is not int or data["memory_entries"] < 0):
+        return error("'memory_entries' must be a non-negative integer")
+
+    if "disk_bytes" in data and (type(data["disk_bytes"]) is not int or data["disk_bytes"] <= 0):
+        return error("'disk_bytes' must be a positive integer")
+
+    if "compression" in data and not (type(data["compression"]) is str and hasattr(CacheCompression, data["compression"])):
+        return error(f"'compression' can only take values: {stringify_enum(CacheCompression)}")
+
+    return True
+
+
+def _to_cache_namespace(data: CacheNamespaceDict) -> CacheNamespace:
+    return CacheNamespace(
+        data["name"],
+        _to_timedelta(data["refresh_time"]) if "refresh_time" in data else None,
+        data.get("memory_entries", 64),
+        data.get("disk_bytes"),
+        CacheCompression[data.get("compression", "none")],
+    )
+
+
 DEFAULT_CONFIG = Configuration(
     gapi_credentials_path=Path(__file__).parent / "credentials.json",
     gapi_token_path=Path(__file__).parent / "token.json",
     log_folder=None,
+    log_level=LogLevel.Status,
+    log_format=LogFormat.text,
+    log_max_bytes=10 * 1024 * 1024,
     calendar_id="primary",
     reminder_notification_type=ReminderNotificationType.popup,
     reminders=[
@@ -242,6 +461,21 @@ DEFAULT_CONFIG = Configuration(
     traveller=[],
     cache_folder=Path.home() / ".cache/Travel Ticket Calendar/",
     cache_data_refresh_time=timedelta(weeks=1),
+    cache_namespace=[
+        # A ticket's AI parse doesn't change with time
+        CacheNamespace("ai", None, 64, 64 * 1024 * 1024, CacheCompression.gzip),
+    ],
+    cache_sweep_interval=timedelta(hours=1),
+    route_preload_count=32,
+    route_memory_entries=512,
+    route_stale_while_revalidate=True,
+    route_max_staleness=timedelta(weeks=12),
+    route_prefetch_workers=8,
+    rail_radar_base_url="https://api.railradar.in/api/v1",
+    async_engine=False,
+    async_tickets_in_flight=256,
+    gemini_concurrency=4,
+    google_api_concurrency=8,
     rail_radar_credentials_path=Path(
         __file__).parent / "rail_radar_credentials.json",
     ai_model_credentials_path=Path(
@@ -249,8 +483,24 @@ DEFAULT_CONFIG = Configuration(
     ticket_folder=Path.home() / "travels/",
     done_folder=Path.home() / "travels/done/",
     configuration_folder=Path.home() / ".config/Travel Ticket Calendar/",
+    profile_folder=Path.home() / ".local/share/Travel Ticket Calendar/profiles/",
     max_retries_for_network_requests=7,
     file_transfer_timeout=timedelta(seconds=10),
     file_transfer_polling_interval=timedelta(milliseconds=250),
-    ai_model="gemini-2.5-flash-lite"
+    notify_each_ticket=True,
+    ticket_summary_window=timedelta(minutes=1),
+    done_folder_sharding=True,
+    watch_mode=WatchMode.native,
+    poll_interval=timedelta(seconds=5),
+    poll_full_rescan_interval=timedelta(hours=1),
+    poll_prune_folders=[],
+    ai_model="gemini-2.5-flash-lite",
+    metrics_file=None,
+    metrics_port=0,
+    job_queue=False,
+    job_queue_path=None,
+    job_queue_workers=2,
+    job_visibility_timeout=timedelta(minutes=15),
+    job_max_attempts=5,
+    tenant=[],
 )
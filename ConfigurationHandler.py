@@ -1,17 +1,30 @@
 import copy
+from dataclasses import fields
+import threading
 import tomllib
-from typing import Self, cast
+from typing import Any, Callable, Self, cast
 
 from Logger import LogLevel, log
 from common import CONFIGURATION_FOLDER
 from Configuration import Configuration, ConfigurationDict, DEFAULT_CONFIG
 
+# Called with the old configuration, the new one and the names of the keys that changed
+ConfigurationSubscriber = Callable[[Configuration, Configuration, set[str]], None]
+
 
 class _ConfigurationHandler:
     _config_fp = CONFIGURATION_FOLDER / "config.toml"
 
+    # Editors tend to write a file in several steps. Changes are only picked up once the file has been quiet for this long
+    _reload_delay = 0.1  # seconds
+
     def __init__(self: Self) -> None:
         self.config = self._load()
+        self._subscribers: list[ConfigurationSubscriber] = []
+        self._reload_lock = threading.Lock()
+        self._reload_timer: threading.Timer | None = None
+        self._swap_lock = threading.Lock()
+        self._observer: Any = None
 
     def _load(self: Self) -> Configuration:
         if not self._config_fp.is_file():
@@ -20,9 +33,7 @@ class _ConfigurationHandler:
             return self._get_default_config()
 
         try:
-            with open(self._config_fp, "r") as config_toml:
-                return Configuration.from_config_dict(
-                    cast(ConfigurationDict, tomllib.loads(config_toml.read())))
+            return self._parse()
         except tomllib.TOMLDecodeError as error:
             log(LogLevel.Warning, DEFAULT_CONFIG,
                 f"{self._config_fp} corrupted; Failure to parse it: {error}")
@@ -36,9 +47,102 @@ class _ConfigurationHandler:
         log(LogLevel.Status, DEFAULT_CONFIG, "Using default configuration.")
         return self._get_default_config()
 
+    def _parse(self: Self) -> Configuration:
+        with open(self._config_fp, "r") as config_toml:
+            return Configuration.from_config_dict(
+                cast(ConfigurationDict, tomllib.loads(config_toml.read())))
+
+    def subscribe(self: Self, subscriber: ConfigurationSubscriber) -> None:
+        self._subscribers.append(subscriber)
+
+    # Reloads the configuration whenever config.toml changes
+    def watch(self: Self) -> None:
+        from watchdog.events import FileSystemEvent, FileSystemEventHandler
+        from watchdog.observers import Observer
+
+        config_handler = self
+
+        class ConfigFileEventHandler(FileSystemEventHandler):
+            def on_any_event(self, event: FileSystemEvent) -> None:
+                paths = [event.src_path, getattr(event, "dest_path", "")]
+                if event.event_type in ["created", "modified", "moved"] and str(config_handler._config_fp) in paths:
+                    config_handler._schedule_reload()
+
+        self._observer = Observer()
+        self._observer.schedule(ConfigFileEventHandler(), str(
+            self._config_fp.parent), recursive=False)
+        try:
+            self._observer.start()
+        except FileNotFoundError:
+            log(LogLevel.Warning, self.config,
+                f"'{self._config_fp.parent}' doesn't exist. Changes to {self._config_fp.name} need a restart to take effect")
+            self._observer = None
+
+    def stop_watching(self: Self) -> None:
+        if self._observer is not None:
+            self._observer.stop()
+
+    def _schedule_reload(self: Self) -> None:
+        with self._reload_lock:
+            if self._reload_timer is not None:
+                self._reload_timer.cancel()
+            self._reload_timer = threading.Timer(
+                self._reload_delay, self.reload)
+            self._reload_timer.daemon = True
+            self._reload_timer.start()
+
+    # Swaps in the configuration from config.toml. The current configuration is kept if config.toml can't be parsed
+    def reload(self: Self) -> bool:
+        with self._swap_lock:
+            return self._reload()
+
+    def _reload(self: Self) -> bool:
+        try:
+            new_config = self._parse()
+        except FileNotFoundError:
+            log(LogLevel.Warning, self.config,
+                f"{self._config_fp} was removed. Keeping the current configuration")
+            return False
+        except Exception as error:
+            log(LogLevel.Warning, self.config,
+                f"Failure to reload {self._config_fp}: {error}. Keeping the current configuration")
+            return False
+
+        old_config, self.config = self.config, new_config
+
+        changed = {field.name for field in fields(Configuration) if getattr(
+            old_config, field.name) != getattr(new_config, field.name)}
+        if not changed:
+            return True
+
+        log(LogLevel.Status, new_config,
+            f"Reloaded configuration. Changed: {", ".join(sorted(changed))}")
+        for subscriber in self._subscribers:
+            try:
+                subscriber(old_config, new_config, changed)
+            except Exception as error:
+                log(LogLevel.Warning, new_config,
+                    f"Failure to apply the new configuration: {error}")
+        return True
+
     @staticmethod
     def _get_default_config() -> Configuration:
         return copy.deepcopy(DEFAULT_CONFIG)
 
 
-handler = _ConfigurationHandler()
+_handler: _ConfigurationHandler | None = None
+
+
+# config.toml is read the first time the handler is asked for rather than as soon as this module is imported
+def get_handler() -> _ConfigurationHandler:
+    global _handler
+
+    if _handler is None:
+        _handler = _ConfigurationHandler()
+    return _handler
+
+
+def __getattr__(name: str) -> _ConfigurationHandler:
+    if name == "handler":
+        return get_handler()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
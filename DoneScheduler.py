@@ -0,0 +1,154 @@
+from dataclasses import asdict, dataclass
+from datetime import datetime
+import heapq
+import json
+import os
+from pathlib import Path
+import threading
+from typing import Self
+
+from Configuration import Configuration
+from Logger import LogLevel, log
+from common import file_lock, notify
+
+
+@dataclass(slots=True)
+class _Journey:
+    arrival: float  # Timestamp
+    ticket_fp: str
+    from_where: str
+    to_where: str
+    done_folder: str | None = None  # None for journeys scheduled before tenants had their own done folders
+
+
+# Moves a ticket to done_folder as soon as its journey ends. Arrival times are kept in a heap and the thread sleeps till the earliest
+# one, so no folder is rescanned and no Google API is called to find out which journeys have ended
+# The schedule is saved in the cache folder so that journeys ending while the program isn't running are marked as done on the next start
+# A single scheduler serves every tenant. Each journey remembers the done folder its ticket goes to
+class DoneScheduler(threading.Thread):
+    _schedule_name = "done_schedule.json"
+
+    # Upper bound on a single sleep so that a suspended machine or a changed clock doesn't delay marking by much
+    _max_wait = 300  # seconds
+
+    def __init__(self: Self, config: Configuration) -> None:
+        super().__init__(name="done-scheduler", daemon=True)
+        self.config = config
+        self._condition = threading.Condition()
+        self._stopped = False
+
+        # Ticket path -> its journey. The heap may hold outdated entries for rescheduled tickets which are skipped when popped
+        self._journeys: dict[str, _Journey] = {}
+        self._heap: list[tuple[float, str]] = []
+
+        for journey in self._read_schedule(config):
+            self._journeys[journey.ticket_fp] = journey
+            self._heap.append((journey.arrival, journey.ticket_fp))
+        heapq.heapify(self._heap)
+
+    def schedule(self: Self, ticket_fp: Path, arrival: datetime, from_where: str, to_where: str, done_folder: Path) -> None:
+        journey = _Journey(arrival.timestamp(), str(
+            ticket_fp), from_where, to_where, str(done_folder))
+
+        with self._condition:
+            if self._journeys.get(journey.ticket_fp) == journey:
+                return
+            self._journeys[journey.ticket_fp] = journey
+            heapq.heappush(self._heap, (journey.arrival, journey.ticket_fp))
+            self._update_schedule([journey], [])
+            self._condition.notify()
+
+    def run(self: Self) -> None:
+        while True:
+            with self._condition:
+                due = self._pop_due()
+                if not due:
+                    timeout = self._max_wait if not self._heap else min(
+                        self._max_wait, max(0, self._heap[0][0] - datetime.now().timestamp()))
+                    self._condition.wait(timeout)
+                if self._stopped:
+                    return
+                if due:
+                    due = self._update_schedule([], due)
+
+            for journey in due:
+                if self.mark_as_done(Path(journey.ticket_fp), datetime.fromtimestamp(journey.arrival), self.config.done_folder if journey.done_folder is None else Path(
+                        journey.done_folder), self.config):
+                    notify("Journey marked as Done!",
+                           f"Hope your journey from {journey.from_where} to {journey.to_where} was successful :)", self.config)
+
+    def stop(self: Self) -> None:
+        with self._condition:
+            self._stopped = True
+            self._condition.notify()
+
+    # With done_folder_sharding the ticket goes in a folder for the year and month the journey ended in, like done/2026/01/, so
+    # that no single folder grows with years of tickets
+    # Returns whether the ticket was moved
+    @staticmethod
+    def mark_as_done(ticket_fp: Path, arrival: datetime, done_folder: Path, config: Configuration) -> bool:
+        if not ticket_fp.is_file():
+            return False  # Already moved or deleted by the user
+
+        if config.done_folder_sharding:
+            done_folder = done_folder / f"{arrival:%Y}" / f"{arrival:%m}"
+
+        try:
+            done_folder.mkdir(parents=True, exist_ok=True)
+            ticket_fp.rename(done_folder / ticket_fp.name)
+            return True
+        except Exception as error:
+            log(LogLevel.Warning, config,
+                f"Error marking {ticket_fp} as done: {error}")
+            return False
+
+    # Must be called with self._condition held
+    def _pop_due(self: Self) -> list[_Journey]:
+        now = datetime.now().timestamp()
+        due = []
+        while self._heap and self._heap[0][0] <= now:
+            arrival, ticket_fp = heapq.heappop(self._heap)
+            journey = self._journeys.get(ticket_fp)
+            if journey is not None and journey.arrival == arrival:
+                due.append(self._journeys.pop(ticket_fp))
+        return due
+
+    # Adds journeys to the saved schedule and takes the ended ones out of it. Returns the ended journeys that were still in it
+    # Job queue workers each have a scheduler of their own sharing the file, so it's changed under a lock and a journey is only
+    # marked as done by whichever scheduler takes it out first
+    # Must be called with self._condition held
+    def _update_schedule(self: Self, added: list[_Journey], ended: list[_Journey]) -> list[_Journey]:
+        schedule_fp = self.config.cache_folder / self._schedule_name
+        try:
+            with file_lock(schedule_fp.with_name(f"{schedule_fp.name}.lock")):
+                journeys = {journey.ticket_fp: journey for journey in self._read_schedule(
+                    self.config)}
+                claimed = [journey for journey in ended if journeys.get(
+                    journey.ticket_fp) == journey]
+                for journey in claimed:
+                    del journeys[journey.ticket_fp]
+                for journey in added:
+                    journeys[journey.ticket_fp] = journey
+
+                temp_fp = schedule_fp.with_name(
+                    f".{schedule_fp.name}.{os.getpid()}.tmp")
+                temp_fp.write_text(json.dumps(
+                    [asdict(journey) for journey in journeys.values()]))
+                os.replace(temp_fp, schedule_fp)
+                return claimed
+        except Exception as error:
+            log(LogLevel.Warning, self.config,
+                f"Failure to save the schedule of journeys to {schedule_fp}: {error}")
+            return ended
+
+    @staticmethod
+    def _read_schedule(config: Configuration) -> list[_Journey]:
+        schedule_fp = config.cache_folder / DoneScheduler._schedule_name
+        try:
+            return [_Journey(**journey) for journey in json.loads(schedule_fp.read_text())]
+        except FileNotFoundError:
+            return []
+        except Exception as error:
+            log(LogLevel.Warning, config,
+                f"Failure to read the schedule of journeys from {schedule_fp}: {error}")
+            return []
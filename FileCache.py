@@ -1,52 +1,298 @@
+from collections import OrderedDict
+from collections.abc import Iterator
+from contextlib import contextmanager
+from dataclasses import dataclass, replace
 from datetime import datetime
+import gzip
+import hashlib
+import os
 from pathlib import Path
+import threading
+import time
 from typing import Callable, Generic, Self, TypeVar
+import zlib
 
-from Configuration import Configuration
+from Configuration import CacheNamespace, Configuration
 from Logger import LogLevel, log
+from Metrics import metrics
+from common import CacheCompression, file_lock
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
 
 T = TypeVar("T")
 
 
+@dataclass(slots=True)
+class CacheStats:
+    memory_hits: int = 0
+    disk_hits: int = 0
+    misses: int = 0
+    evictions: int = 0
+
+
+# Two tiers: a size bounded in-memory LRU per namespace in front of the cache files
+# Each namespace has its own folder inside the cache folder and its own refresh time and size budgets (see CacheNamespace)
 class FileCache(Generic[T]):
-    def __init__(self: Self, code: str, to_update: Callable[[Configuration], T], to_store: Callable[[T], str], to_parse: Callable[[str], T], config: Configuration) -> None:
+    # namespace -> code -> (time the entry was written, stored entry)
+    _memory: dict[str, OrderedDict[str, tuple[datetime, str]]] = {}
+    _stats: dict[str, CacheStats] = {}
+    # (namespace, code) -> (its lock, number of threads holding or waiting on it). Removed once the last of them is done
+    _key_locks: dict[tuple[str, str], tuple[threading.Lock, int]] = {}
+    _lock = threading.RLock()
+
+    # First line of every cache file
+    _checksum_prefix = "crc32:"
+
+    # Other processes are kept out with a lock file per shard folder instead of one per entry, so they don't pile up. Missing
+    # entries which share a shard (one in 256) are computed one after the other
+    _lock_name = ".lock"
+
+    def __init__(self: Self, namespace: str, code: str, to_update: Callable[[Configuration], T], to_store: Callable[[T], str], to_parse: Callable[[str], T], config: Configuration) -> None:
         log(LogLevel.Status, config,
-            f"\t\tChecking for cache with code: {code}")
+            f"\t\tChecking for cache with code: {code} in {namespace}")
 
         self._to_update = to_update
         self._to_store = to_store
         self._to_parse = to_parse
         self._code = code
+        self._namespace = config.get_cache_namespace(namespace)
+        self._compression = self._usable_compression(self._namespace, config)
 
-        if self.is_cache_available(config):
-            log(LogLevel.Status, config,
-                f"\t\t\tCache available for code: {self._code}; retrieving cache.")
-            self.data = self.retrieve(config)
-        else:
-            log(LogLevel.Status, config,
-                f"\t\t\tNo cache available for code: {self._code}.")
-            self.data = self.update(config)
+        stored = self._from_memory()
+        if stored is None:
+            stored = self._from_disk(config)
+
+        if stored is None:
+            # Only one caller computes a missing entry. Everyone else waiting on the lock finds it in the cache afterwards
+            with self._locked(config):
+                stored = self._from_memory()
+                if stored is None:
+                    stored = self._from_disk(config)
+
+                if stored is None:
+                    log(LogLevel.Status, config,
+                        f"\t\t\tNo cache available for code: {self._code}.")
+                    self._count("misses")
+                    self.data = self._update(config)
+                    return
+
+        log(LogLevel.Status, config,
+            f"\t\t\tCache available for code: {self._code}; retrieving cache.")
+        self.data = self.retrieve(stored, config)
+
+    # The cached entry for code, or None when there's no up to date one. Unlike creating a FileCache, nothing is computed on a miss
+    # For callers which compute entries in ways to_update can't, like awaiting a coroutine
+    @classmethod
+    def lookup(cls: type[Self], namespace: str, code: str, to_parse: Callable[[str], T], config: Configuration) -> T | None:
+        cache = cls.__new__(cls)
+        cache._to_parse = to_parse
+        cache._code = code
+        cache._namespace = config.get_cache_namespace(namespace)
+        cache._compression = cls._usable_compression(cache._namespace, config)
+
+        stored = cache._from_memory()
+        if stored is None:
+            stored = cache._from_disk(config)
+        if stored is None:
+            return None
+
+        try:
+            return to_parse(stored)
+        except Exception as error:
+            log(LogLevel.Warning, config,
+                f"Error retrieving file from cache for code {code}: {error}")
+            return None
 
     def update(self: Self, config: Configuration) -> T:
+        with self._locked(config):
+            return self._update(config)
+
+    def _update(self: Self, config: Configuration) -> T:
         data = self._to_update(config)
-        self._get_cache_fp(self._code, config).parent.mkdir(
-            parents=True, exist_ok=True)
-        with open(self._get_cache_fp(self._code, config), "w") as cache_file:
-            cache_file.write(self._to_store(data))
+        stored = self._to_store(data)
+
+        # Written to a temporary file first and then renamed over the entry so a crash never leaves a truncated entry behind
+        cache_fp = self._get_cache_fp(
+            self._namespace.name, self._code, self._compression, config)
+        cache_fp.parent.mkdir(parents=True, exist_ok=True)
+        temp_fp = cache_fp.with_name(f".{cache_fp.name}.{os.getpid()}.tmp")
+        try:
+            with open(temp_fp, "wb") as cache_file:
+                cache_file.write(self._compress(
+                    f"{self._checksum_prefix}{self._checksum(stored)}\n{stored}".encode(), self._compression))
+                cache_file.flush()
+                os.fsync(cache_file.fileno())
+            os.replace(temp_fp, cache_fp)
+        finally:
+            temp_fp.unlink(missing_ok=True)
+
+        self._to_memory(datetime.now(), stored)
         return data
 
-    def retrieve(self: Self, config: Configuration) -> T:
+    @contextmanager
+    def _locked(self: Self, config: Configuration) -> Iterator[None]:
+        key = (self._namespace.name, self._code)
+        with self._lock:
+            key_lock, users = self._key_locks.get(key, (None, 0))
+            if key_lock is None:
+                key_lock = threading.Lock()
+            self._key_locks[key] = (key_lock, users + 1)
+
+        # The thread lock keeps threads of this process off the lock file
+        try:
+            with key_lock, file_lock(self._get_cache_fp(*key, self._compression, config).with_name(self._lock_name)):
+                yield
+        finally:
+            with self._lock:
+                key_lock, users = self._key_locks[key]
+                if users == 1:
+                    del self._key_locks[key]
+                else:
+                    self._key_locks[key] = (key_lock, users - 1)
+
+    def retrieve(self: Self, stored: str, config: Configuration) -> T:
         try:
-            with open(self._get_cache_fp(self._code, config), "r") as cache_file:
-                return self._to_parse(cache_file.read())
+            return self._to_parse(stored)
         except Exception as error:
             log(LogLevel.Warning, config,
                 f"Error retrieving file from cache for code {self._code}: {error}")
             return self.update(config)
 
-    def is_cache_available(self: Self, config: Configuration) -> bool:
-        return self._get_cache_fp(self._code, config).is_file() and (datetime.now() - datetime.fromtimestamp(self._get_cache_fp(self._code, config).stat().st_mtime)) < config.cache_data_refresh_time
+    def _from_memory(self: Self) -> str | None:
+        with self._lock:
+            entries = self._memory.get(self._namespace.name)
+            if entries is None or self._code not in entries:
+                return None
+
+            written_at, stored = entries[self._code]
+            if not self._is_fresh(written_at):
+                del entries[self._code]
+                return None
+
+            entries.move_to_end(self._code)
+            self._count("memory_hits")
+            return stored
+
+    # An entry written before its namespace's compression was changed is still read with the compression it was written with
+    # Once it's outdated it's written again with the new one
+    def _from_disk(self: Self, config: Configuration) -> str | None:
+        for compression in [self._compression] + [compression for compression in _SUFFIXES if compression != self._compression and (
+                compression != CacheCompression.zstd or zstandard is not None)]:
+            cache_fp = self._get_cache_fp(
+                self._namespace.name, self._code, compression, config)
+            try:
+                stat = cache_fp.stat()
+                break
+            except FileNotFoundError:
+                continue
+            except Exception as error:
+                log(LogLevel.Warning, config,
+                    f"Error reading cache file for code {self._code}: {error}")
+                return None
+        else:
+            return None
+
+        try:
+            written_at = datetime.fromtimestamp(stat.st_mtime)
+            if not self._is_fresh(written_at):
+                return None
+
+            with open(cache_fp, "rb") as cache_file:
+                stored = self._decompress(
+                    cache_file.read(), compression).decode()
+
+            # The sweeper evicts the least recently accessed entries first. Not every filesystem keeps access times up to date
+            os.utime(cache_fp, (time.time(), stat.st_mtime))
+        except FileNotFoundError:
+            return None
+        except Exception as error:
+            log(LogLevel.Warning, config,
+                f"Error reading cache file for code {self._code}: {error}")
+            return None
+
+        # Entries written before checksums were added don't have one and are taken as they are
+        if stored.startswith(self._checksum_prefix):
+            header, _, stored = stored.partition("\n")
+            if header != f"{self._checksum_prefix}{self._checksum(stored)}":
+                log(LogLevel.Warning, config,
+                    f"Cache file for code {self._code} is corrupted; Ignoring it")
+                return None
+
+        self._count("disk_hits")
+        self._to_memory(written_at, stored)
+        return stored
+
+    def _to_memory(self: Self, written_at: datetime, stored: str) -> None:
+        if self._namespace.memory_entries <= 0:
+            return
+
+        with self._lock:
+            entries = self._memory.setdefault(
+                self._namespace.name, OrderedDict())
+            entries[self._code] = (written_at, stored)
+            entries.move_to_end(self._code)
+
+            while len(entries) > self._namespace.memory_entries:
+                entries.popitem(last=False)
+                self._count("evictions")
+
+    @staticmethod
+    def _usable_compression(namespace: CacheNamespace, config: Configuration) -> CacheCompression:
+        if namespace.compression == CacheCompression.zstd and zstandard is None:
+            log(LogLevel.Warning, config,
+                f"zstd compression for cache '{namespace.name}' needs the zstandard package. Using gzip instead")
+            return CacheCompression.gzip
+        return namespace.compression
 
     @staticmethod
-    def _get_cache_fp(code: str, config: Configuration) -> Path:
-        return config.cache_folder / f"{code}.txt"
+    def _compress(data: bytes, compression: CacheCompression) -> bytes:
+        match compression:
+            case CacheCompression.gzip:
+                return gzip.compress(data)
+            case CacheCompression.zstd:
+                return zstandard.ZstdCompressor().compress(data)
+        return data
+
+    @staticmethod
+    def _decompress(data: bytes, compression: CacheCompression) -> bytes:
+        match compression:
+            case CacheCompression.gzip:
+                return gzip.decompress(data)
+            case CacheCompression.zstd:
+                return zstandard.ZstdDecompressor().decompress(data)
+        return data
+
+    @staticmethod
+    def _checksum(stored: str) -> str:
+        return f"{zlib.crc32(stored.encode()):08x}"
+
+    def _is_fresh(self: Self, written_at: datetime) -> bool:
+        return self._namespace.refresh_time is None or datetime.now() - written_at < self._namespace.refresh_time
+
+    def _count(self: Self, counter: str) -> None:
+        with self._lock:
+            stats = self._stats.setdefault(
+                self._namespace.name, CacheStats())
+            setattr(stats, counter, getattr(stats, counter) + 1)
+        metrics.count("cache_events", namespace=self._namespace.name, event=counter)
+
+    @classmethod
+    def stats(cls: type[Self]) -> dict[str, CacheStats]:
+        with cls._lock:
+            return {name: replace(stats) for name, stats in cls._stats.items()}
+
+    # Entries are spread over subfolders by a prefix of the hash of their code so that no single folder grows too large
+    @staticmethod
+    def _get_cache_fp(namespace: str, code: str, compression: CacheCompression, config: Configuration) -> Path:
+        shard = hashlib.sha1(code.encode()).hexdigest()[:2]
+        return config.cache_folder / namespace / shard / f"{code}{_SUFFIXES[compression]}"
+
+
+_SUFFIXES = {
+    CacheCompression.none: ".txt",
+    CacheCompression.gzip: ".txt.gz",
+    CacheCompression.zstd: ".txt.zst",
+}
@@ -0,0 +1,130 @@
+import os
+from pathlib import Path
+from typing import Self
+
+from watchdog.events import DirCreatedEvent, DirDeletedEvent, DirMovedEvent, FileCreatedEvent, FileSystemEventHandler
+from watchdog.observers.api import BaseObserver, ObservedWatch
+
+from Configuration import Configuration
+from Logger import LogLevel, log
+from TicketFolderHandler import TicketFolderHandler
+
+
+# The watches on the ticket folder of a handler. When done_folder is inside the ticket folder it's left out of them entirely, so that
+# archiving a ticket makes no events and years of archived tickets don't add to what's watched
+# The folders on the way from the ticket folder to done_folder are watched without their subfolders and every other subfolder of
+# theirs is watched as a whole. Subfolders that turn up in them later get watched as they do
+# An observer which leaves done_folder out by itself, like ScandirObserver, gets a single watch over the whole ticket folder
+class FolderWatch(FileSystemEventHandler):
+    def __init__(self: Self, observer: BaseObserver, handler: TicketFolderHandler, prunes_done_folder: bool) -> None:
+        self._observer = observer
+        self._handler = handler
+        self._prunes_done_folder = prunes_done_folder
+        self.ticket_folder = handler.config.ticket_folder
+        self._done_folder = handler.config.done_folder
+        self._watches: dict[str, ObservedWatch] = {}  # Folder -> its watch
+
+    # Raises OSError if the ticket folder can't be watched while the observer is running. Otherwise the observer raises it on start
+    def schedule(self: Self) -> None:
+        ticket_folder = os.path.abspath(self.ticket_folder)
+        done_folder = os.path.abspath(self._done_folder)
+
+        if self._prunes_done_folder or done_folder == ticket_folder or not Path(done_folder).is_relative_to(ticket_folder):
+            self._add(ticket_folder, True)
+            return
+
+        try:
+            self._watch(ticket_folder)
+        except OSError:
+            self.unschedule()
+            self._add(ticket_folder, True)
+
+    def unschedule(self: Self) -> None:
+        for watch in self._watches.values():
+            try:
+                self._observer.unschedule(watch)
+            except KeyError:
+                pass  # Already gone along with its folder
+        self._watches.clear()
+
+    # Watches the ticket folder again if it or done_folder changed. If the new ticket folder can't be watched the old one still is
+    def update(self: Self, config: Configuration) -> None:
+        previous = (self.ticket_folder, self._done_folder)
+        if (config.ticket_folder, config.done_folder) == previous:
+            return
+
+        self.unschedule()
+        self.ticket_folder, self._done_folder = config.ticket_folder, config.done_folder
+        try:
+            self.schedule()
+            log(LogLevel.Status, config, f"Watching '{self.ticket_folder}'")
+        except OSError as error:
+            log(LogLevel.Error, config,
+                f"'{self.ticket_folder}' cannot be monitored {error}. Still watching '{previous[0]}'")
+            self.unschedule()
+            self.ticket_folder, self._done_folder = previous
+            self.schedule()
+
+    def on_created(self: Self, event: DirCreatedEvent) -> None:
+        if event.is_directory:
+            self._subfolder_added(os.fsdecode(event.src_path))
+
+    def on_deleted(self: Self, event: DirDeletedEvent) -> None:
+        if event.is_directory:
+            self._subfolder_removed(os.fsdecode(event.src_path))
+
+    def on_moved(self: Self, event: DirMovedEvent) -> None:
+        if event.is_directory:
+            self._subfolder_removed(os.fsdecode(event.src_path))
+            if os.path.dirname(os.fsdecode(event.dest_path)) in self._watches:
+                self._subfolder_added(os.fsdecode(event.dest_path))
+
+    def _watch(self: Self, folder: str) -> None:
+        done_folder = os.path.abspath(self._done_folder)
+        if folder == done_folder:
+            return
+
+        if not Path(done_folder).is_relative_to(folder):
+            self._add(folder, True)
+            return
+
+        self._add(folder, False)
+        with os.scandir(folder) as entries:
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=False):
+                    self._watch(entry.path)
+
+    def _add(self: Self, folder: str, recursive: bool) -> None:
+        watch = self._observer.schedule(
+            self._handler, folder, recursive=recursive)
+        if not recursive:
+            self._observer.add_handler_for_watch(self, watch)
+        self._watches[folder] = watch
+
+    # A folder moved in may already hold tickets, which no watch has seen. They're handed to the handler like new ones
+    # A ticket written right as its folder is created may be handed over twice. The second time it's found in the calendar
+    def _subfolder_added(self: Self, folder: str) -> None:
+        folder = os.path.abspath(folder)
+        done_folder = os.path.abspath(self._done_folder)
+        if folder == done_folder or folder in self._watches:
+            return
+
+        try:
+            self._watch(folder)
+        except OSError:
+            return  # Gone again already
+
+        for root, folders, files in os.walk(folder):
+            folders[:] = [name for name in folders if os.path.join(
+                root, name) != done_folder]
+            for name in files:
+                self._handler.dispatch(
+                    FileCreatedEvent(os.path.join(root, name)))
+
+    def _subfolder_removed(self: Self, folder: str) -> None:
+        folder = os.path.abspath(folder)
+        for watched in [watched for watched in self._watches if watched == folder or watched.startswith(folder + os.sep)]:
+            try:
+                self._observer.unschedule(self._watches.pop(watched))
+            except KeyError:
+                pass
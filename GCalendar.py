@@ -1,3 +1,4 @@
+import asyncio
 from typing import Callable, Self
 from datetime import datetime
 
@@ -17,6 +18,18 @@ class GCalendar(GService):
         log(LogLevel.Status, config, "Done initializing Google Calendar API")
 
     def insert_event(self: Self, ttc_id: str, summary: str, location: str, description: str, ticket_upload: FileUploadResponse | None, start: datetime, end: datetime, color: CalendarEventColor, config: Configuration) -> str:
+        return self._perform_gapi_call(self._insert_event_request(ttc_id, summary, location, description, ticket_upload, start, end, color, config), config)["htmlLink"]
+
+    async def insert_event_async(self: Self, ttc_id: str, summary: str, location: str, description: str, ticket_upload: FileUploadResponse | None, start: datetime, end: datetime, color: CalendarEventColor, config: Configuration, limit: asyncio.Semaphore) -> str:
+        return (await self._perform_gapi_call_async(self._insert_event_request(ttc_id, summary, location, description, ticket_upload, start, end, color, config), config, limit))["htmlLink"]
+
+    def event_exists(self: Self, ttc_id: str, config: Configuration) -> str | None:
+        return self._first_event_link(self._perform_gapi_call(self._event_exists_request(ttc_id, config), config))
+
+    async def event_exists_async(self: Self, ttc_id: str, config: Configuration, limit: asyncio.Semaphore) -> str | None:
+        return self._first_event_link(await self._perform_gapi_call_async(self._event_exists_request(ttc_id, config), config, limit))
+
+    def _insert_event_request(self: Self, ttc_id: str, summary: str, location: str, description: str, ticket_upload: FileUploadResponse | None, start: datetime, end: datetime, color: CalendarEventColor, config: Configuration) -> Callable[[], dict]:
         event_data = {
             "summary": summary,
             "location": location,
@@ -49,26 +62,22 @@ class GCalendar(GService):
                 ticket_upload.gcalendar_format
             ]
 
-        return self._perform_gapi_call(
-            lambda: self._service.events()
-            .insert(
-                calendarId=config.calendar_id,
-                body=event_data,
-                supportsAttachments=ticket_upload is not None
-            )
-            .execute(), config
-        )["htmlLink"]
+        return lambda: self._service.events().insert(
+            calendarId=config.calendar_id,
+            body=event_data,
+            supportsAttachments=ticket_upload is not None
+        ).execute()
 
-    def event_exists(self: Self, ttc_id: str, config: Configuration) -> str | None:
-        found_events = self._perform_gapi_call(
-            lambda: self._service.events()
-            .list(
-                calendarId=config.calendar_id,
-                privateExtendedProperty=f"ttc_id={ttc_id}",
-                singleEvents=True
-            )
-            .execute(), config
-        )["items"]
+    def _event_exists_request(self: Self, ttc_id: str, config: Configuration) -> Callable[[], dict]:
+        return lambda: self._service.events().list(
+            calendarId=config.calendar_id,
+            privateExtendedProperty=f"ttc_id={ttc_id}",
+            singleEvents=True
+        ).execute()
+
+    @staticmethod
+    def _first_event_link(response: dict) -> str | None:
+        found_events = response["items"]
 
         if len(found_events) > 0:
             return found_events[0]["htmlLink"]
@@ -1,3 +1,4 @@
+import asyncio
 from dataclasses import dataclass
 from pathlib import Path
 from typing import Callable, Self
@@ -35,20 +36,25 @@ class GDrive(GService):
 
     def upload_pdf(self: Self, path: Path, config: Configuration) -> FileUploadResponse | None:
         try:
-            return FileUploadResponse(
-                **self._perform_gapi_call(
-                    lambda: self._service.files().create(
-                        body={
-                            "name": path.name
-                        },
-                        media_body=MediaFileUpload(
-                            path,
-                            mimetype="application/pdf",
-                            resumable=True
-                        ),
-                        fields="id,name,webViewLink,mimeType"
-                    ).execute(), config
-                )
-            )
+            return FileUploadResponse(**self._perform_gapi_call(self._upload_pdf_request(path), config))
         except:
             return None
+
+    async def upload_pdf_async(self: Self, path: Path, config: Configuration, limit: asyncio.Semaphore) -> FileUploadResponse | None:
+        try:
+            return FileUploadResponse(**await self._perform_gapi_call_async(self._upload_pdf_request(path), config, limit))
+        except:
+            return None
+
+    def _upload_pdf_request(self: Self, path: Path) -> Callable[[], dict]:
+        return lambda: self._service.files().create(
+            body={
+                "name": path.name
+            },
+            media_body=MediaFileUpload(
+                path,
+                mimetype="application/pdf",
+                resumable=True
+            ),
+            fields="id,name,webViewLink,mimeType"
+        ).execute()
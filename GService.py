@@ -1,4 +1,6 @@
+import asyncio
 from pathlib import Path
+import threading
 import time
 from typing import Any, TypeVar, Self, Callable
 from datetime import datetime
@@ -13,6 +15,7 @@ from google.auth import external_account_authorized_user
 
 from Configuration import Configuration
 from Logger import LogLevel, log
+from Metrics import metrics
 from common import calculate_backoff
 
 
@@ -20,9 +23,25 @@ class GService:
     def __init__(self: Self, api_name: str, api_version: str, credentials: Credentials | external_account_authorized_user.Credentials, refresh_credentials: Callable[[Configuration], None], config: Configuration) -> None:
         self._api_name = api_name
         self._api_version = api_version
-        self._service = self._build_service(credentials, config)
         self._refresh_credentials = refresh_credentials
 
+        # The HTTP client underneath a service object can't be shared between threads, so every thread making calls builds its own
+        # Bumping the generation makes each thread rebuild its service object the next time it's used
+        self._credentials = credentials
+        self._config = config
+        self._generation = 0
+        self._local = threading.local()
+        self._local.service = self._build_service(credentials, config)
+        self._local.generation = self._generation
+
+    @property
+    def _service(self: Self) -> Any:
+        if getattr(self._local, "generation", None) != self._generation:
+            self._local.service = self._build_service(
+                self._credentials, self._config)
+            self._local.generation = self._generation
+        return self._local.service
+
     def _build_service(self: Self, credentials: Credentials | external_account_authorized_user.Credentials, config: Configuration,) -> Any:
         try:
             return build(self._api_name, self._api_version, credentials=credentials)
@@ -32,7 +51,9 @@ class GService:
             sys.exit(-1)
 
     def rebuild(self: Self, credentials: Credentials | external_account_authorized_user.Credentials, config: Configuration) -> None:
-        self._service = self._build_service(credentials, config)
+        self._credentials = credentials
+        self._config = config
+        self._generation += 1
 
     @staticmethod
     def _ensure_tz_aware(dt: datetime) -> datetime:
@@ -67,17 +88,37 @@ class GService:
     def _perform_gapi_call(self: Self, fn: Callable[[], T], config: Configuration) -> T:
         for attempt in range(config.max_retries_for_network_requests):
             try:
-                return fn()
-            except HttpError as error:
-                self._handle_http_error(error)
-            except ServerNotFoundError as error:
-                self._handle_server_not_found_error(error)
-            except RefreshError as error:
-                self._handle_refresh_error(error, config)
+                with metrics.span("gapi_call", api=self._api_name):
+                    return fn()
             except Exception as error:
-                self._handle_event_error(error)
-            log(LogLevel.Status, config,
-                f"Retrying Google API call in {calculate_backoff(attempt)} seconds")
+                self._handle_gapi_error(error, attempt, config)
             time.sleep(calculate_backoff(attempt))
 
         raise Exception
+
+    # The client library only makes blocking calls, so each call runs on a worker thread of the event loop while the backoff between
+    # retries is awaited. limit bounds the number of calls in flight
+    async def _perform_gapi_call_async(self: Self, fn: Callable[[], T], config: Configuration, limit: asyncio.Semaphore) -> T:
+        for attempt in range(config.max_retries_for_network_requests):
+            try:
+                async with limit:
+                    with metrics.span("gapi_call", api=self._api_name):
+                        return await asyncio.to_thread(fn)
+            except Exception as error:
+                self._handle_gapi_error(error, attempt, config)
+            await asyncio.sleep(calculate_backoff(attempt))
+
+        raise Exception
+
+    def _handle_gapi_error(self: Self, error: Exception, attempt: int, config: Configuration) -> None:
+        if isinstance(error, HttpError):
+            self._handle_http_error(error)
+        elif isinstance(error, ServerNotFoundError):
+            self._handle_server_not_found_error(error)
+        elif isinstance(error, RefreshError):
+            self._handle_refresh_error(error, config)
+        else:
+            self._handle_event_error(error)
+        log(LogLevel.Status, config,
+            f"Retrying Google API call in {calculate_backoff(attempt)} seconds")
+        metrics.count("retries", service=self._api_name)
@@ -0,0 +1,166 @@
+from collections import Counter
+from dataclasses import dataclass
+from datetime import timedelta
+from pathlib import Path
+import sqlite3
+import threading
+import time
+from typing import Self
+
+from Configuration import Configuration
+from Logger import LogLevel, log
+from common import calculate_backoff
+
+
+@dataclass
+class Job:
+    id: int
+    ticket_fp: Path
+    tenant: str | None
+    attempts: int
+    leased_by: str  # The worker holding the lease
+
+
+# Tickets waiting to be processed, kept in SQLite so that they survive the program and can be worked on by any number of worker
+# processes. Those can be on other machines as long as they see the same job_queue_path, like on a shared folder
+#
+# A job is leased by one worker at a time. If the worker doesn't ack (or fail) it within job_visibility_timeout, say because it
+# died, the job becomes visible again for another worker to lease. A job which has been leased job_max_attempts times without
+# succeeding is moved to the dead letters where it stays till someone looks into it
+# A worker whose lease ran out and went to another worker can no longer extend, ack or fail the job
+class JobQueue:
+    _db_name = "jobs.sqlite3"
+
+    # Finished jobs are kept around this long for --queue-status before they're removed
+    _done_retention = timedelta(days=7)
+
+    def __init__(self: Self, config: Configuration) -> None:
+        self.config = config
+        self.db_fp = config.job_queue_path or config.cache_folder / self._db_name
+        self._lock = threading.Lock()
+
+        self.db_fp.parent.mkdir(parents=True, exist_ok=True)
+        # Transactions are managed by hand so that leasing can take the write lock before it reads
+        self._connection = sqlite3.connect(
+            self.db_fp, timeout=30, isolation_level=None, check_same_thread=False)
+        self._connection.executescript("""
+            CREATE TABLE IF NOT EXISTS jobs (
+                id INTEGER PRIMARY KEY,
+                ticket_fp TEXT NOT NULL,
+                tenant TEXT,
+                state TEXT NOT NULL,  -- queued, leased, done or dead
+                attempts INTEGER NOT NULL DEFAULT 0,
+                visible_at REAL NOT NULL,  -- When a queued job may be leased or a lease runs out
+                leased_by TEXT,
+                enqueued_at REAL NOT NULL,
+                updated_at REAL NOT NULL,
+                result TEXT
+            );
+            CREATE UNIQUE INDEX IF NOT EXISTS pending_jobs ON jobs (ticket_fp) WHERE state IN ('queued', 'leased');
+            CREATE INDEX IF NOT EXISTS visible_jobs ON jobs (state, visible_at);
+        """)
+        self._execute("DELETE FROM jobs WHERE state = 'done' AND updated_at < ?",
+                      (time.time() - self._done_retention.total_seconds(),))
+
+    # A ticket which is already waiting in the queue or being worked on isn't added again
+    def enqueue(self: Self, ticket_fp: Path, tenant: str | None = None) -> bool:
+        now = time.time()
+        added = self._execute("""
+            INSERT OR IGNORE INTO jobs (ticket_fp, tenant, state, visible_at, enqueued_at, updated_at) VALUES (?, ?, 'queued', ?, ?, ?)
+        """, (str(ticket_fp), tenant, now, now, now)).rowcount > 0
+
+        if added:
+            log(LogLevel.Status, self.config, f"Queued {ticket_fp}")
+        return added
+
+    # The job that has been waiting the longest, or None if there's nothing to do right now
+    def lease(self: Self, worker: str) -> Job | None:
+        with self._lock:
+            self._connection.execute("BEGIN IMMEDIATE")
+            try:
+                while True:
+                    now = time.time()
+                    row = self._connection.execute("""
+                        SELECT id, ticket_fp, tenant, attempts, state FROM jobs
+                        WHERE state IN ('queued', 'leased') AND visible_at <= ? ORDER BY visible_at LIMIT 1
+                    """, (now,)).fetchone()
+                    if row is None:
+                        self._connection.execute("COMMIT")
+                        return None
+
+                    job = Job(row[0], Path(row[1]), row[2], row[3] + 1, worker)
+                    if row[4] == "leased":
+                        log(LogLevel.Warning, self.config,
+                            f"Lease on {job.ticket_fp} ran out. Its worker may have died")
+
+                    if job.attempts > self.config.job_max_attempts:
+                        self._connection.execute("UPDATE jobs SET state = 'dead', updated_at = ?, result = coalesce(result, 'lease_expired') WHERE id = ?",
+                                                 (now, job.id))
+                        log(LogLevel.Error, self.config,
+                            f"Giving up on {job.ticket_fp} after {job.attempts - 1} attempts")
+                        continue
+
+                    self._connection.execute("""
+                        UPDATE jobs SET state = 'leased', attempts = ?, visible_at = ?, leased_by = ?, updated_at = ? WHERE id = ?
+                    """, (job.attempts, now + self.config.job_visibility_timeout.total_seconds(), worker, now, job.id))
+                    self._connection.execute("COMMIT")
+                    return job
+            except BaseException:
+                self._connection.execute("ROLLBACK")
+                raise
+
+    # Pushes out the end of the lease for jobs which take longer than job_visibility_timeout
+    # Returns False if the lease has been lost
+    def extend(self: Self, job: Job) -> bool:
+        now = time.time()
+        return self._update_leased(job, "visible_at = ?, updated_at = ?",
+                                   (now + self.config.job_visibility_timeout.total_seconds(), now))
+
+    def ack(self: Self, job: Job, result: str) -> None:
+        self._update_leased(job, "state = 'done', result = ?, updated_at = ?",
+                            (result, time.time()))
+
+    # The job is retried after a backoff unless it has run out of attempts, in which case it's dead lettered
+    def fail(self: Self, job: Job, result: str) -> None:
+        now = time.time()
+        if job.attempts >= self.config.job_max_attempts:
+            if self._update_leased(job, "state = 'dead', result = ?, updated_at = ?", (result, now)):
+                log(LogLevel.Error, self.config,
+                    f"Giving up on {job.ticket_fp} after {job.attempts} attempts: {result}")
+        else:
+            self._update_leased(job, "state = 'queued', result = ?, visible_at = ?, leased_by = NULL, updated_at = ?",
+                                (result, now + calculate_backoff(job.attempts), now))
+
+    # Number of jobs in each state
+    def depth(self: Self) -> dict[str, int]:
+        counts = Counter({"queued": 0, "leased": 0, "done": 0, "dead": 0})
+        counts.update(dict(self._execute(
+            "SELECT state, count(*) FROM jobs GROUP BY state").fetchall()))
+        return dict(counts)
+
+    def dead_letters(self: Self) -> list[dict]:
+        return [
+            {"ticket": ticket_fp, "tenant": tenant, "attempts": attempts, "result": result}
+            for ticket_fp, tenant, attempts, result in self._execute(
+                "SELECT ticket_fp, tenant, attempts, result FROM jobs WHERE state = 'dead' ORDER BY updated_at").fetchall()
+        ]
+
+    # Puts the dead letters back in the queue with their attempts reset. Returns how many there were
+    def retry_dead(self: Self) -> int:
+        now = time.time()
+        return self._execute("UPDATE OR IGNORE jobs SET state = 'queued', attempts = 0, visible_at = ?, updated_at = ? WHERE state = 'dead'",
+                             (now, now)).rowcount
+
+    # Updates the job only while job.leased_by still holds its lease
+    def _update_leased(self: Self, job: Job, assignments: str, parameters: tuple) -> bool:
+        if self._execute(f"UPDATE jobs SET {assignments} WHERE id = ? AND state = 'leased' AND leased_by = ?",
+                         (*parameters, job.id, job.leased_by)).rowcount > 0:
+            return True
+
+        log(LogLevel.Warning, self.config,
+            f"Lease on {job.ticket_fp} was lost to another worker. Leaving the job to it")
+        return False
+
+    def _execute(self: Self, sql: str, parameters: tuple = ()) -> sqlite3.Cursor:
+        with self._lock:
+            return self._connection.execute(sql, parameters)
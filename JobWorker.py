@@ -0,0 +1,157 @@
+import multiprocessing
+from multiprocessing.process import BaseProcess
+import os
+import socket
+import threading
+from typing import Self
+
+from Configuration import Configuration
+from ConfigurationHandler import get_handler
+from JobQueue import Job, JobQueue
+from Logger import LogLevel, flush, log
+from TicketFolderHandler import TicketFolderHandler
+
+
+# Leases tickets from the job queue and processes them one at a time till stopped
+class JobWorker:
+    _poll_interval = 1  # seconds; How long to wait before asking again when the queue is empty
+
+    def __init__(self: Self, name: str) -> None:
+        self.name = name
+        self._config_handler = get_handler()
+        self._queue = JobQueue(self._config_handler.config)
+        self._stop_event = threading.Event()
+
+        # A handler (with its Google services) per tenant, created when the first job of that tenant comes up
+        self._handlers: dict[str | None, TicketFolderHandler] = {}
+
+    def run(self: Self) -> None:
+        log(LogLevel.Status, self._config_handler.config,
+            f"Worker {self.name} consuming jobs from {self._queue.db_fp}")
+        self._config_handler.watch()
+
+        while not self._stop_event.is_set():
+            job = self._queue.lease(self.name)
+            if job is None:
+                self._stop_event.wait(self._poll_interval)
+                continue
+            self._work_on(job)
+
+        self._config_handler.stop_watching()
+        for handler in self._handlers.values():
+            handler.stop()
+
+    def stop(self: Self) -> None:
+        self._stop_event.set()
+
+    def _work_on(self: Self, job: Job) -> None:
+        config = self._config_handler.config
+        self._queue.config = config
+
+        if not job.ticket_fp.is_file():
+            log(LogLevel.Warning, config,
+                f"{job.ticket_fp} is gone. Dropping it from the queue")
+            self._queue.ack(job, "missing")
+            return
+
+        # Keeps the job leased for as long as the ticket is being worked on
+        done = threading.Event()
+
+        def heartbeat() -> None:
+            while not done.wait(config.job_visibility_timeout.total_seconds() / 3):
+                if not self._queue.extend(job):
+                    return
+
+        threading.Thread(target=heartbeat, name="job-heartbeat",
+                         daemon=True).start()
+
+        try:
+            handler = self._handlers.get(job.tenant)
+            if handler is None:
+                # The handler exits the program when the Google APIs can't be set up. Only the job fails here and the worker
+                # tries again with the next one
+                try:
+                    handler = self._handlers[job.tenant] = TicketFolderHandler(
+                        self._config_handler, scan=False, tenant=job.tenant)
+                except SystemExit:
+                    log(LogLevel.Error, config,
+                        f"Failure to set up the handler for {job.ticket_fp}")
+                    self._queue.fail(job, "error: handler setup failed")
+                    return
+
+            result = handler.process_new_ticket(job.ticket_fp)
+            if result.failed:
+                self._queue.fail(job, result.result)
+            else:
+                self._queue.ack(job, result.result)
+        except Exception as error:
+            log(LogLevel.Error, config,
+                f"Failure to work on {job.ticket_fp}: {error}")
+            self._queue.fail(job, f"error: {error}")
+        finally:
+            done.set()
+
+
+def _worker_main(index: int) -> None:
+    worker = JobWorker(f"{socket.gethostname()}:{os.getpid()}:{index}")
+    try:
+        worker.run()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        flush()
+
+
+# Runs worker processes and starts a worker again whenever one exits, say because it crashed or was killed
+# Each one is a fresh interpreter with its own Google services and connections
+class WorkerSupervisor(threading.Thread):
+    _check_interval = 5  # seconds
+
+    def __init__(self: Self, count: int, config: Configuration) -> None:
+        super().__init__(name="job-worker-supervisor", daemon=True)
+        self.config = config
+        self._context = multiprocessing.get_context("spawn")
+        self._stop_event = threading.Event()
+        self._processes = [self._spawn(index) for index in range(count)]
+
+    def run(self: Self) -> None:
+        while not self._stop_event.wait(self._check_interval):
+            for index, process in enumerate(self._processes):
+                if process.is_alive() or self._stop_event.is_set():
+                    continue
+
+                log(LogLevel.Warning, self.config,
+                    f"Worker {process.name} exited with {process.exitcode}. Starting it again")
+                process.close()
+                self._processes[index] = self._spawn(index)
+
+    # Stops supervising and then the workers, so that none of them is started again on the way out
+    def stop(self: Self) -> None:
+        self._stop_event.set()
+        if self.is_alive():
+            self.join()
+
+        for process in self._processes:
+            process.terminate()
+        for process in self._processes:
+            process.join()
+
+    def _spawn(self: Self, index: int) -> BaseProcess:
+        process = self._context.Process(target=_worker_main, args=(
+            index,), name=f"job-worker-{index}", daemon=True)
+        process.start()
+        return process
+
+
+# Runs count workers from the current process till interrupted
+def run_workers(count: int, config: Configuration) -> None:
+    if count <= 1:
+        _worker_main(0)
+        return
+
+    supervisor = WorkerSupervisor(count, config)
+    supervisor.start()
+    try:
+        supervisor.join()
+    except KeyboardInterrupt:
+        supervisor.stop()
@@ -1,5 +1,12 @@
+import atexit
+from dataclasses import dataclass
 from datetime import datetime
 from enum import IntEnum, auto
+import json
+from pathlib import Path
+import queue
+import threading
+from typing import IO, Self
 
 # To avoid circular imports
 from typing import TYPE_CHECKING
@@ -13,17 +20,137 @@ class LogLevel(IntEnum):
     Error = auto()
 
 
+class LogFormat(IntEnum):
+    text = auto()
+    json = auto()  # One JSON object per line
+
+
+@dataclass(slots=True)
+class _LogRecord:
+    when: datetime
+    level: LogLevel
+    message: str
+    log_folder: Path | None
+    log_format: LogFormat
+    log_max_bytes: int
+
+
+# Callers only put records on a queue. A background thread writes them out in batches and keeps the log files open in between
+# Once _max_pending records are waiting, callers wait for the writer to catch up rather than the queue growing without bound
+class _LogWriter(threading.Thread):
+    _batch_size = 256
+    _max_pending = 16384
+
+    def __init__(self: Self) -> None:
+        super().__init__(name="log-writer", daemon=True)
+        self.records: queue.Queue[_LogRecord] = queue.Queue(
+            self._max_pending)
+
+        # Log folder -> (path of the file being written to, the open file)
+        self._files: dict[Path, tuple[Path, IO[str]]] = {}
+
+    def run(self: Self) -> None:
+        while True:
+            batch = [self.records.get()]
+            while len(batch) < self._batch_size:
+                try:
+                    batch.append(self.records.get_nowait())
+                except queue.Empty:
+                    break
+
+            try:
+                self._write(batch)
+            finally:
+                for _ in batch:
+                    self.records.task_done()
+
+    def _write(self: Self, batch: list[_LogRecord]) -> None:
+        touched = set()
+        for record in batch:
+            if record.log_folder is None:
+                print(f"[{record.level.name}]: ", record.message, file=_console)
+                continue
+
+            try:
+                output = self._get_file(record)
+                output.write(self._format(record))
+                touched.add(record.log_folder)
+            except Exception as error:
+                print(f"[Error]: Failure to open a log file: {error}", file=_console)
+                print(f"[{record.level.name}]: ", record.message, file=_console)
+
+        for log_folder in touched:
+            try:
+                self._files[log_folder][1].flush()
+            except Exception as error:
+                print(f"[Error]: Failure to write to a log file: {error}", file=_console)
+
+    # Files are named after the day like log_10_01_2026.txt. Once a file reaches log_max_bytes the rest of the day goes into
+    # log_10_01_2026.1.txt, log_10_01_2026.2.txt and so on
+    def _get_file(self: Self, record: _LogRecord) -> IO[str]:
+        assert record.log_folder is not None
+        day = f"log_{record.when.strftime("%d_%m_%Y")}"
+
+        current = self._files.get(record.log_folder)
+        if current is not None:
+            log_fp, output = current
+            if log_fp.name.startswith(f"{day}.") and output.tell() < record.log_max_bytes:
+                return output
+            output.close()
+            del self._files[record.log_folder]
+
+        record.log_folder.mkdir(parents=True, exist_ok=True)
+        log_fp = record.log_folder / f"{day}.txt"
+        part = 0
+        while log_fp.is_file() and log_fp.stat().st_size >= record.log_max_bytes:
+            part += 1
+            log_fp = record.log_folder / f"{day}.{part}.txt"
+
+        output = open(log_fp, "a")
+        self._files[record.log_folder] = (log_fp, output)
+        return output
+
+    @staticmethod
+    def _format(record: _LogRecord) -> str:
+        if record.log_format == LogFormat.json:
+            return json.dumps({
+                "time": record.when.isoformat(),
+                "level": record.level.name,
+                "message": record.message,
+            }) + "\n"
+        return f"{record.when.strftime("%H:%M:%S.%f")[:-3]} [{record.level.name}]: {record.message}\n"
+
+
+_writer: _LogWriter | None = None
+_writer_lock = threading.Lock()
+
+# Where records go without a log folder. stdout when None
+_console: IO[str] | None = None
+
+
+def set_console(stream: IO[str] | None) -> None:
+    global _console
+    _console = stream
+
+
 def log(level: LogLevel, config: "Configuration", *args) -> None:
-    try:
-        if config.log_folder is None:
-            print(f"[{level.name}]: ", *args)
-        else:
-            today_log_path = config.log_folder / \
-                f"log_{datetime.now().strftime("%d_%m_%Y")}.txt"
-
-            today_log_path.parent.mkdir(parents=True, exist_ok=True)
-            with open(today_log_path, "a") as output:
-                output.write(f"[{level.name}]: {" ".join(args)}\n")
-    except Exception as error:
-        print(f"[Error]: Failure to open a log file: {error}")
-        print(f"[{level.name}]: ", *args)
+    global _writer
+
+    if level < config.log_level:
+        return
+
+    if _writer is None:
+        with _writer_lock:
+            if _writer is None:
+                _writer = _LogWriter()
+                _writer.start()
+
+    _writer.records.put(_LogRecord(datetime.now(), level, " ".join(str(arg) for arg in args),
+                                   config.log_folder, config.log_format, config.log_max_bytes))
+
+
+# Blocks till everything logged so far has been written out. Also runs when the program exits
+@atexit.register
+def flush() -> None:
+    if _writer is not None and _writer.is_alive():
+        _writer.records.join()
@@ -0,0 +1,181 @@
+from bisect import bisect_left
+from collections.abc import Iterator
+from contextlib import contextmanager
+import os
+import threading
+import time
+from typing import TYPE_CHECKING, Self
+
+from Configuration import Configuration
+from Logger import LogLevel, log
+
+if TYPE_CHECKING:
+    from http.server import ThreadingHTTPServer
+
+# Upper bounds in seconds. Stages range from microseconds of regex to tens of seconds of retried network calls
+_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25,
+            0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+_PREFIX = "ttc"
+
+Labels = tuple[tuple[str, str], ...]
+
+
+class _Histogram:
+    def __init__(self: Self) -> None:
+        self.bucket_counts = [0] * (len(_BUCKETS) + 1)  # Last one is +Inf
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self: Self, value: float) -> None:
+        self.bucket_counts[bisect_left(_BUCKETS, value)] += 1
+        self.count += 1
+        self.sum += value
+
+
+class _Metrics:
+    def __init__(self: Self) -> None:
+        self._lock = threading.Lock()
+        self._histograms: dict[str, dict[Labels, _Histogram]] = {}
+        self._counters: dict[str, dict[Labels, float]] = {}
+
+    # Times the with block as a stage of processing. A failing block is counted in stage_failures as well
+    @contextmanager
+    def span(self: Self, stage: str, **labels: str) -> Iterator[None]:
+        start = time.perf_counter()
+        try:
+            yield
+        except BaseException:
+            self.count("stage_failures", stage=stage, **labels)
+            raise
+        finally:
+            self.observe("stage_duration_seconds",
+                         time.perf_counter() - start, stage=stage, **labels)
+
+    def observe(self: Self, name: str, value: float, **labels: str) -> None:
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            histograms = self._histograms.setdefault(name, {})
+            if key not in histograms:
+                histograms[key] = _Histogram()
+            histograms[key].observe(value)
+
+    def count(self: Self, name: str, amount: float = 1, **labels: str) -> None:
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            counters = self._counters.setdefault(name, {})
+            counters[key] = counters.get(key, 0) + amount
+
+    # OpenMetrics text exposition format
+    def render(self: Self) -> str:
+        lines = []
+        with self._lock:
+            for name, counters in sorted(self._counters.items()):
+                lines.append(f"# TYPE {_PREFIX}_{name} counter")
+                for labels, value in sorted(counters.items()):
+                    lines.append(
+                        f"{_PREFIX}_{name}_total{self._format_labels(labels)} {value}")
+
+            for name, histograms in sorted(self._histograms.items()):
+                lines.append(f"# TYPE {_PREFIX}_{name} histogram")
+                for labels, histogram in sorted(histograms.items()):
+                    cumulative = 0
+                    for bound, bucket_count in zip((*_BUCKETS, "+Inf"), histogram.bucket_counts):
+                        cumulative += bucket_count
+                        lines.append(
+                            f"{_PREFIX}_{name}_bucket{self._format_labels(labels + (("le", str(bound)),))} {cumulative}")
+                    lines.append(
+                        f"{_PREFIX}_{name}_count{self._format_labels(labels)} {histogram.count}")
+                    lines.append(
+                        f"{_PREFIX}_{name}_sum{self._format_labels(labels)} {histogram.sum}")
+
+        lines.append("# EOF")
+        return "\n".join(lines) + "\n"
+
+    @staticmethod
+    def _format_labels(labels: Labels) -> str:
+        if not labels:
+            return ""
+        escaped = (f'{key}="{str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")}"'
+                   for key, value in labels)
+        return "{" + ",".join(escaped) + "}"
+
+
+# Publishes the metrics every _interval seconds to config.metrics_file (for node_exporter's textfile collector) and/or serves them
+# on http://127.0.0.1:<config.metrics_port>/metrics
+class MetricsExporter(threading.Thread):
+    _interval = 15  # seconds
+
+    def __init__(self: Self, config: Configuration) -> None:
+        super().__init__(name="metrics-exporter", daemon=True)
+        self.config = config
+        self._stop_event = threading.Event()
+        self._server: "ThreadingHTTPServer | None" = None
+
+    @staticmethod
+    def is_enabled(config: Configuration) -> bool:
+        return config.metrics_file is not None or config.metrics_port > 0
+
+    def run(self: Self) -> None:
+        if self.config.metrics_port > 0:
+            self._serve(self.config)
+
+        while not self._stop_event.wait(self._interval):
+            self.write_textfile(self.config)
+
+    def stop(self: Self) -> None:
+        self._stop_event.set()
+        if self._server is not None:
+            self._server.shutdown()
+        self.write_textfile(self.config)
+
+    @staticmethod
+    def write_textfile(config: Configuration) -> None:
+        if config.metrics_file is None:
+            return
+
+        try:
+            config.metrics_file.parent.mkdir(parents=True, exist_ok=True)
+            temp_fp = config.metrics_file.with_name(
+                f".{config.metrics_file.name}.{os.getpid()}.tmp")
+            temp_fp.write_text(metrics.render())
+            os.replace(temp_fp, config.metrics_file)
+        except Exception as error:
+            log(LogLevel.Warning, config,
+                f"Failure to write metrics to {config.metrics_file}: {error}")
+
+    def _serve(self: Self, config: Configuration) -> None:
+        from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self) -> None:
+                if self.path != "/metrics":
+                    self.send_error(404)
+                    return
+
+                body = metrics.render().encode()
+                self.send_response(200)
+                self.send_header(
+                    "Content-Type", "application/openmetrics-text; version=1.0.0; charset=utf-8")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format: str, *args) -> None:
+                pass
+
+        try:
+            self._server = ThreadingHTTPServer(
+                ("127.0.0.1", config.metrics_port), Handler)
+        except OSError as error:
+            log(LogLevel.Warning, config,
+                f"Failure to serve metrics on port {config.metrics_port}: {error}")
+            return
+
+        threading.Thread(target=self._server.serve_forever,
+                         name="metrics-server", daemon=True).start()
+        log(LogLevel.Status, config,
+            f"Serving metrics on http://127.0.0.1:{config.metrics_port}/metrics")
+
+
+metrics = _Metrics()
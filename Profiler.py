@@ -0,0 +1,109 @@
+from collections import Counter
+import cProfile
+from datetime import datetime
+from pathlib import Path
+import pstats
+import sys
+import threading
+import tracemalloc
+from types import FrameType
+from typing import Self
+
+from Configuration import Configuration
+from Logger import LogLevel, log
+
+
+# Samples the stacks of every thread at a fixed interval. cProfile only sees the thread that started it while most of the steady
+# state work happens on the observer's thread, so this is what the collapsed stack (flamegraph) output is built from
+class _StackSampler(threading.Thread):
+    _interval = 0.005  # seconds
+
+    def __init__(self: Self) -> None:
+        super().__init__(name="stack-sampler", daemon=True)
+        self.stacks: Counter[str] = Counter()
+        self._stop_event = threading.Event()
+
+    def run(self: Self) -> None:
+        thread_names = {}
+        while not self._stop_event.wait(self._interval):
+            for thread in threading.enumerate():
+                thread_names[thread.ident] = thread.name
+
+            for ident, frame in sys._current_frames().items():
+                if ident != self.ident:
+                    self.stacks[self._collapse(
+                        thread_names.get(ident, str(ident)), frame)] += 1
+
+    def stop(self: Self) -> None:
+        self._stop_event.set()
+        self.join()
+
+    @staticmethod
+    def _collapse(thread_name: str, frame: FrameType | None) -> str:
+        functions = []
+        while frame is not None:
+            functions.append(
+                f"{Path(frame.f_code.co_filename).name}:{frame.f_code.co_name}")
+            frame = frame.f_back
+        functions.append(thread_name)
+        return ";".join(reversed(functions))
+
+
+# Runs cProfile, tracemalloc and the stack sampler between start() and stop() and then writes the reports to
+# <profile_folder>/<time of the run>/:
+#   stats.txt            cProfile stats sorted by cumulative time. Only of the main thread, which runs the startup scan but not
+#                        the watching. That shows up in stacks.collapsed
+#   profile.pstats       Raw cProfile stats for snakeviz, pstats etc.
+#   stacks.collapsed     Collapsed stacks for flamegraph.pl/speedscope/inferno
+#   allocations.txt      Top allocations still alive at the end of the run
+class Profiler:
+    _top_allocations = 50
+
+    def __init__(self: Self) -> None:
+        self._profile = cProfile.Profile()
+        self._sampler = _StackSampler()
+        self._started_at = datetime.now()
+
+    def start(self: Self, config: Configuration) -> None:
+        log(LogLevel.Status, config, "Profiling...")
+        self._started_at = datetime.now()
+        tracemalloc.start(25)
+        self._sampler.start()
+        self._profile.enable()
+
+    def stop(self: Self, config: Configuration) -> Path:
+        self._profile.disable()
+        self._sampler.stop()
+        snapshot = tracemalloc.take_snapshot()
+        tracemalloc.stop()
+
+        output_folder = config.profile_folder / \
+            self._started_at.strftime("%Y_%m_%d_%H_%M_%S")
+        output_folder.mkdir(parents=True, exist_ok=True)
+
+        self._profile.dump_stats(output_folder / "profile.pstats")
+        with open(output_folder / "stats.txt", "w") as stats_file:
+            pstats.Stats(self._profile, stream=stats_file).sort_stats(
+                pstats.SortKey.CUMULATIVE).print_stats()
+
+        with open(output_folder / "stacks.collapsed", "w") as stacks_file:
+            for stack, count in self._sampler.stacks.most_common():
+                stacks_file.write(f"{stack} {count}\n")
+
+        with open(output_folder / "allocations.txt", "w") as allocations_file:
+            snapshot = snapshot.filter_traces([
+                tracemalloc.Filter(False, tracemalloc.__file__),
+                tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+            ])
+            stats = snapshot.statistics("traceback")
+            allocations_file.write(
+                f"Total: {sum(stat.size for stat in stats) / 1024:.1f} KiB in {sum(stat.count for stat in stats)} blocks\n\n")
+            for stat in stats[:self._top_allocations]:
+                allocations_file.write(
+                    f"{stat.size / 1024:.1f} KiB in {stat.count} blocks\n")
+                allocations_file.write(
+                    "\n".join(f"    {line}" for line in stat.traceback.format()) + "\n\n")
+
+        log(LogLevel.Status, config,
+            f"Profile of the run written to {output_folder}")
+        return output_folder
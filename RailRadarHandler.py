@@ -1,32 +1,31 @@
-from collections.abc import Iterator
+import asyncio
+from collections.abc import Iterable, Iterator
+from concurrent.futures import Future, ThreadPoolExecutor
 from datetime import datetime, timedelta
 import json
+from pathlib import Path
+import threading
 import time
-from typing import Callable, Self, TypedDict
-
-import requests
-from requests import HTTPError, RequestException
+from typing import TYPE_CHECKING, Callable, Self
 
 from Configuration import Configuration
-from FileCache import FileCache
 from Logger import LogLevel, log
+from Metrics import metrics
+from RouteStore import Route, Station, store as route_store
 from common import calculate_backoff
 
-
-class Station(TypedDict):
-    day: int
-    departure: int
-    arrival: int
-    code: str
-    name: str
+# requests (and httpx for the async engine) is only imported once a route actually has to be fetched
+if TYPE_CHECKING:
+    import httpx
+    import requests
 
 
 class RailRadarHandler:
     def __init__(self: Self, train_number: str, departure_date: datetime, config: Configuration) -> None:
         self.train_number = train_number
 
-        self._data = FileCache(
-            self.train_number, self._get_train_info, json.dumps, json.loads, config).data
+        self._route = self._get_route(self.train_number, config)
+        self._data = self._route.stations
 
         self._departure_date = departure_date
         self._day_of_departure = 0  # Day of the journey when reaching the boarding station
@@ -43,6 +42,12 @@ class RailRadarHandler:
     def is_data_missing(self: Self) -> bool:
         return None in [self.departure_datetime, self.arrival_datetime, self.departure_station_name, self.arrival_station_name]
 
+    def station(self: Self, code: str) -> tuple[int, Station] | None:
+        position = self._route.station_index.get(code)
+        if position is None:
+            return None
+        return position, self._data[position]
+
     def station_codes(self: Self) -> Iterator[tuple[str, Callable[[], None]]]:
         for station in self._data:
             yield (station["code"], self.mark_as_arrival_station(station) if self.departure_station_marked else self.mark_as_departure_station(station))
@@ -71,50 +76,340 @@ class RailRadarHandler:
 
         return impl
 
-    def _get_train_info(self: Self, config: Configuration) -> list[Station]:
-        for attempt in range(config.max_retries_for_network_requests):
+    # Fetches the routes of all the given trains concurrently ahead of processing tickets so that they're waiting in the route store
+    @staticmethod
+    def prefetch(train_numbers: Iterable[str], config: Configuration) -> None:
+        train_numbers = set(train_numbers)
+        if not train_numbers:
+            return
+
+        log(LogLevel.Status, config,
+            f"Prefetching routes of {len(train_numbers)} trains")
+
+        def impl(train_number: str) -> None:
             try:
-                with open(config.rail_radar_credentials_path, "r") as credentials_json:
-                    # Returning a list containing dictionaries representing all the stations the train stops at with only the required fields to save data
-                    return [
-                        {
-                            "day": station["day"],
-                            "departure": station.get("scheduledDeparture", 0),
-                            "arrival": station.get("scheduledArrival", 0),
-                            "code": station["stationCode"],
-                            "name": station["stationName"],
-                        }
-                        for station in self._api_call(self.train_number, json.loads(credentials_json.read()), config)["data"]["route"]
-                        if station["isHalt"] == 1
-                    ]
-            except FileNotFoundError:
+                RailRadarHandler._get_route(train_number, config)
+            except Exception as error:
+                # The ticket will try again (and report the failure) when it gets processed
                 log(LogLevel.Warning, config,
-                    f"'{config.rail_radar_credentials_path}' doesn't exist")
-                raise
+                    f"Failure to prefetch route of train number: {train_number}: {error}")
+
+        with ThreadPoolExecutor(max_workers=max(1, config.route_prefetch_workers), thread_name_prefix="route-prefetch") as executor:
+            list(executor.map(impl, train_numbers))
+
+    # Same as prefetch but as a coroutine, with the requests made over httpx's async client when httpx is installed
+    # Without httpx every route is fetched on a worker thread of the event loop instead. Either way up to route_prefetch_workers
+    # routes are fetched at a time
+    @staticmethod
+    async def prefetch_async(train_numbers: Iterable[str], config: Configuration) -> None:
+        train_numbers = set(train_numbers)
+        if not train_numbers:
+            return
+
+        try:
+            import httpx
+        except ImportError:
+            httpx = None
+            log(LogLevel.Status, config,
+                "httpx isn't installed. Fetching routes on worker threads")
+
+        log(LogLevel.Status, config,
+            f"Prefetching routes of {len(train_numbers)} trains")
+        limit = asyncio.Semaphore(max(1, config.route_prefetch_workers))
+
+        async def impl(train_number: str, client: "httpx.AsyncClient | None") -> None:
+            try:
+                async with limit:
+                    if client is None:
+                        await asyncio.to_thread(RailRadarHandler._get_route, train_number, config)
+                        return
+
+                    # The route store is SQLite, which mustn't hold up the event loop
+                    route, is_usable = await asyncio.to_thread(RailRadarHandler._lookup, train_number, config)
+                    if not is_usable:
+                        await RailRadarHandler._fetch_async(train_number, route, client, config)
+            except Exception as error:
+                # The ticket will try again (and report the failure) when it gets processed
+                log(LogLevel.Warning, config,
+                    f"Failure to prefetch route of train number: {train_number}: {error}")
+
+        if httpx is None:
+            await asyncio.gather(*(impl(train_number, None) for train_number in train_numbers))
+            return
+
+        async with httpx.AsyncClient(timeout=_REQUEST_TIMEOUT) as client:
+            await asyncio.gather(*(impl(train_number, client) for train_number in train_numbers))
+
+    @staticmethod
+    def _get_route(train_number: str, config: Configuration) -> Route:
+        route, is_usable = RailRadarHandler._lookup(train_number, config)
+        if is_usable:
+            assert route is not None
+            return route
+        return RailRadarHandler._fetch(train_number, route, config)
+
+    # The stored route of the train and whether it can be used as it is. Otherwise it has to be fetched from RailRadar
+    @staticmethod
+    def _lookup(train_number: str, config: Configuration) -> tuple[Route | None, bool]:
+        log(LogLevel.Status, config,
+            f"\t\tChecking route store for train number: {train_number}")
+
+        route = route_store.get(train_number, config)
+        if route is not None:
+            age = datetime.now() - route.fetched_at
+            if age < config.cache_data_refresh_time:
+                metrics.count("route_lookups", result="fresh")
+                return route, True
+
+            # Timetables rarely change so an outdated route is still good enough to process the ticket with
+            if config.route_stale_while_revalidate and age < config.route_max_staleness:
+                log(LogLevel.Status, config,
+                    f"\t\t\tStored route for train number: {train_number} is outdated; Using it while refreshing it in the background.")
+                RailRadarHandler._refresh_in_background(
+                    train_number, route, config)
+                metrics.count("route_lookups", result="stale")
+                return route, True
+
+        log(LogLevel.Status, config,
+            f"\t\t\tNo up to date route stored for train number: {train_number}.")
+        metrics.count("route_lookups", result="missing" if route is None else "expired")
+        return route, False
+
+    # The refresh takes off before its thread is started, so lookups coming in meanwhile find it in flight and don't start more
+    @staticmethod
+    def _refresh_in_background(train_number: str, stored: Route, config: Configuration) -> None:
+        future, is_owner = RailRadarHandler._take_off(train_number)
+        if not is_owner:
+            return
+
+        def impl() -> None:
+            try:
+                RailRadarHandler._fly(train_number, future, lambda: RailRadarHandler._get_train_info(
+                    train_number, stored, config))
+                log(LogLevel.Status, config,
+                    f"Refreshed route of train number: {train_number} in the background")
+            except Exception as error:
+                log(LogLevel.Warning, config,
+                    f"Failure to refresh route of train number: {train_number} in the background: {error}")
+
+        threading.Thread(
+            target=impl, name=f"route-refresh-{train_number}", daemon=True).start()
+
+    # Single flight: only one RailRadar request per train is ever in progress, whether it's for a ticket, a background refresh or
+    # the async prefetch. Anyone else asking for the same train waits for it
+    @staticmethod
+    def _fetch(train_number: str, stored: Route | None, config: Configuration) -> Route:
+        future, is_owner = RailRadarHandler._take_off(train_number)
+        if not is_owner:
+            log(LogLevel.Status, config,
+                f"\t\tRoute of train number: {train_number} is already being fetched; Waiting for it")
+            return future.result()
+
+        return RailRadarHandler._fly(train_number, future, lambda: RailRadarHandler._get_train_info(
+            train_number, stored, config))
+
+    # The flight of the train and whether the caller owns it. The owner has to land it, like _fly does
+    @staticmethod
+    def _take_off(train_number: str) -> tuple[Future[Route], bool]:
+        with _in_flight_lock:
+            future = _in_flight.get(train_number)
+            if future is not None:
+                return future, False
+
+            future = _in_flight[train_number] = Future()
+            return future, True
+
+    @staticmethod
+    def _fly(train_number: str, future: Future[Route], fetch: Callable[[], Route]) -> Route:
+        try:
+            route = fetch()
+            future.set_result(route)
+            return route
+        except BaseException as error:
+            future.set_exception(error)
+            raise
+        finally:
+            with _in_flight_lock:
+                del _in_flight[train_number]
+
+    # stored is the route we already have (if any). RailRadar is asked to only send the route again if it has changed since then
+    @staticmethod
+    def _get_train_info(train_number: str, stored: Route | None, config: Configuration) -> Route:
+        from requests import HTTPError, RequestException
+
+        header = _load_credentials(config)
+
+        for attempt in range(config.max_retries_for_network_requests):
+            try:
+                response = RailRadarHandler._api_call(
+                    train_number, header, stored, config)
+
+                return RailRadarHandler._store_response(train_number, response, stored, config)
             except HTTPError:
                 raise
             except RequestException:
                 log(LogLevel.Warning, config,
                     f"Network error while retrieving RailRadar info. Retrying in {calculate_backoff(attempt)} seconds...")
+                metrics.count("retries", service="railradar")
                 time.sleep(calculate_backoff(attempt))
-            except IOError:
-                log(LogLevel.Warning, config,
-                    f"Couldn't open '{config.rail_radar_credentials_path}'")
+        raise Exception(
+            "Connection Error. Are you connected to the internet?")
+
+    @staticmethod
+    def _api_call(train_number: str, header: dict, stored: Route | None, config: Configuration) -> "requests.Response":
+        log(LogLevel.Status, config, f"\t\tPerforming API call to RailRadar")
+
+        with metrics.span("railradar_request"):
+            response = _get_session().get(
+                f"{config.rail_radar_base_url}/trains/{train_number}",
+                headers=RailRadarHandler._request_headers(header, stored),
+                timeout=_REQUEST_TIMEOUT
+            )
+            response.raise_for_status()
+        metrics.count("railradar_responses", status=str(response.status_code))
+        return response
+
+    # Same as _fetch but awaiting the flight, the request and the backoff between retries
+    @staticmethod
+    async def _fetch_async(train_number: str, stored: Route | None, client: "httpx.AsyncClient", config: Configuration) -> Route:
+        future, is_owner = RailRadarHandler._take_off(train_number)
+        if not is_owner:
+            log(LogLevel.Status, config,
+                f"\t\tRoute of train number: {train_number} is already being fetched; Waiting for it")
+            return await asyncio.wrap_future(future)
+
+        try:
+            route = await RailRadarHandler._get_train_info_async(train_number, stored, client, config)
+            future.set_result(route)
+            return route
+        except BaseException as error:
+            future.set_exception(error)
+            raise
+        finally:
+            with _in_flight_lock:
+                del _in_flight[train_number]
+
+    @staticmethod
+    async def _get_train_info_async(train_number: str, stored: Route | None, client: "httpx.AsyncClient", config: Configuration) -> Route:
+        import httpx
+
+        header = await asyncio.to_thread(_load_credentials, config)
+
+        for attempt in range(config.max_retries_for_network_requests):
+            try:
+                log(LogLevel.Status, config,
+                    f"\t\tPerforming API call to RailRadar")
+                with metrics.span("railradar_request"):
+                    response = await client.get(
+                        f"{config.rail_radar_base_url}/trains/{train_number}",
+                        headers=RailRadarHandler._request_headers(
+                            header, stored)
+                    )
+                    # Unlike requests, httpx counts 304 as an error as well
+                    if response.status_code != 304:
+                        response.raise_for_status()
+                metrics.count("railradar_responses",
+                              status=str(response.status_code))
+
+                return await asyncio.to_thread(RailRadarHandler._store_response, train_number, response, stored, config)
+            except httpx.HTTPStatusError:
                 raise
-            except json.JSONDecodeError:
+            except httpx.HTTPError:
                 log(LogLevel.Warning, config,
-                    f"Unable to parse '{config.rail_radar_credentials_path}'")
-                raise
+                    f"Network error while retrieving RailRadar info. Retrying in {calculate_backoff(attempt)} seconds...")
+                metrics.count("retries", service="railradar")
+                await asyncio.sleep(calculate_backoff(attempt))
         raise Exception(
             "Connection Error. Are you connected to the internet?")
 
     @staticmethod
-    def _api_call(train_number: str, header: dict, config: Configuration) -> dict:
-        log(LogLevel.Status, config, f"\t\tPerforming API call to RailRadar")
+    def _request_headers(header: dict, stored: Route | None) -> dict:
+        headers = dict(header)
+        if stored is not None and stored.etag is not None:
+            headers["If-None-Match"] = stored.etag
+        if stored is not None and stored.last_modified is not None:
+            headers["If-Modified-Since"] = stored.last_modified
+        return headers
 
-        response = requests.get(
-            f"https://api.railradar.in/api/v1/trains/{train_number}",
-            headers=header
+    # response is from either requests or httpx, which look the same for what's used of them here
+    @staticmethod
+    def _store_response(train_number: str, response: "requests.Response | httpx.Response", stored: Route | None, config: Configuration) -> Route:
+        if response.status_code == 304 and stored is not None:
+            log(LogLevel.Status, config,
+                f"\t\tRoute of train number: {train_number} unchanged; Keeping the stored one")
+            return route_store.revalidate(train_number, config)
+
+        # Storing only the stations the train stops at with only the required fields to save data
+        return route_store.put(
+            train_number,
+            [
+                {
+                    "day": station["day"],
+                    "departure": station.get("scheduledDeparture", 0),
+                    "arrival": station.get("scheduledArrival", 0),
+                    "code": station["stationCode"],
+                    "name": station["stationName"],
+                }
+                for station in response.json()["data"]["route"]
+                if station["isHalt"] == 1
+            ],
+            config,
+            response.headers.get("ETag"),
+            response.headers.get("Last-Modified")
         )
-        response.raise_for_status()
-        return response.json()
+
+
+# One pooled session for every RailRadar call so connections are kept alive and reused across tickets
+_REQUEST_TIMEOUT = 30  # seconds
+_session: "requests.Session | None" = None
+_session_lock = threading.Lock()
+
+
+def _get_session() -> "requests.Session":
+    global _session
+
+    with _session_lock:
+        if _session is None:
+            import requests
+            from requests.adapters import HTTPAdapter
+
+            _session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=4, pool_maxsize=16)
+            _session.mount("https://", adapter)
+            _session.mount("http://", adapter)
+        return _session
+
+
+# Train number -> RailRadar request for its route that's in progress right now
+_in_flight: dict[str, Future[Route]] = {}
+_in_flight_lock = threading.Lock()
+
+_credentials: dict | None = None
+_credentials_fp: Path | None = None
+_credentials_lock = threading.Lock()
+
+
+def _load_credentials(config: Configuration) -> dict:
+    global _credentials, _credentials_fp
+
+    with _credentials_lock:
+        if _credentials is not None and _credentials_fp == config.rail_radar_credentials_path:
+            return _credentials
+
+        try:
+            with open(config.rail_radar_credentials_path, "r") as credentials_json:
+                _credentials = json.loads(credentials_json.read())
+                _credentials_fp = config.rail_radar_credentials_path
+                return _credentials
+        except FileNotFoundError:
+            log(LogLevel.Warning, config,
+                f"'{config.rail_radar_credentials_path}' doesn't exist")
+            raise
+        except IOError:
+            log(LogLevel.Warning, config,
+                f"Couldn't open '{config.rail_radar_credentials_path}'")
+            raise
+        except json.JSONDecodeError:
+            log(LogLevel.Warning, config,
+                f"Unable to parse '{config.rail_radar_credentials_path}'")
+            raise
@@ -0,0 +1,227 @@
+import atexit
+from collections import Counter, OrderedDict
+from dataclasses import dataclass
+from datetime import datetime
+from pathlib import Path
+import sqlite3
+import threading
+from typing import Self, TypedDict
+
+from Configuration import Configuration
+from Logger import LogLevel, log
+
+
+class Station(TypedDict):
+    day: int
+    departure: int
+    arrival: int
+    code: str
+    name: str
+
+
+@dataclass(slots=True)
+class Route:
+    stations: list[Station]
+    fetched_at: datetime
+
+    # Station code -> position of the station in self.stations
+    station_index: dict[str, int]
+
+    # Validators sent by RailRadar with the route. Used to revalidate the route once it is due for a refresh
+    etag: str | None = None
+    last_modified: str | None = None
+
+    @classmethod
+    def from_stations(cls: type[Self], stations: list[Station], fetched_at: datetime, etag: str | None = None, last_modified: str | None = None) -> Self:
+        return cls(stations, fetched_at, {station["code"]: i for i, station in enumerate(stations)}, etag, last_modified)
+
+
+# All the routes of every train we've come across live in a single SQLite database in the cache folder
+# Routes are read from it lazily and kept in memory so that every ticket for the same train shares them. Only the
+# route_memory_entries most recently used routes are kept, so memory doesn't grow with every train ever travelled on
+# Hits, which decide the routes preloaded on startup, are counted in memory and written along with the next route stored, once
+# _max_pending_hits have added up or when the store is closed, instead of with a commit on every lookup
+class RouteStore:
+    _db_name = "routes.sqlite3"
+    _max_pending_hits = 256
+
+    def __init__(self: Self) -> None:
+        self._lock = threading.RLock()
+        self._connection: sqlite3.Connection | None = None
+        self._db_fp: Path | None = None
+        self._routes: OrderedDict[str, Route] = OrderedDict()
+        self._hits: Counter[str] = Counter()  # Not written yet
+
+    def get(self: Self, train_number: str, config: Configuration) -> Route | None:
+        with self._lock:
+            connection = self._connect(config)
+
+            route = self._routes.get(train_number)
+            if route is None:
+                route = self._load(connection, train_number)
+                if route is None:
+                    return None
+            self._remember(train_number, route, config)
+
+            self._hits[train_number] += 1
+            if self._hits.total() >= self._max_pending_hits:
+                with connection:
+                    self._flush_hits(connection)
+            return route
+
+    def put(self: Self, train_number: str, stations: list[Station], config: Configuration, etag: str | None = None, last_modified: str | None = None) -> Route:
+        route = Route.from_stations(
+            stations, datetime.now(), etag, last_modified)
+
+        with self._lock:
+            connection = self._connect(config)
+            with connection:
+                self._flush_hits(connection)
+                connection.execute("""
+                    INSERT INTO trains (train_number, fetched_at, hits, etag, last_modified) VALUES (?, ?, 1, ?, ?)
+                    ON CONFLICT (train_number) DO UPDATE SET
+                        fetched_at = excluded.fetched_at, hits = hits + 1, etag = excluded.etag, last_modified = excluded.last_modified
+                """, (train_number, route.fetched_at.timestamp(), etag, last_modified))
+                connection.execute(
+                    "DELETE FROM halts WHERE train_number = ?", (train_number,))
+                connection.executemany(
+                    "INSERT INTO halts (train_number, seq, code, name, day, arrival, departure) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    [
+                        (train_number, seq, station["code"], station["name"],
+                         station["day"], station["arrival"], station["departure"])
+                        for seq, station in enumerate(stations)
+                    ]
+                )
+            self._remember(train_number, route, config)
+
+        return route
+
+    # RailRadar confirmed that the stored route hasn't changed. Only its freshness needs updating
+    def revalidate(self: Self, train_number: str, config: Configuration) -> Route:
+        with self._lock:
+            connection = self._connect(config)
+            route = self._routes.get(train_number) or self._load(
+                connection, train_number)
+            assert route is not None
+
+            route.fetched_at = datetime.now()
+            self._remember(train_number, route, config)
+            with connection:
+                self._flush_hits(connection)
+                connection.execute("UPDATE trains SET fetched_at = ? WHERE train_number = ?",
+                                   (route.fetched_at.timestamp(), train_number))
+            return route
+
+    # Writes the hits counted so far and closes the database. It's opened again on the next use
+    def close(self: Self) -> None:
+        with self._lock:
+            if self._connection is None:
+                return
+
+            try:
+                with self._connection:
+                    self._flush_hits(self._connection)
+            except sqlite3.Error:
+                pass  # Only costs the preloading some accuracy
+            self._connection.close()
+            self._connection = None
+            self._db_fp = None
+            self._routes.clear()
+
+    # Must be called with self._lock held, inside a transaction
+    def _flush_hits(self: Self, connection: sqlite3.Connection) -> None:
+        if self._hits:
+            connection.executemany("UPDATE trains SET hits = hits + ? WHERE train_number = ?",
+                                   [(hits, train_number) for train_number, hits in self._hits.items()])
+            self._hits.clear()
+
+    # Must be called with self._lock held
+    def _remember(self: Self, train_number: str, route: Route, config: Configuration) -> None:
+        if config.route_memory_entries <= 0:
+            return
+
+        self._routes[train_number] = route
+        self._routes.move_to_end(train_number)
+        while len(self._routes) > config.route_memory_entries:
+            self._routes.popitem(last=False)
+
+    def _connect(self: Self, config: Configuration) -> sqlite3.Connection:
+        db_fp = config.cache_folder / self._db_name
+        if self._connection is not None and self._db_fp == db_fp:
+            return self._connection
+
+        self.close()
+
+        log(LogLevel.Status, config, f"\t\tOpening route store at {db_fp}")
+        db_fp.parent.mkdir(parents=True, exist_ok=True)
+
+        connection = sqlite3.connect(db_fp, check_same_thread=False)
+        connection.executescript("""
+            CREATE TABLE IF NOT EXISTS trains (
+                train_number TEXT PRIMARY KEY,
+                fetched_at REAL NOT NULL,
+                hits INTEGER NOT NULL DEFAULT 0,
+                etag TEXT,
+                last_modified TEXT
+            );
+            CREATE TABLE IF NOT EXISTS halts (
+                train_number TEXT NOT NULL,
+                seq INTEGER NOT NULL,
+                code TEXT NOT NULL,
+                name TEXT NOT NULL,
+                day INTEGER,
+                arrival INTEGER,
+                departure INTEGER,
+                PRIMARY KEY (train_number, seq)
+            ) WITHOUT ROWID;
+            CREATE INDEX IF NOT EXISTS halts_by_code ON halts (code, train_number);
+        """)
+
+        # Stores created before validators were kept
+        columns = [row[1] for row in connection.execute(
+            "PRAGMA table_info(trains)")]
+        for column in ["etag", "last_modified"]:
+            if column not in columns:
+                connection.execute(
+                    f"ALTER TABLE trains ADD COLUMN {column} TEXT")
+        connection.commit()
+
+        self._connection = connection
+        self._db_fp = db_fp
+        self._preload(connection, config)
+        return connection
+
+    # Pull the routes of the most travelled trains into memory in one go
+    def _preload(self: Self, connection: sqlite3.Connection, config: Configuration) -> None:
+        if config.route_preload_count <= 0:
+            return
+
+        train_numbers = [
+            row[0] for row in connection.execute(
+                "SELECT train_number FROM trains ORDER BY hits DESC LIMIT ?", (config.route_preload_count,))
+        ]
+        for train_number in train_numbers:
+            if (route := self._load(connection, train_number)) is not None:
+                self._remember(train_number, route, config)
+
+        if train_numbers:
+            log(LogLevel.Status, config,
+                f"\t\tPreloaded routes of {len(self._routes)} frequently travelled trains")
+
+    @staticmethod
+    def _load(connection: sqlite3.Connection, train_number: str) -> Route | None:
+        train = connection.execute(
+            "SELECT fetched_at, etag, last_modified FROM trains WHERE train_number = ?", (train_number,)).fetchone()
+        if train is None:
+            return None
+
+        return Route.from_stations([
+            {"day": day, "departure": departure,
+                "arrival": arrival, "code": code, "name": name}
+            for code, name, day, arrival, departure in connection.execute(
+                "SELECT code, name, day, arrival, departure FROM halts WHERE train_number = ? ORDER BY seq", (train_number,))
+        ], datetime.fromtimestamp(train[0]), train[1], train[2])
+
+
+store = RouteStore()
+atexit.register(store.close)
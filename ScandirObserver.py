@@ -0,0 +1,182 @@
+from dataclasses import asdict, dataclass, field
+import functools
+import hashlib
+import json
+import os
+from pathlib import Path
+import time
+from typing import Self
+
+from watchdog.events import FileCreatedEvent
+from watchdog.observers.api import DEFAULT_EMITTER_TIMEOUT, BaseObserver, EventEmitter, EventQueue, ObservedWatch
+
+from Configuration import Configuration
+from ConfigurationHandler import _ConfigurationHandler
+from Logger import LogLevel, log
+
+
+@dataclass(slots=True)
+class _Directory:
+    mtime: int  # Nanoseconds
+    trusted: bool  # Whether mtime can be relied on to tell that nothing was added since. See _mtime_slack
+    files: dict[str, tuple[int, int, int]] = field(
+        default_factory=dict)  # Name -> (inode, size, mtime)
+    subdirectories: list[str] = field(default_factory=list)
+
+
+# Finds new files by polling, for folders on NFS/SMB or synced by FUSE where the OS never reports them
+# Unlike watchdog's PollingObserver, which lists and stats every file of the tree every time, a directory is only listed again when
+# its own mtime has changed. A scan of a tree that hasn't changed costs a stat per directory, and done_folder and poll_prune_folders
+# aren't scanned at all. The snapshot is saved in the cache folder so that files added while the program wasn't running are found too
+# Only file creations are reported since they're all the handlers act on
+class ScandirObserver(BaseObserver):
+    def __init__(self: Self, config_handler: _ConfigurationHandler) -> None:
+        super().__init__(functools.partial(  # type: ignore
+            _ScandirEmitter, config_handler=config_handler))
+
+
+class _ScandirEmitter(EventEmitter):
+    _snapshot_folder = "poll_snapshots"
+
+    # Filesystems only keep directory mtimes to a granularity (2 seconds on SMB/FAT) so a file added right after a scan may not change
+    # the mtime. Directories changed that recently are listed again on the next scan too
+    _mtime_slack = 2_000_000_000  # nanoseconds
+
+    def __init__(self: Self, event_queue: EventQueue, watch: ObservedWatch, *, timeout: float = DEFAULT_EMITTER_TIMEOUT, event_filter: list | None = None, config_handler: _ConfigurationHandler) -> None:
+        super().__init__(event_queue, watch, timeout=timeout,
+                         event_filter=event_filter)
+        self._config_handler = config_handler
+        self._root = os.path.abspath(watch.path)
+        self._snapshot: dict[str, _Directory] | None = None
+        self._is_first = True
+        self._last_full_scan = 0.0
+
+    def queue_events(self: Self, timeout: float) -> None:
+        config = self._config_handler.config
+
+        # With nothing to compare against, a scan only takes the snapshot
+        if self._is_first:
+            self._is_first = False
+            self._snapshot = self._read_snapshot(config)
+            # Files added to the top of the folder since the last run are left to the scan on startup
+            self._scan(config, self._snapshot is not None, True)
+            return
+
+        if self.stopped_event.wait(config.poll_interval.total_seconds()):
+            return
+        self._scan(config, self._snapshot is not None, False)
+
+    def _scan(self: Self, config: Configuration, to_report: bool, is_first: bool) -> None:
+        old = self._snapshot or {}
+        full = time.monotonic() - self._last_full_scan >= config.poll_full_rescan_interval.total_seconds()
+        pruned = self._pruned_folders(config)
+        trusted_before = time.time_ns() - self._mtime_slack
+
+        new: dict[str, _Directory] = {}
+        created: list[str] = []
+        listed = 0
+
+        pending = [self._root]
+        while pending and not self.stopped_event.is_set():
+            path = pending.pop()
+            try:
+                mtime = os.stat(path).st_mtime_ns
+            except OSError as error:
+                if path == self._root:
+                    # Likely an unmounted share. Nothing is forgotten so that nothing is reported again once it's back
+                    log(LogLevel.Warning, config,
+                        f"Failure to scan {path}: {error}")
+                    return
+                continue
+
+            previous = old.get(path)
+            if previous is not None and previous.trusted and previous.mtime == mtime and not full:
+                directory = previous
+            else:
+                directory = self._list(path, mtime, mtime < trusted_before)
+                listed += 1
+                if directory is None:
+                    continue
+
+                for name, signature in directory.files.items():
+                    old_signature = None if previous is None else previous.files.get(
+                        name)
+                    # A replaced file has a different inode
+                    if old_signature is None or old_signature[0] != signature[0]:
+                        if not (is_first and path == self._root):
+                            created.append(os.path.join(path, name))
+
+            new[path] = directory
+            pending.extend(subpath for name in directory.subdirectories if (
+                subpath := os.path.join(path, name)) not in pruned)
+
+        if self.stopped_event.is_set():
+            return
+
+        if full:
+            self._last_full_scan = time.monotonic()
+
+        if to_report:
+            for ticket_fp in created:
+                self.queue_event(FileCreatedEvent(ticket_fp))
+
+        if listed or new.keys() != old.keys():
+            log(LogLevel.Status, config,
+                f"Polled {len(new)} folders in {self._root}. Listed {listed} of them and found {len(created)} new files")
+            self._snapshot = new
+            self._write_snapshot(config)
+
+    @staticmethod
+    def _list(path: str, mtime: int, trusted: bool) -> _Directory | None:
+        directory = _Directory(mtime, trusted)
+        try:
+            with os.scandir(path) as entries:
+                for entry in entries:
+                    if entry.is_dir(follow_symlinks=False):
+                        directory.subdirectories.append(entry.name)
+                    elif entry.is_file(follow_symlinks=False):
+                        stat = entry.stat(follow_symlinks=False)
+                        directory.files[entry.name] = (
+                            stat.st_ino, stat.st_size, stat.st_mtime_ns)
+        except OSError:
+            return None
+        return directory
+
+    # done_folder of every tenant as well, since they can be inside any of the ticket folders
+    @staticmethod
+    def _pruned_folders(config: Configuration) -> set[str]:
+        folders = [config.done_folder, *config.poll_prune_folders] + \
+            [Path(tenant["done_folder"])
+             for tenant in config.tenant if "done_folder" in tenant]
+        return {os.path.abspath(folder) for folder in folders}
+
+    def _snapshot_fp(self: Self, config: Configuration) -> Path:
+        return config.cache_folder / self._snapshot_folder / f"{hashlib.sha1(self._root.encode()).hexdigest()[:16]}.json"
+
+    def _read_snapshot(self: Self, config: Configuration) -> dict[str, _Directory] | None:
+        snapshot_fp = self._snapshot_fp(config)
+        try:
+            return {
+                path: _Directory(directory["mtime"], directory["trusted"], {name: tuple(signature) for name, signature in directory["files"].items()},
+                                 directory["subdirectories"])
+                for path, directory in json.loads(snapshot_fp.read_text())["directories"].items()
+            }
+        except FileNotFoundError:
+            return None
+        except Exception as error:
+            log(LogLevel.Warning, config,
+                f"Failure to read the poll snapshot {snapshot_fp}: {error}")
+            return None
+
+    def _write_snapshot(self: Self, config: Configuration) -> None:
+        snapshot_fp = self._snapshot_fp(config)
+        try:
+            snapshot_fp.parent.mkdir(parents=True, exist_ok=True)
+            temp_fp = snapshot_fp.with_name(
+                f".{snapshot_fp.name}.{os.getpid()}.tmp")
+            temp_fp.write_text(json.dumps({"root": self._root, "directories": {
+                path: asdict(directory) for path, directory in (self._snapshot or {}).items()}}))
+            os.replace(temp_fp, snapshot_fp)
+        except Exception as error:
+            log(LogLevel.Warning, config,
+                f"Failure to save the poll snapshot to {snapshot_fp}: {error}")
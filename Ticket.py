@@ -4,41 +4,94 @@ from pathlib import Path
 from typing import Self
 import re
 
-from pypdf import PdfReader
-
 from AiModelHandler import Model
 from Configuration import Configuration
 from Logger import LogLevel, log
+from Metrics import metrics
 from RailRadarHandler import RailRadarHandler
 from TravelData import TravelData, TravelDataField, TravelType
 from common import CalendarEventColor
 
+IRCTC_DATE_FORMAT = "%d-%b-%Y"
+
+# Compiled once at import; these run for every IRCTC ticket
+_IRCTC_SEATING_PATTERN = re.compile(
+    r"CNF/(?P<seating>\w\d{1,2}/\d{1,2}/(?:SIDE )?(?:UPPER|MIDDLE|LOWER|WINDOW SIDE|NO CHOICE))|RLWL|PQWL", re.DOTALL | re.IGNORECASE)
+
+_IRCTC_HEADER_PATTERN = re.compile(
+    r"Booked From\s+To\s+(?P<stations>.*?)Start Date\* (?P<departure_date>\S*)\s.*?PNR Train No\./Name Class\n(?P<pnr>\d+) (?P<train_number>\d\d\d\d\d)", re.DOTALL | re.IGNORECASE)
+
+_IRCTC_STATIONS_PATTERN = re.compile(
+    r"Booked From\s+To\s+(.*?)Start Date", re.DOTALL | re.IGNORECASE)
+
+_IRCTC_STATION_CODE_PATTERN = re.compile(r"\((\w+)\)")
+
+_IRCTC_FALLBACK_PATTERNS = [
+    re.compile(r"Start Date\* (?P<departure_date>.*?)\s",
+               re.DOTALL | re.IGNORECASE),
+    re.compile(r"PNR Train No./Name Class\n(?P<pnr>\d+) (?P<train_number>\d\d\d\d\d)",
+               re.DOTALL | re.IGNORECASE),
+    _IRCTC_SEATING_PATTERN,
+]
+
 
 class Ticket:
-    def __init__(self: Self, filepath: Path, model: Model, config: Configuration) -> None:
+    # ticket_text can be supplied if the text of the ticket has already been extracted, and digest if its contents have been hashed
+    def __init__(self: Self, filepath: Path, model: Model, config: Configuration, ticket_text: str | None = None, digest: str | None = None) -> None:
         self._filepath = filepath
 
-        log(LogLevel.Status, config, "\tExtracting Ticket text")
-        with PdfReader(self._filepath) as pdf:
-            ticket_text = pdf.pages[0].extract_text()
+        if ticket_text is None:
+            ticket_text = self.extract_text(self._filepath, config)
 
-        if ticket_text.find("IRCTC") != -1:
+        if self.is_irctc_ticket(ticket_text):
             log(LogLevel.Status, config, "\tIdentified ticket as IRCTC ticket")
             self._data = self._process_as_irctc_tkt(ticket_text, config)
         else:
             log(LogLevel.Status, config,
                 "Couldn't identify the type of ticket to parse. Parsing with AI Model.")
-            self._data = self._process_with_ai_model(
-                self._filepath, model, config)
+            with metrics.span("ai_parse"):
+                self._data = self._process_with_ai_model(
+                    self._filepath, model, config, digest)
+
+    # A ticket that was parsed before, like one resumed from the journal
+    @classmethod
+    def from_data(cls: type[Self], filepath: Path, data: TravelData) -> Self:
+        ticket = cls.__new__(cls)
+        ticket._filepath = filepath
+        ticket._data = data
+        return ticket
+
+    @staticmethod
+    def extract_text(ticket_fp: Path, config: Configuration) -> str:
+        from pypdf import PdfReader
+
+        log(LogLevel.Status, config, "\tExtracting Ticket text")
+        with metrics.span("pdf_extract"), PdfReader(ticket_fp) as pdf:
+            return pdf.pages[0].extract_text()
+
+    @staticmethod
+    def is_irctc_ticket(ticket_text: str) -> bool:
+        return ticket_text.find("IRCTC") != -1
+
+    # Just the train number of an IRCTC ticket without parsing the rest of it. None if it can't be found
+    @staticmethod
+    def irctc_train_number(ticket_text: str) -> str | None:
+        if (data := Ticket._match_irctc_fields(ticket_text)) is not None:
+            return data["train_number"]
+
+        match = _IRCTC_FALLBACK_PATTERNS[1].search(ticket_text)
+        return None if match is None else match.group("train_number")
 
     def _process_as_irctc_tkt(self: Self, ticket_text: str, config: Configuration) -> TravelData:
-        data = self._extract_data_from_irctc_ticket(
-            self._filepath, ticket_text, config)
+        with metrics.span("irctc_fields"):
+            data = self._extract_data_from_irctc_ticket(
+                self._filepath, ticket_text, config)
 
         log(LogLevel.Status, config,
             f"\tFiguring out information for train number: {data["train_number"]} from RailRadar")
 
-        rrh = self._get_rrh_stations_marked(data, ticket_text, config)
+        with metrics.span("station_resolution"):
+            rrh = self._get_rrh_stations_marked(data, ticket_text, config)
 
         if rrh.is_data_missing:
             raise Exception(
@@ -62,33 +115,31 @@ class Ticket:
             event_color=data["event_color"],
         )
 
-    def _extract_data_from_irctc_ticket(self: Self, ticket_fp: Path, ticket_text: str, config: Configuration) -> dict:
+    @staticmethod
+    def _extract_data_from_irctc_ticket(ticket_fp: Path, ticket_text: str, config: Configuration) -> dict:
         # Collecting:
         # 1. Date of departure
         # 2. PNR number for generating TTC ID
         # 3. Train number for getting any departure/arrival station name, code and time through RailRadar
         # 4. Seating arrangement if available to include in event description
+        # 5. The "Booked From ... To" extract which is where the station codes are searched for later
 
-        PATTERNS = [
-            r"Start Date\* (?P<departure_date>.*?)\s",
-            r"PNR Train No./Name Class\n(?P<pnr>\d+) (?P<train_number>\d\d\d\d\d)",
-            r"CNF/(?P<seating>\w\d{1,2}/\d{1,2}/(?:SIDE )?(?:UPPER|MIDDLE|LOWER|WINDOW SIDE|NO CHOICE))|RLWL|PQWL",
-        ]
-        IRCTC_DATE_FORMAT = "%d-%b-%Y"
+        data = Ticket._match_irctc_fields(ticket_text)
 
+        if data is None:
+            # Header block wasn't laid out the way we expect. Fall back to searching the full text for every field
+            stations = _IRCTC_STATIONS_PATTERN.search(ticket_text)
+            data = {"stations": ticket_text if stations is None else stations.group(1)}
+            for i, pattern in enumerate(_IRCTC_FALLBACK_PATTERNS, 1):
+                match = pattern.search(ticket_text)
 
-        data = {}
-        for i, pattern in enumerate(PATTERNS, 1):
-            match = re.search(pattern, ticket_text,
-                              flags=re.DOTALL | re.IGNORECASE)
+                if match is None:
+                    raise Exception(
+                        f"IRCTC ticket.\nCouldn't find something in pattern no.: {i} search group from IRCTC ticket {ticket_fp}")
 
-            if match is None:
-                raise Exception(
-                    f"IRCTC ticket.\nCouldn't find something in pattern no.: {i} search group from IRCTC ticket {ticket_fp}")
+                data.update(match.groupdict())
 
-            data.update(match.groupdict())
-
-        data["event_color"] = self._color_from_ticket(ticket_text, config)
+        data["event_color"] = Ticket._color_from_ticket(ticket_text, config)
         data["departure_date"] = datetime.strptime(
             data["departure_date"], IRCTC_DATE_FORMAT
         )
@@ -98,6 +149,22 @@ class Ticket:
 
         return data
 
+    @staticmethod
+    def _match_irctc_fields(ticket_text: str) -> dict | None:
+        # Single pass over the ticket: locate the header block once and only search small slices of the text after that
+        header = _IRCTC_HEADER_PATTERN.search(ticket_text)
+        if header is None:
+            return None
+
+        # Passenger details (and hence the booking status) always follow the header
+        seating = _IRCTC_SEATING_PATTERN.search(ticket_text, header.end())
+        if seating is None:
+            return None
+
+        data = header.groupdict()
+        data["seating"] = seating.group("seating")
+        return data
+
     @staticmethod
     def _color_from_ticket(ticket_text: str, config: Configuration) -> CalendarEventColor:
         ticket_text = ticket_text.lower()
@@ -112,12 +179,11 @@ class Ticket:
         rrh = RailRadarHandler(
             data["train_number"], data["departure_date"], config)
 
-        # Strip off any part of the text where we know the station code won't be present to make the search more efficient
-        code_extract = re.search(
-            r"Booked From\s+To\s+(.*?)Start Date", ticket_text, re.DOTALL | re.IGNORECASE)
+        # Only the "Booked From ... To" extract found while parsing can contain the station codes; that keeps the search small
+        code_extract = data["stations"]
 
-        code_extract = ticket_text if code_extract is None else code_extract.group(
-            1)
+        if Ticket._mark_stations_from_index(rrh, code_extract):
+            return rrh
 
         for code, mark in rrh.station_codes():
             code_match = re.search(
@@ -133,9 +199,41 @@ class Ticket:
 
         return rrh
 
+    # IRCTC prints station codes in brackets like "KALYAN JN (KYN)". Look each of those up in the route's station index instead of
+    # searching the extract once per station of the route. Returns False if that wasn't enough to mark both stations
     @staticmethod
-    def _process_with_ai_model(ticket_fp: Path, model: Model, config: Configuration) -> TravelData:
-        TICKET_EXTRACTION_PROMPT = """
+    def _mark_stations_from_index(rrh: RailRadarHandler, code_extract: str) -> bool:
+        # (position in route, position in extract, station)
+        found = []
+        for code_match in _IRCTC_STATION_CODE_PATTERN.finditer(code_extract):
+            if (station := rrh.station(code_match.group(1))) is not None:
+                found.append((station[0], code_match.start(), station[1]))
+
+        if len(found) < 2:
+            return False
+
+        # Same stations the linear search would pick: the earliest halt in the route is the departure station and the next halt
+        # that's written after it in the ticket is the arrival station
+        departure = min(found, key=lambda entry: entry[0])
+        arrival = min(
+            (entry for entry in found if entry[0] > departure[0] and entry[1] > departure[1]),
+            key=lambda entry: entry[0], default=None
+        )
+        if arrival is None:
+            return False
+
+        rrh.mark_as_departure_station(departure[2])()
+        rrh.mark_as_arrival_station(arrival[2])()
+        return True
+
+    @staticmethod
+    def _process_with_ai_model(ticket_fp: Path, model: Model, config: Configuration, digest: str | None) -> TravelData:
+        return Ticket.travel_data_from_ai_response(model.parse(ticket_fp, Ticket.ai_prompt(), config, digest), config)
+
+    # What the AI model is asked to extract from a ticket
+    @staticmethod
+    def ai_prompt() -> str:
+        return """
 Analyze this travel ticket (flight/train/bus) and extract information in valid JSON format.
 
 CRITICAL REQUIREMENTS:
@@ -172,8 +270,9 @@ EXTRACTION STRATEGY:
 2. Look for PNR/booking reference prominently displayed
 3. Extract departure/arrival times - they're usually in 24-hour format
 """
-        response = model.parse(ticket_fp, TICKET_EXTRACTION_PROMPT, config)
 
+    @staticmethod
+    def travel_data_from_ai_response(response: str, config: Configuration) -> TravelData:
         if "```json" in response:
             response = response.split(
                 "```json")[1].split("```")[0]
@@ -192,6 +291,10 @@ EXTRACTION STRATEGY:
             config.traveller_to_color(response["traveller"]),
         )
 
+    @property
+    def data(self: Self) -> TravelData:
+        return self._data
+
     @property
     def ttc_id(self: Self) -> str:
         return self._data.ttc_id
@@ -1,115 +1,393 @@
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, fields
 from datetime import datetime
 from pathlib import Path
 import sys
+import threading
 import time
-from typing import Self
+from typing import TYPE_CHECKING, Self
 
 from watchdog.events import DirCreatedEvent, FileCreatedEvent, PatternMatchingEventHandler
 
 from AiModelHandler import Model
 from Configuration import Configuration
+from DoneScheduler import DoneScheduler
+from JobQueue import JobQueue
 from ConfigurationHandler import _ConfigurationHandler
-from GServicesHandler import GServicesHandler
 from Logger import LogLevel, log
+from Metrics import metrics
+from RailRadarHandler import RailRadarHandler
 from Ticket import Ticket
+from TicketJournal import journal
 from common import notify
 
+# The Google API client libraries take a while to import. They're imported when the handler is created instead of with this module
+if TYPE_CHECKING:
+    from GServicesHandler import GServicesHandler
+
+
+@dataclass
+class TicketResult:
+    ticket_fp: Path
+    result: str  # One of parse_failed, api_failed, already_present, created or done
+    link: str | None  # Of the calendar event
+    seconds: float
+
+    @property
+    def failed(self: Self) -> bool:
+        return self.result in ["parse_failed", "api_failed"]
+
 
 class TicketFolderHandler(PatternMatchingEventHandler):
-    def __init__(self: Self, config_handler: _ConfigurationHandler) -> None:
+    # scan is whether to process the tickets already in the ticket folder right away
+    # With a tenant, the handler works on that tenant's ticket folder with its credentials and calendar. The AI model and the done
+    # scheduler can be passed in to share them between the handlers of all the tenants
+    # With a queue, tickets are only put in the job queue for the workers to process instead of being processed here
+    # Without schedule_done, tickets of journeys which have already ended are still marked as done but no done scheduler is run
+    def __init__(self: Self, config_handler: _ConfigurationHandler, scan: bool = True, tenant: str | None = None, model: Model | None = None, done_scheduler: DoneScheduler | None = None, queue: JobQueue | None = None, schedule_done: bool = True) -> None:
+        self._tenant = tenant
+        self._queue = queue
+        self._config = config_handler.config if tenant is None else config_handler.config.get_tenant(
+            tenant)
+
         super().__init__(patterns=["*.pdf"],
-                         ignore_directories=True, ignore_patterns=[f"{config_handler.config.done_folder}/*.pdf"])
-        self.config = config_handler.config
+                         ignore_directories=True)
+        self._ignored = self._done_patterns(self._config)
+
+        self._owns_done_scheduler = False
+        if queue is not None:
+            config_handler.subscribe(self._on_config_change)
+            if scan:
+                for ticket_fp in self.config.ticket_folder.glob("*.pdf"):
+                    queue.enqueue(ticket_fp, tenant)
+            return
 
         try:
+            from GServicesHandler import GServicesHandler
+
             self._gsh = GServicesHandler(self.config)
+            # Held while swapping in the Google services for new credentials and while a ticket picks them up
+            self._gsh_lock = threading.Lock()
         except Exception as error:
             log(LogLevel.Error, self.config,
                 f"Unhandled exception {error} while initializing Google APIs. Exiting...")
             sys.exit(-1)
 
-        self._model = Model()
+        self._model = Model() if model is None else model
+
+        # Journeys which ended while the program wasn't running are marked as done right away
+        self._owns_done_scheduler = schedule_done and done_scheduler is None
+        self._done_scheduler = DoneScheduler(
+            self.config) if self._owns_done_scheduler else done_scheduler
+        if self._owns_done_scheduler:
+            self._done_scheduler.start()
+
+        # Results of the tickets added while running which are waiting to be summed up, when notify_each_ticket is off
+        self._summary_lock = threading.Lock()
+        self._pending_results: list[TicketResult] = []
+        self._summary_timer: threading.Timer | None = None
+
+        config_handler.subscribe(self._on_config_change)
+
+        if scan:
+            self.process_batch(
+                list(self.config.ticket_folder.glob("*.pdf")), 1)
+
+    # Processes tickets which are already in place, up to workers at a time, without any per ticket notifications
+    # With async_engine the tickets are processed as coroutines instead and workers doesn't apply
+    def process_batch(self: Self, ticket_fps: list[Path], workers: int) -> list[TicketResult]:
+        config = self.config
+
+        if config.async_engine:
+            from AsyncEngine import AsyncEngine
+
+            with self._gsh_lock:
+                gsh = self._gsh
+            results = AsyncEngine(gsh, self._model,
+                                  self._done_scheduler, config).process_batch(ticket_fps)
+            self._notify_summary(results, config)
+            return results
+
+        ticket_texts = self._prefetch_routes(ticket_fps, config)
+
+        def process(ticket_fp: Path) -> TicketResult:
+            return self._process_ticket(ticket_fp, config, False, ticket_texts.get(ticket_fp))
 
-        for ticket_fp in self.config.ticket_folder.glob("*.pdf"):
-            self._process_ticket(ticket_fp, self._gsh,
-                                 self._model, self.config, False)
+        if workers <= 1:
+            results = [process(ticket_fp) for ticket_fp in ticket_fps]
+        else:
+            with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="ticket") as executor:
+                results = list(executor.map(process, ticket_fps))
+
+        self._notify_summary(results, config)
+        return results
+
+    # Processes a ticket which was added while the program is running. It gets notifications of its own unless notify_each_ticket
+    # is off, in which case it's summed up along with the other tickets added within ticket_summary_window
+    def process_new_ticket(self: Self, ticket_fp: Path, config: Configuration | None = None) -> TicketResult:
+        config = self.config if config is None else config
+
+        if config.notify_each_ticket:
+            notify("Detected New Ticket", f"Processing {ticket_fp}", config)
+
+        result = self._process_ticket(
+            ticket_fp, config, config.notify_each_ticket)
+
+        if not config.notify_each_ticket:
+            self._add_to_summary(result, config)
+        return result
+
+    # Stops the done scheduler if the handler runs its own
+    def stop(self: Self) -> None:
+        if self._owns_done_scheduler:
+            self._done_scheduler.stop()
+            self._done_scheduler.join()
+
+    # Always the latest configuration (of the tenant if there's one). It's swapped out whenever config.toml changes
+    @property
+    def config(self: Self) -> Configuration:
+        return self._config
+
+    @property
+    def tenant(self: Self) -> str | None:
+        return self._tenant
+
+    # Worked out again whenever done_folder changes
+    @property
+    def ignore_patterns(self: Self) -> list[str]:
+        return self._ignored
 
     def on_created(self: Self, event: DirCreatedEvent | FileCreatedEvent) -> None:
         if isinstance(event.src_path, str):
+            # The same configuration is used throughout a ticket even if config.toml changes midway
+            config = self.config
+
             ticket_fp = Path(event.src_path)
-            if self._wait_for_transfer_completion(ticket_fp, self.config):
-                notify("Detected New Ticket",
-                       f"Processing {event.src_path}", self.config)
+            if self._wait_for_transfer_completion(ticket_fp, config):
+                if self._queue is not None:
+                    self._queue.enqueue(ticket_fp, self._tenant)
+                    return
 
-                self._process_ticket(ticket_fp, self._gsh,
-                                     self._model, self.config, True)
+                self.process_new_ticket(ticket_fp, config)
 
             else:
-                notify("Skipping Ticket",
-                       f"{event.src_path} due to timeout", self.config)
-                log(LogLevel.Warning, self.config,
+                if config.notify_each_ticket:
+                    notify("Skipping Ticket",
+                           f"{event.src_path} due to timeout", config)
+                log(LogLevel.Warning, config,
                     f"Timeout reached but file transfer not complete. Skipping ticket '{ticket_fp}'...")
 
-    def _process_ticket(self: Self, ticket_fp: Path, gsh: GServicesHandler, model: Model, config: Configuration, to_notify: bool) -> None:
-        log(LogLevel.Status, config, f"Processing {ticket_fp}")
+    # Only rebuilds what depends on the keys that changed. Everything else reads the configuration per ticket
+    def _on_config_change(self: Self, old: Configuration, new: Configuration, changed: set[str]) -> None:
+        if self._tenant is not None:
+            try:
+                new = new.get_tenant(self._tenant)
+            except KeyError:
+                log(LogLevel.Warning, new,
+                    f"Tenant '{self._tenant}' was removed from the configuration. Its tickets are handled as before till a restart")
+                return
 
-        try:
-            ticket = Ticket(ticket_fp, model, config)
-        except Exception as error:
-            log(LogLevel.Error, config,
-                f"Failure to parse ticket: {error}")
-            log(LogLevel.Error, config,
-                "Unimplemented feature of user intervention to supply correct info. Skipping ticket...")
-            notify("Skipping Ticket",
-                   f"Failure to parse {ticket_fp}", config)
+            old = self._config
+            changed = {field.name for field in fields(Configuration) if getattr(
+                old, field.name) != getattr(new, field.name)}
+
+        self._config = new
+        if "done_folder" in changed:
+            self._ignored = self._done_patterns(new)
+
+        if self._queue is not None:
+            self._queue.config = new
             return
 
+        if self._owns_done_scheduler:
+            self._done_scheduler.config = new
+
+        if changed & {"gapi_credentials_path", "gapi_token_path"}:
+            from GServicesHandler import GServicesHandler
+
+            # Tickets being processed carry on with the services they started with
+            try:
+                gsh = GServicesHandler(new)
+                with self._gsh_lock:
+                    self._gsh = gsh
+                log(LogLevel.Status, new, "Reinitialized Google APIs")
+            except Exception as error:
+                log(LogLevel.Error, new,
+                    f"Failure to reinitialize Google APIs: {error}. Continuing with the previous credentials")
+
+        if "ai_model_credentials_path" in changed:
+            self._model.reset()
+
+    # Per ticket notifications are only sent when to_notify is set
+    def _process_ticket(self: Self, ticket_fp: Path, config: Configuration, to_notify: bool, ticket_text: str | None = None) -> TicketResult:
+        with self._gsh_lock:
+            gsh = self._gsh
+
+        start = time.perf_counter()
+        with metrics.span("ticket"):
+            result, link = self._process_ticket_steps(
+                ticket_fp, gsh, self._model, config, to_notify, ticket_text)
+        metrics.count("tickets", result=result)
+        return TicketResult(ticket_fp, result, link, time.perf_counter() - start)
+
+    # One notification for a whole batch of tickets processed without per ticket notifications
+    @staticmethod
+    def _notify_summary(results: list[TicketResult], config: Configuration) -> None:
+        if not results:
+            return
+
+        failed = sum(result.failed for result in results)
+        notify("Processed Tickets",
+               f"Processed {len(results)} tickets, {failed} failed", config)
+
+    def _add_to_summary(self: Self, result: TicketResult, config: Configuration) -> None:
+        with self._summary_lock:
+            self._pending_results.append(result)
+            if self._summary_timer is None:
+                self._summary_timer = threading.Timer(
+                    config.ticket_summary_window.total_seconds(), self._send_summary, (config,))
+                self._summary_timer.daemon = True
+                self._summary_timer.start()
+
+    def _send_summary(self: Self, config: Configuration) -> None:
+        with self._summary_lock:
+            results, self._pending_results = self._pending_results, []
+            self._summary_timer = None
+        self._notify_summary(results, config)
+
+    # Returns how processing the ticket ended up along with the link to its calendar event
+    def _process_ticket_steps(self: Self, ticket_fp: Path, gsh: "GServicesHandler", model: Model, config: Configuration, to_notify: bool, ticket_text: str | None) -> tuple[str, str | None]:
+        log(LogLevel.Status, config, f"Processing {ticket_fp}")
+
+        # Steps done by an earlier attempt at the ticket are skipped
+        checkpoint = journal.begin(ticket_fp, config)
+
+        if checkpoint.data is not None:
+            log(LogLevel.Status, config,
+                "\tResuming from where the last attempt at the ticket stopped")
+            metrics.count("journal_resumes")
+            ticket = Ticket.from_data(ticket_fp, checkpoint.data)
+        else:
+            try:
+                with metrics.span("parse"):
+                    ticket = Ticket(ticket_fp, model, config,
+                                    ticket_text, checkpoint.digest)
+            except Exception as error:
+                log(LogLevel.Error, config,
+                    f"Failure to parse ticket: {error}")
+                log(LogLevel.Error, config,
+                    "Unimplemented feature of user intervention to supply correct info. Skipping ticket...")
+                if to_notify:
+                    notify("Skipping Ticket",
+                           f"Failure to parse {ticket_fp}", config)
+                return "parse_failed", None
+
+            checkpoint.data = ticket.data
+            journal.save(checkpoint, config)
+
         try:
-            if link := gsh.calendar.event_exists(ticket.ttc_id, config):
+            # An event created by the last attempt is as good as one found in the calendar
+            link = checkpoint.link
+            if link is None:
+                with metrics.span("calendar_lookup"):
+                    link = gsh.calendar.event_exists(ticket.ttc_id, config)
+
+            if link:
                 log(LogLevel.Status, config,
                     f"\tFound the event at {link}. Not creating it again")
+                result = "already_present"
 
-                if datetime.now() > ticket.arrival:
-                    self._mark_as_done(ticket_fp, config)
-                    notify("Journey marked as Done!",
-                           f"Hope your journey from {ticket.from_where} to {ticket.to_where} was successful :)", config)
+                # A ticket which can't be moved now is left to the done scheduler
+                if datetime.now() > ticket.arrival and DoneScheduler.mark_as_done(ticket_fp, ticket.arrival, config.done_folder, config):
+                    if to_notify:
+                        notify("Journey marked as Done!",
+                               f"Hope your journey from {ticket.from_where} to {ticket.to_where} was successful :)", config)
+                    result = "done"
 
                 elif to_notify:
                     notify("Event Already Present",
                            f"{ticket_fp} at {link}", config)
             else:
-                log(LogLevel.Status, config,
-                    f"\tUploading {ticket_fp} to Google Drive")
-                upload_response = gsh.drive.upload_pdf(ticket_fp, config)
-
+                upload_response = checkpoint.upload
                 if upload_response:
                     log(LogLevel.Status, config,
-                        f"\tUploaded {ticket_fp} to {upload_response.webViewLink}")
+                        f"\tAlready uploaded {ticket_fp} to {upload_response.webViewLink}")
                 else:
-                    log(LogLevel.Warning, config,
-                        f"Failure to upload {ticket_fp}")
+                    log(LogLevel.Status, config,
+                        f"\tUploading {ticket_fp} to Google Drive")
+                    with metrics.span("drive_upload"):
+                        upload_response = gsh.drive.upload_pdf(
+                            ticket_fp, config)
+
+                    if upload_response:
+                        log(LogLevel.Status, config,
+                            f"\tUploaded {ticket_fp} to {upload_response.webViewLink}")
+                        checkpoint.upload = upload_response
+                        journal.save(checkpoint, config)
+                    else:
+                        log(LogLevel.Warning, config,
+                            f"Failure to upload {ticket_fp}")
 
                 log(LogLevel.Status, config, "\tCreating event")
-                link = gsh.calendar.insert_event(ticket.ttc_id, ticket.summary, ticket.from_where,
-                                                 ticket.description, upload_response, ticket.departure, ticket.arrival, ticket.color, config)
+                with metrics.span("calendar_insert"):
+                    link = gsh.calendar.insert_event(ticket.ttc_id, ticket.summary, ticket.from_where,
+                                                     ticket.description, upload_response, ticket.departure, ticket.arrival, ticket.color, config)
                 log(LogLevel.Status, config, f"\tEvent created at {link}")
+                checkpoint.link = link
+                journal.save(checkpoint, config)
+                result = "created"
 
                 if to_notify:
                     notify("Finished Processing Ticket",
                            f"{ticket_fp} to {link}", config)
-            log(LogLevel.Status, config, f"Finished processing {ticket_fp}")
+
+            if result != "done" and self._done_scheduler is not None:
+                self._done_scheduler.schedule(
+                    ticket_fp, ticket.arrival, ticket.from_where, ticket.to_where, config.done_folder)
         except Exception as error:
             log(LogLevel.Error, config,
                 "Failure to perform some Google API call. Skipping ticket...")
+            return "api_failed", None
 
+        journal.clear(ticket_fp, config)
+        log(LogLevel.Status, config, f"Finished processing {ticket_fp}")
+        return result, link
+
+    # Gets the routes of every train in the pending IRCTC tickets in one go instead of one ticket at a time
+    # Returns the extracted text of the tickets so that they don't need to be extracted again while processing
     @staticmethod
-    def _mark_as_done(ticket_fp: Path, config: Configuration) -> None:
-        try:
-            config.done_folder.mkdir(parents=True, exist_ok=True)
-            ticket_fp.rename(config.done_folder / ticket_fp.name)
-        except Exception as error:
-            log(LogLevel.Warning, config,
-                f"Error marking {ticket_fp} as done: {error}")
+    def _prefetch_routes(ticket_fps: list[Path], config: Configuration) -> dict[Path, str]:
+        ticket_texts, train_numbers = TicketFolderHandler._extract_texts(
+            ticket_fps, config)
+        RailRadarHandler.prefetch(train_numbers, config)
+        return ticket_texts
+
+    # The text of each ticket and the train numbers of the IRCTC tickets among them
+    @staticmethod
+    def _extract_texts(ticket_fps: list[Path], config: Configuration) -> tuple[dict[Path, str], set[str]]:
+        ticket_texts = {}
+        train_numbers = set()
+
+        for ticket_fp in ticket_fps:
+            try:
+                ticket_text = Ticket.extract_text(ticket_fp, config)
+            except Exception as error:
+                # Reported when the ticket is processed
+                log(LogLevel.Warning, config,
+                    f"Failure to extract text from {ticket_fp}: {error}")
+                continue
+
+            ticket_texts[ticket_fp] = ticket_text
+            if Ticket.is_irctc_ticket(ticket_text) and (train_number := Ticket.irctc_train_number(ticket_text)) is not None:
+                train_numbers.add(train_number)
+
+        return ticket_texts, train_numbers
+
+    # Tickets in done_folder, flat or in its year/month folders. FolderWatch keeps events from there from arriving in the first place
+    # but an observer may not be able to leave it out, like when done_folder is the ticket folder itself
+    @staticmethod
+    def _done_patterns(config: Configuration) -> list[str]:
+        return [f"{config.done_folder}/*.pdf", f"{config.done_folder}/*/*/*.pdf"]
 
     # The on_created event fires as soon as the file is created. This may result in the script getting an incompletely transferred file to parse resulting in parsing errors
     # Hence we are polling every file_transfer_polling_interval seconds to check if the file size of the ticket is growing or not
@@ -0,0 +1,181 @@
+from dataclasses import asdict, dataclass
+from datetime import datetime, timedelta
+import hashlib
+import json
+from pathlib import Path
+import sqlite3
+import threading
+import time
+from typing import TYPE_CHECKING, Self
+
+from Configuration import Configuration
+from Logger import LogLevel, log
+from TravelData import TravelData, TravelDataField, TravelType
+from common import CalendarEventColor
+
+if TYPE_CHECKING:
+    from GDrive import FileUploadResponse
+
+
+# How far processing a ticket got. Whatever is set here has been done and isn't done again
+@dataclass
+class Checkpoint:
+    ticket_fp: Path
+    digest: str | None  # Of the ticket's contents. A ticket replaced by a different one with the same name starts over
+    data: TravelData | None = None  # Parsed
+    upload: "FileUploadResponse | None" = None  # Uploaded to Google Drive
+    link: str | None = None  # Of the created calendar event
+    journaled: bool = True  # False once the journal couldn't be used. The ticket is still processed, just without checkpoints
+
+
+# Progress of the tickets being processed, saved after every step in a SQLite database in the cache folder
+# If the program dies or a Google API call fails half way through a ticket, the next attempt resumes the ticket at the step it
+# stopped at instead of parsing it again and uploading another copy of it to Google Drive
+# A ticket's entry is removed once it has been processed. Entries of tickets which never finish are removed after a while
+# The journal only saves work. When it can't be used, like when another process keeps it locked or it's damaged, tickets are
+# processed without it
+class TicketJournal:
+    _db_name = "journal.sqlite3"
+    _retention = timedelta(days=30)
+
+    def __init__(self: Self) -> None:
+        self._lock = threading.Lock()
+        self._connection: sqlite3.Connection | None = None
+        self._db_fp: Path | None = None
+
+    def begin(self: Self, ticket_fp: Path, config: Configuration) -> Checkpoint:
+        try:
+            digest = hashlib.sha1(ticket_fp.read_bytes()).hexdigest()
+        except OSError:
+            return Checkpoint(ticket_fp, None)  # Fails again while parsing, where it's reported
+
+        try:
+            with self._lock:
+                row = self._connect(config).execute(
+                    "SELECT digest, data, upload, link FROM checkpoints WHERE ticket_fp = ?", (str(ticket_fp),)).fetchone()
+        except (sqlite3.Error, OSError) as error:
+            log(LogLevel.Warning, config,
+                f"Failure to read the journal. Processing {ticket_fp} without it: {error}")
+            return Checkpoint(ticket_fp, digest, journaled=False)
+
+        if row is None or row[0] != digest:
+            return Checkpoint(ticket_fp, digest)
+
+        try:
+            return Checkpoint(ticket_fp, digest, self._decode_data(row[1]), self._decode_upload(row[2]), row[3])
+        except Exception as error:
+            log(LogLevel.Warning, config,
+                f"Failure to read the checkpoint of {ticket_fp}. Starting over: {error}")
+            return Checkpoint(ticket_fp, digest)
+
+    def save(self: Self, checkpoint: Checkpoint, config: Configuration) -> None:
+        if checkpoint.digest is None or not checkpoint.journaled:
+            return
+
+        try:
+            with self._lock:
+                connection = self._connect(config)
+                with connection:
+                    connection.execute("""
+                        INSERT OR REPLACE INTO checkpoints (ticket_fp, digest, data, upload, link, updated_at) VALUES (?, ?, ?, ?, ?, ?)
+                    """, (str(checkpoint.ticket_fp), checkpoint.digest, self._encode_data(checkpoint.data),
+                          None if checkpoint.upload is None else json.dumps(
+                              asdict(checkpoint.upload)),
+                          checkpoint.link, time.time()))
+        except (sqlite3.Error, OSError) as error:
+            log(LogLevel.Warning, config,
+                f"Failure to save the progress of {checkpoint.ticket_fp} to the journal. Going on without it: {error}")
+            checkpoint.journaled = False
+
+    # An entry which can't be removed now is removed once its ticket is processed again or its retention runs out
+    def clear(self: Self, ticket_fp: Path, config: Configuration) -> None:
+        try:
+            with self._lock:
+                connection = self._connect(config)
+                with connection:
+                    connection.execute(
+                        "DELETE FROM checkpoints WHERE ticket_fp = ?", (str(ticket_fp),))
+        except (sqlite3.Error, OSError) as error:
+            log(LogLevel.Warning, config,
+                f"Failure to remove {ticket_fp} from the journal: {error}")
+
+    # Must be called with self._lock held
+    def _connect(self: Self, config: Configuration) -> sqlite3.Connection:
+        db_fp = config.cache_folder / self._db_name
+        if self._connection is not None and self._db_fp == db_fp:
+            return self._connection
+
+        if self._connection is not None:
+            self._connection.close()
+            self._connection = None
+
+        db_fp.parent.mkdir(parents=True, exist_ok=True)
+        # Job queue workers in other processes share the journal, hence the timeout
+        connection = sqlite3.connect(
+            db_fp, timeout=30, check_same_thread=False)
+        try:
+            connection.execute("PRAGMA journal_mode = WAL")
+            connection.execute("PRAGMA synchronous = FULL")
+            connection.executescript("""
+                CREATE TABLE IF NOT EXISTS checkpoints (
+                    ticket_fp TEXT PRIMARY KEY,
+                    digest TEXT NOT NULL,
+                    data TEXT,
+                    upload TEXT,
+                    link TEXT,
+                    updated_at REAL NOT NULL
+                );
+            """)
+            with connection:
+                connection.execute("DELETE FROM checkpoints WHERE updated_at < ?",
+                                   (time.time() - self._retention.total_seconds(),))
+        except sqlite3.Error:
+            connection.close()
+            raise
+
+        self._connection = connection
+        self._db_fp = db_fp
+        return connection
+
+    @staticmethod
+    def _encode_data(data: TravelData | None) -> str | None:
+        if data is None:
+            return None
+
+        return json.dumps({
+            "travel_type": data.travel_type.name,
+            "description": data.description,
+            "departure": {"where": data.departure.where, "when": data.departure.when.isoformat()},
+            "arrival": {"where": data.arrival.where, "when": data.arrival.when.isoformat()},
+            "ttc_id": data.ttc_id,
+            "event_color": data.event_color.name,
+        })
+
+    @staticmethod
+    def _decode_data(encoded: str | None) -> TravelData | None:
+        if encoded is None:
+            return None
+
+        data = json.loads(encoded)
+        return TravelData(
+            TravelType[data["travel_type"]],
+            data["description"],
+            TravelDataField(data["departure"]["where"],
+                            datetime.fromisoformat(data["departure"]["when"])),
+            TravelDataField(data["arrival"]["where"],
+                            datetime.fromisoformat(data["arrival"]["when"])),
+            data["ttc_id"],
+            CalendarEventColor[data["event_color"]],
+        )
+
+    @staticmethod
+    def _decode_upload(encoded: str | None) -> "FileUploadResponse | None":
+        if encoded is None:
+            return None
+
+        from GDrive import FileUploadResponse
+
+        return FileUploadResponse(**json.loads(encoded))
+
+
+journal = TicketJournal()
@@ -6,7 +6,8 @@ from enum import IntEnum, auto
 from common import CalendarEventColor
 
 
-@dataclass
+# Slotted, as every ticket has these. An instance without a __dict__ takes a fraction of the memory
+@dataclass(slots=True)
 class TravelDataField:
     where: str
     when: datetime
@@ -18,7 +19,7 @@ class TravelType(IntEnum):
     Bus = auto()
 
 
-@dataclass
+@dataclass(slots=True)
 class TravelData:
     travel_type: TravelType
     description: str
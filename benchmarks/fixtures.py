@@ -0,0 +1,121 @@
+# Made up IRCTC tickets, the matching RailRadar routes and a minimal PDF writer so that the benchmarks don't need real tickets
+
+from datetime import datetime, timedelta
+from pathlib import Path
+import random
+
+
+# A route the way RailRadar sends it: {"data": {"route": [...]}} with every halt of the train
+def make_route(train_number: str, halts: int, rng: random.Random) -> list[dict]:
+    route = []
+    minute = rng.randrange(0, 24 * 60)
+    for seq in range(halts):
+        code = f"S{train_number[-3:]}{seq:02d}"
+        arrival = minute
+        minute += rng.randrange(2, 15)  # Halt
+        route.append({
+            "stationCode": code,
+            "stationName": f"STATION {code} JN",
+            "day": 1 + minute // (24 * 60),
+            "scheduledArrival": arrival % (24 * 60) if seq > 0 else 0,
+            "scheduledDeparture": minute % (24 * 60),
+            "isHalt": 1,
+        })
+        minute += rng.randrange(20, 180)  # Running time to the next halt
+    return route
+
+
+FIRST_NAMES = ["john", "mark", "priya", "arjun", "meera", "rahul", "ananya", "vikram", "sneha", "rohan", "kavya", "aditya"]
+LAST_NAMES = ["doe", "sharma", "iyer", "patel", "reddy", "nair", "gupta", "menon", "das", "kulkarni"]
+
+CLASSES = ["SLEEPER CLASS (SL)", "THIRD AC (3A)", "SECOND AC (2A)", "FIRST AC (1A)", "AC CHAIR CAR (CC)"]
+BERTHS = ["LOWER", "MIDDLE", "UPPER", "SIDE LOWER", "SIDE UPPER", "WINDOW SIDE", "NO CHOICE"]
+
+
+# Booking status of a passenger as printed on the ticket. Confirmed berths look like CNF/B2/34/LOWER
+def booking_status(rng: random.Random) -> str:
+    roll = rng.random()
+    if roll < 0.8:
+        return f"CNF/{rng.choice("ABSH")}{rng.randrange(1, 13)}/{rng.randrange(1, 73)}/{rng.choice(BERTHS)}"
+    if roll < 0.9:
+        return f"RLWL/{rng.randrange(1, 60)}"
+    return f"PQWL/{rng.randrange(1, 30)}"
+
+
+# boarding and destination are halts from the train's route. passengers are (name, booking status) pairs
+# With header_first the block with the PNR is laid out before "Booked From To" which makes the parser fall back to searching for
+# every field separately
+def irctc_ticket_text(pnr: str, train_number: str, boarding: dict, destination: dict, departure_date: datetime, passengers: list[tuple[str, str]], travel_class: str = "THIRD AC (3A)", header_first: bool = False) -> str:
+    stations = [
+        "Booked From To",
+        f"{boarding["stationName"]} ({boarding["stationCode"]}) {destination["stationName"]} ({destination["stationCode"]})",
+        f"Start Date* {departure_date.strftime("%d-%b-%Y")} Departure* 10:05 {departure_date.strftime("%d-%b-%Y")} Arrival* 22:40 {departure_date.strftime("%d-%b-%Y")}",
+    ]
+    header = [
+        "PNR Train No./Name Class",
+        f"{pnr} {train_number}/EXPRESS {travel_class}",
+        "Quota Distance Booking Date",
+        "GENERAL (GN) 1320 KM 01-Jan-2026 18:02:11 HRS",
+    ]
+
+    lines = ["Electronic Reservation Slip (ERS)"]
+    lines.extend(header + stations if header_first else stations + header)
+    lines.extend(["Passenger Details",
+                  "# Name Age Gender Booking Status Current Status"])
+    for i, (name, status) in enumerate(passengers, 1):
+        lines.append(f"{i}. {name.upper()} {20 + 7 * i % 50} {"MF"[i % 2]} {status} {status}")
+    lines.append("Transaction ID: 100004567891234")
+    lines.extend(["Terms and conditions apply to this Electronic Reservation Slip (ERS)."] * 10)
+    lines.append("IRCTC")
+    return "\n".join(lines)
+
+
+# Tickets for count journeys on trains with up to max_halts halts, spread over every variant irctc_ticket_text can produce
+# Returns the tickets as (name, text) pairs along with the RailRadar routes of the trains
+def make_irctc_corpus(count: int, trains: int, max_halts: int, rng: random.Random) -> tuple[list[tuple[str, str]], dict[str, list[dict]]]:
+    routes = {str(12000 + i): make_route(str(12000 + i), rng.randrange(8, max(9, max_halts + 1)), rng)
+              for i in range(trains)}
+    train_numbers = list(routes)
+
+    tickets = []
+    for i in range(count):
+        train_number = rng.choice(train_numbers)
+        route = routes[train_number]
+        boarding = rng.randrange(0, len(route) - 1)
+        destination = rng.randrange(boarding + 1, len(route))
+        passengers = [(f"{rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)}", booking_status(rng))
+                      for _ in range(rng.choice([1, 1, 2, 2, 3, 4, 6]))]
+        tickets.append((f"irctc_{i:05d}", irctc_ticket_text(
+            f"{8000000000 + i}", train_number, route[boarding], route[destination],
+            datetime(2026, 1, 1) + timedelta(days=rng.randrange(0, 365)), passengers,
+            rng.choice(CLASSES), header_first=rng.random() < 0.05)))
+    return tickets, routes
+
+
+# One page PDF with every line of text set in Helvetica. Enough for pypdf to extract the same lines back
+def write_pdf(pdf_fp: Path, text: str) -> None:
+    def escape(line: str) -> str:
+        return line.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)")
+
+    content = "BT /F1 8 Tf 10 TL 36 806 Td\n" + \
+        "".join(f"({escape(line)}) Tj T*\n" for line in text.splitlines()) + "ET"
+
+    objects = [
+        "<< /Type /Catalog /Pages 2 0 R >>",
+        "<< /Type /Pages /Kids [3 0 R] /Count 1 >>",
+        "<< /Type /Page /Parent 2 0 R /MediaBox [0 0 595 842] /Resources << /Font << /F1 4 0 R >> >> /Contents 5 0 R >>",
+        "<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica /Encoding /WinAnsiEncoding >>",
+        f"<< /Length {len(content.encode("latin-1"))} >>\nstream\n{content}\nendstream",
+    ]
+
+    pdf = b"%PDF-1.4\n"
+    offsets = []
+    for number, body in enumerate(objects, 1):
+        offsets.append(len(pdf))
+        pdf += f"{number} 0 obj\n{body}\nendobj\n".encode("latin-1")
+
+    xref_offset = len(pdf)
+    pdf += f"xref\n0 {len(objects) + 1}\n0000000000 65535 f \n".encode()
+    pdf += "".join(f"{offset:010d} 00000 n \n" for offset in offsets).encode()
+    pdf += f"trailer\n<< /Size {len(objects) + 1} /Root 1 0 R >>\nstartxref\n{xref_offset}\n%%EOF\n".encode()
+    pdf_fp.write_bytes(pdf)
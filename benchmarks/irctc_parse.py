@@ -0,0 +1,69 @@
+# Microbenchmark for the IRCTC field extraction hot path
+# Run from the project folder: python -m benchmarks.irctc_parse [--iterations N]
+
+import argparse
+import re
+import timeit
+
+from Ticket import Ticket
+
+SAMPLE_TICKET_TEXT = """Electronic Reservation Slip (ERS)
+Booked From To
+KALYAN JN (KYN) MUMBAI CSMT (CSMT)
+Start Date* 12-Jan-2026 Departure* 10:05 12-Jan-2026 Arrival* 22:40 12-Jan-2026
+PNR Train No./Name Class
+8234567890 12110/PANCHAVATI EXP THIRD AC (3A)
+Quota Distance Booking Date
+GENERAL (GN) 1320 KM 01-Jan-2026 18:02:11 HRS
+Passenger Details
+# Name Age Gender Booking Status Current Status
+1. JOHN DOE 30 M CNF/B2/34/LOWER CNF/B2/34/LOWER
+2. MARK DOE 28 M CNF/B2/35/MIDDLE CNF/B2/35/MIDDLE
+Transaction ID: 100004567891234
+IR recovers only 57% of cost of travel on an average.
+""" + "Terms and conditions apply to this Electronic Reservation Slip (ERS). " * 40 + "IRCTC"
+
+# The extraction as it was before the patterns were precompiled and combined; kept here as the baseline
+_LEGACY_PATTERNS = [
+    r"Start Date\* (?P<departure_date>.*?)\s",
+    r"PNR Train No./Name Class\n(?P<pnr>\d+) (?P<train_number>\d\d\d\d\d)",
+    r"CNF/(?P<seating>\w\d{1,2}/\d{1,2}/(?:SIDE )?(?:UPPER|MIDDLE|LOWER|WINDOW SIDE|NO CHOICE))|RLWL|PQWL",
+]
+
+
+def legacy_extract(ticket_text: str) -> dict:
+    data = {}
+    for pattern in _LEGACY_PATTERNS:
+        match = re.search(pattern, ticket_text,
+                          flags=re.DOTALL | re.IGNORECASE)
+        assert match is not None
+        data.update(match.groupdict())
+
+    code_extract = re.search(
+        r"Booked From\s+To\s+(.*?)Start Date", ticket_text, re.DOTALL | re.IGNORECASE)
+    assert code_extract is not None
+    data["stations"] = code_extract.group(1)
+    return data
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description="Per-ticket IRCTC field extraction time")
+    parser.add_argument("--iterations", type=int, default=20000)
+    args = parser.parse_args()
+
+    legacy = legacy_extract(SAMPLE_TICKET_TEXT)
+    current = Ticket._match_irctc_fields(SAMPLE_TICKET_TEXT)
+    assert current is not None
+    for key in ["departure_date", "pnr", "train_number", "seating"]:
+        assert legacy[key] == current[key], key
+    assert legacy["stations"].strip() == current["stations"].strip()
+
+    for name, fn in [("legacy", legacy_extract), ("single pass", Ticket._match_irctc_fields)]:
+        seconds = min(timeit.repeat(lambda: fn(SAMPLE_TICKET_TEXT),
+                                    number=args.iterations, repeat=5))
+        print(f"{name:>12}: {seconds / args.iterations * 1e6:.2f} us/ticket")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,118 @@
+# Times each stage of parsing an IRCTC ticket separately over a generated corpus of tickets: PDF text extraction, field extraction,
+# resolving the boarding/destination stations against the train's route and matching the travellers for the event colour
+# Run from the project folder: python -m benchmarks.irctc_stages [--count N] [--max-halts N] [--write FOLDER]
+# With --write the corpus is also kept in FOLDER: the tickets as PDF and text, and the routes as RailRadar would send them
+
+import argparse
+import copy
+import json
+from pathlib import Path
+import random
+import statistics
+import tempfile
+import time
+from typing import Callable
+
+from Configuration import DEFAULT_CONFIG, Configuration, Traveller
+from Logger import LogLevel
+from RouteStore import store as route_store
+from Ticket import Ticket
+from benchmarks.fixtures import FIRST_NAMES, LAST_NAMES, make_irctc_corpus, write_pdf
+from common import CalendarEventColor
+
+
+def write_corpus(folder: Path, tickets: list[tuple[str, str]], routes: dict[str, list[dict]]) -> None:
+    (folder / "routes").mkdir(parents=True, exist_ok=True)
+    for name, text in tickets:
+        write_pdf(folder / f"{name}.pdf", text)
+        (folder / f"{name}.txt").write_text(text)
+    for train_number, route in routes.items():
+        (folder / "routes" / f"{train_number}.json").write_text(
+            json.dumps({"data": {"route": route}}))
+
+
+# Seconds each ticket took, the fastest of repeat runs over the whole corpus
+def time_stage(inputs: list, stage: Callable, repeat: int) -> list[float]:
+    best = [float("inf")] * len(inputs)
+    for _ in range(repeat):
+        for i, arguments in enumerate(inputs):
+            start = time.perf_counter()
+            stage(*arguments)
+            best[i] = min(best[i], time.perf_counter() - start)
+    return best
+
+
+def report(name: str, seconds: list[float]) -> None:
+    quantiles = statistics.quantiles(
+        seconds, n=100, method="inclusive") if len(seconds) > 1 else seconds * 99
+    print(f"{name:<20} {statistics.fmean(seconds) * 1e6:>10.1f} {quantiles[49] * 1e6:>10.1f} {quantiles[94] * 1e6:>10.1f} {max(seconds) * 1e6:>10.1f}")
+
+
+def make_config(cache_folder: Path, travellers: int, rng: random.Random) -> Configuration:
+    config = copy.deepcopy(DEFAULT_CONFIG)
+    config.cache_folder = cache_folder
+    config.log_level = LogLevel.Warning  # Only the parsing is timed, not logging it
+    config.traveller = [
+        Traveller([f"{rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)}" for _ in range(3)],
+                  rng.choice(list(CalendarEventColor)))
+        for _ in range(travellers)
+    ]
+    return config
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description="Per ticket time of every stage of parsing IRCTC tickets")
+    parser.add_argument("--count", type=int, default=500,
+                        help="Number of tickets to generate")
+    parser.add_argument("--trains", type=int, default=50)
+    parser.add_argument("--max-halts", type=int, default=120,
+                        help="Longest route a train can have")
+    parser.add_argument("--travellers", type=int, default=10,
+                        help="Number of [[traveller]] entries the colour is matched against")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--write", type=Path, metavar="FOLDER",
+                        help="Keep the generated corpus in FOLDER")
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    tickets, routes = make_irctc_corpus(
+        args.count, args.trains, args.max_halts, rng)
+
+    with tempfile.TemporaryDirectory() as temp_folder:
+        corpus_folder = args.write or Path(temp_folder) / "corpus"
+        write_corpus(corpus_folder, tickets, routes)
+        config = make_config(Path(temp_folder) / "cache", args.travellers, rng)
+
+        # Routes come from the route store, as they would once they've been fetched from RailRadar
+        for train_number, route in routes.items():
+            route_store.put(train_number, [
+                {"day": halt["day"], "departure": halt["scheduledDeparture"], "arrival": halt["scheduledArrival"],
+                 "code": halt["stationCode"], "name": halt["stationName"]}
+                for halt in route
+            ], config)
+
+        pdf_fps = [corpus_folder / f"{name}.pdf" for name, _ in tickets]
+        texts = [text for _, text in tickets]
+        fields = [Ticket._extract_data_from_irctc_ticket(pdf_fp, text, config)
+                  for pdf_fp, text in zip(pdf_fps, texts)]
+
+        for data, text in zip(fields, texts):
+            if Ticket._get_rrh_stations_marked(data, text, config).is_data_missing:
+                raise Exception(f"Stations of PNR {data["pnr"]} weren't resolved")
+
+        print(f"{len(tickets)} tickets on {len(routes)} trains with up to {args.max_halts} halts, {args.travellers} travellers\n")
+        print(f"{"stage (us/ticket)":<20} {"mean":>10} {"p50":>10} {"p95":>10} {"max":>10}")
+        report("pdf_extract", time_stage(
+            [(pdf_fp, config) for pdf_fp in pdf_fps], Ticket.extract_text, args.repeat))
+        report("irctc_fields", time_stage(
+            [(pdf_fp, text, config) for pdf_fp, text in zip(pdf_fps, texts)], Ticket._extract_data_from_irctc_ticket, args.repeat))
+        report("station_resolution", time_stage(
+            [(data, text, config) for data, text in zip(fields, texts)], Ticket._get_rrh_stations_marked, args.repeat))
+        report("colour", time_stage(
+            [(text, config) for text in texts], Ticket._color_from_ticket, args.repeat))
+
+
+if __name__ == "__main__":
+    main()
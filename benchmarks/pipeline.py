@@ -0,0 +1,326 @@
+# End to end throughput of processing a backlog of tickets, with Google Calendar/Drive, RailRadar and Gemini replaced by local
+# stand-ins so that no quota is used up. Latency and failures can be injected into each of them
+# Run from the project folder: python -m benchmarks.pipeline [--tickets 10 100 1000 10000] [--workers N | --async] [--google-latency-ms N] ...
+# Everything but the stand-ins is the real code: PDF extraction, parsing, the route store, the AI cache, retries and backoff
+# Gemini's stand-in only replaces the client, so the google-genai package is still needed
+
+import argparse
+import asyncio
+from collections import Counter
+import copy
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+import hashlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import json
+from pathlib import Path
+import random
+import statistics
+import tempfile
+import threading
+import time
+from types import SimpleNamespace
+from typing import Any, Callable
+
+from Configuration import DEFAULT_CONFIG, Configuration
+from ConfigurationHandler import _ConfigurationHandler
+from Logger import LogLevel
+from benchmarks.fixtures import irctc_ticket_text, make_route, write_pdf
+
+
+@dataclass
+class Faults:
+    latency: float  # seconds
+    error_rate: float  # Share of calls which fail
+
+    def apply(self, rng: random.Random, lock: threading.Lock) -> bool:
+        time.sleep(self.latency)
+        with lock:
+            return rng.random() < self.error_rate
+
+
+class CallCounter:
+    def __init__(self) -> None:
+        self.calls: Counter[str] = Counter()
+        self.lock = threading.Lock()
+        self.rng = random.Random(0)
+
+    def count(self, name: str) -> None:
+        with self.lock:
+            self.calls[name] += 1
+
+
+class _Request:
+    def __init__(self, execute: Callable[[], Any]) -> None:
+        self.execute = execute
+
+
+# The bits of the googleapiclient discovery surface used by GCalendar and GDrive
+class FakeCalendarService:
+    def __init__(self, faults: Faults, counter: CallCounter) -> None:
+        self._faults = faults
+        self._counter = counter
+        self._events: dict[str, str] = {}  # ttc_id -> htmlLink
+
+    def events(self) -> "FakeCalendarService":
+        return self
+
+    def list(self, calendarId: str, privateExtendedProperty: str, singleEvents: bool) -> _Request:
+        def execute() -> dict:
+            self._call("calendar.events.list")
+            ttc_id = privateExtendedProperty.removeprefix("ttc_id=")
+            link = self._events.get(ttc_id)
+            return {"items": [] if link is None else [{"htmlLink": link}]}
+        return _Request(execute)
+
+    def insert(self, calendarId: str, body: dict, supportsAttachments: bool) -> _Request:
+        def execute() -> dict:
+            self._call("calendar.events.insert")
+            ttc_id = body["extendedProperties"]["private"]["ttc_id"]
+            link = self._events[ttc_id] = f"https://calendar.example/event/{ttc_id}"
+            return {"htmlLink": link}
+        return _Request(execute)
+
+    # Drops the events created so far so that a long run doesn't measure the memory of the stand-in
+    def forget(self) -> None:
+        self._events.clear()
+
+    def _call(self, name: str) -> None:
+        self._counter.count(name)
+        if self._faults.apply(self._counter.rng, self._counter.lock):
+            self._counter.count(f"{name} (failed)")
+            raise Exception(f"Injected failure of {name}")
+
+
+class FakeDriveService:
+    def __init__(self, faults: Faults, counter: CallCounter) -> None:
+        self._faults = faults
+        self._counter = counter
+
+    def files(self) -> "FakeDriveService":
+        return self
+
+    def create(self, body: dict, media_body: Any, fields: str) -> _Request:
+        def execute() -> dict:
+            self._counter.count("drive.files.create")
+            if self._faults.apply(self._counter.rng, self._counter.lock):
+                self._counter.count("drive.files.create (failed)")
+                raise Exception("Injected failure of drive.files.create")
+            return {"id": body["name"], "name": body["name"], "mimeType": "application/pdf",
+                    "webViewLink": f"https://drive.example/file/{body["name"]}"}
+        return _Request(execute)
+
+
+class FakeRailRadar:
+    def __init__(self, routes: dict[str, list[dict]], faults: Faults, counter: CallCounter) -> None:
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def do_GET(self) -> None:
+                counter.count("railradar.trains")
+                train_number = self.path.rsplit("/", 1)[-1]
+                if faults.apply(counter.rng, counter.lock):
+                    counter.count("railradar.trains (failed)")
+                    self._respond(503, b"{}")
+                elif train_number not in routes:
+                    self._respond(404, b"{}")
+                else:
+                    self._respond(200, json.dumps(
+                        {"data": {"route": routes[train_number]}}).encode())
+
+            def _respond(self, status: int, body: bytes) -> None:
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format: str, *args) -> None:
+                pass
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.server.daemon_threads = True
+        self.base_url = f"http://127.0.0.1:{self.server.server_address[1]}/api/v1"
+        threading.Thread(target=self.server.serve_forever,
+                         name="fake-railradar", daemon=True).start()
+
+
+# Only the Gemini client is stood in for. Everything in front of it, the AI cache included, is the real Model
+def make_fake_model(faults: Faults, counter: CallCounter, days_ahead: float = 30) -> type:
+    from AiModelHandler import Model
+
+    # The ticket is only known to the model by the PDF sent along with the prompt. Its hash stands in for the ticket number
+    def response(request: dict) -> SimpleNamespace:
+        ttc_id = hashlib.sha1(
+            request["contents"][0].inline_data.data).hexdigest()[:12].upper()
+        departure = datetime.now() + timedelta(days=days_ahead)
+        return SimpleNamespace(text=json.dumps({
+            "departure": {"when": departure.isoformat(), "where": "Delhi Airport, Terminal 1D"},
+            "arrival": {"when": (departure + timedelta(hours=2)).isoformat(), "where": "Mumbai Airport, Terminal 2"},
+            "ttc_id": ttc_id,
+            "travel_type": "Flight",
+            "description": "Some Airline\nAB 123\n12A",
+            "traveller": "john doe",
+        }))
+
+    class FakeModels:
+        def generate_content(self, **request: Any) -> SimpleNamespace:
+            counter.count("gemini.generate_content")
+            if faults.apply(counter.rng, counter.lock):
+                counter.count("gemini.generate_content (failed)")
+                raise Exception("Injected failure of generate_content")
+            return response(request)
+
+    class FakeAsyncModels:
+        async def generate_content(self, **request: Any) -> SimpleNamespace:
+            counter.count("gemini.generate_content")
+            await asyncio.sleep(faults.latency)
+            with counter.lock:
+                failed = counter.rng.random() < faults.error_rate
+            if failed:
+                counter.count("gemini.generate_content (failed)")
+                raise Exception("Injected failure of generate_content")
+            return response(request)
+
+    class FakeModel(Model):
+        def _get_models(self, config: Configuration) -> FakeModels:
+            return FakeModels()
+
+        def _get_async_models(self, config: Configuration) -> FakeAsyncModels:
+            return FakeAsyncModels()
+
+    return FakeModel
+
+
+def make_tickets(folder: Path, count: int, trains: int, ai_share: float, rng: random.Random) -> dict[str, list[dict]]:
+    routes = {str(12000 + i): make_route(str(12000 + i), rng.randrange(8, 40), rng)
+              for i in range(trains)}
+    train_numbers = list(routes)
+    departure_date = datetime.now() + timedelta(days=30)
+
+    for i in range(count):
+        ticket_fp = folder / f"ticket_{count}_{i:05d}.pdf"
+        if rng.random() < ai_share:
+            write_pdf(ticket_fp, f"Boarding pass {i}\nSome Airline AB 123\nDEL -> BOM")
+            continue
+
+        train_number = rng.choice(train_numbers)
+        route = routes[train_number]
+        boarding = rng.randrange(0, len(route) - 1)
+        destination = rng.randrange(boarding + 1, len(route))
+        write_pdf(ticket_fp, irctc_ticket_text(f"{8000000000 + count * 100000 + i}", train_number,
+                                               route[boarding], route[destination], departure_date, [("john doe", "CNF/B2/34/LOWER")]))
+    return routes
+
+
+# A configuration for running out of root against the stand-ins, which are patched in for Google Calendar/Drive, Gemini and
+# notifications. Returns it along with the stand-ins of Calendar and Drive
+# The journeys of the tickets the model parses start model_days_ahead days from now
+def install_fakes(root: Path, railradar: FakeRailRadar, args: argparse.Namespace, counter: CallCounter, model_days_ahead: float = 30) -> tuple[Configuration, dict[str, Any]]:
+    import GServicesHandler
+    import TicketFolderHandler
+    from GCalendar import GCalendar
+    from GDrive import GDrive
+    from GService import GService
+
+    google_faults = Faults(args.google_latency_ms / 1000, args.error_rate)
+    (root / "rail_radar_credentials.json").write_text("{}")
+
+    config = copy.deepcopy(DEFAULT_CONFIG)
+    config.cache_folder = root / "cache"
+    config.ticket_folder = root / "tickets"
+    config.done_folder = root / "tickets/done"
+    config.log_folder = root / "logs"
+    config.log_level = LogLevel.Warning
+    config.rail_radar_credentials_path = root / "rail_radar_credentials.json"
+    config.rail_radar_base_url = railradar.base_url
+    config.max_retries_for_network_requests = args.retries
+    config.async_engine = args.use_async
+
+    # Every service object is a fake and no sign in happens
+    fakes = {"calendar": FakeCalendarService(google_faults, counter),
+             "drive": FakeDriveService(google_faults, counter)}
+    GService._build_service = lambda self, credentials, config: fakes[self._api_name]
+
+    class FakeGServicesHandler:
+        def __init__(self, config: Configuration) -> None:
+            self.calendar = GCalendar(config, None, lambda config: None)  # type: ignore
+            self.drive = GDrive(config, None, lambda config: None)  # type: ignore
+
+    GServicesHandler.GServicesHandler = FakeGServicesHandler  # type: ignore
+    TicketFolderHandler.Model = make_fake_model(Faults(  # type: ignore
+        args.model_latency_ms / 1000, args.error_rate), counter, model_days_ahead)
+    TicketFolderHandler.notify = lambda *args: None  # type: ignore
+    return config, fakes
+
+
+def run(count: int, args: argparse.Namespace) -> None:
+    import TicketFolderHandler
+
+    counter = CallCounter()
+    rng = random.Random(count)
+
+    with tempfile.TemporaryDirectory() as temp_folder:
+        root = Path(temp_folder)
+        (root / "tickets").mkdir()
+        routes = make_tickets(root / "tickets", count,
+                              args.trains, args.ai_share, rng)
+        railradar = FakeRailRadar(routes, Faults(
+            args.railradar_latency_ms / 1000, args.error_rate), counter)
+
+        config, _ = install_fakes(root, railradar, args, counter)
+
+        config_handler = _ConfigurationHandler()
+        config_handler.config = config
+
+        handler = TicketFolderHandler.TicketFolderHandler(
+            config_handler, scan=False)
+        ticket_fps = sorted(config.ticket_folder.glob("*.pdf"))
+
+        start = time.perf_counter()
+        results = handler.process_batch(ticket_fps, args.workers)
+        elapsed = time.perf_counter() - start
+
+        railradar.server.shutdown()
+        handler.stop()
+
+    latencies = sorted(result.seconds for result in results)
+    percentiles = statistics.quantiles(
+        latencies, n=100, method="inclusive") if len(latencies) > 1 else latencies * 99
+    outcomes = Counter(result.result for result in results)
+
+    engine = "async engine" if args.use_async else f"{args.workers} workers"
+    print(f"\n{count} tickets, {engine}: {count / elapsed:.1f} tickets/s ({elapsed:.2f} s)")
+    print(f"  per ticket  p50 {percentiles[49] * 1000:.1f} ms  p95 {percentiles[94] * 1000:.1f} ms  p99 {percentiles[98] * 1000:.1f} ms")
+    print(f"  results     {", ".join(f"{name}: {amount}" for name, amount in sorted(outcomes.items()))}")
+    for name, amount in sorted(counter.calls.items()):
+        print(f"  {name:<36} {amount}")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description="Tickets per second for the whole pipeline against local stand-ins of the APIs")
+    parser.add_argument("--tickets", type=int, nargs="+", default=[10, 100, 1000, 10000],
+                        help="Backlog sizes to run")
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--async", dest="use_async", action="store_true",
+                        help="Process the tickets with the async engine instead of --workers threads")
+    parser.add_argument("--trains", type=int, default=50,
+                        help="Number of different trains the IRCTC tickets are for")
+    parser.add_argument("--ai-share", type=float, default=0.1,
+                        help="Share of the tickets which aren't IRCTC tickets and go to the AI model")
+    parser.add_argument("--google-latency-ms", type=float, default=50)
+    parser.add_argument("--railradar-latency-ms", type=float, default=100)
+    parser.add_argument("--model-latency-ms", type=float, default=1500)
+    parser.add_argument("--error-rate", type=float, default=0,
+                        help="Share of the calls to every stand-in which fail")
+    parser.add_argument("--retries", type=int, default=3,
+                        help="max_retries_for_network_requests. Failed calls back off for 1, 2, 4... seconds like they do for real")
+    args = parser.parse_args()
+
+    for count in args.tickets:
+        run(count, args)
+
+
+if __name__ == "__main__":
+    main()
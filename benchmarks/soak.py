@@ -0,0 +1,175 @@
+# Memory of the daemon over a long stream of new tickets, with Google Calendar/Drive, RailRadar and Gemini replaced by the local
+# stand-ins of benchmarks/pipeline.py. Tickets are written to the ticket folder and handed to the handler the way the observer does
+# Run from the project folder: python -m benchmarks.soak [--minutes 60] [--rate 20] [--max-rss-growth-mb 32] ...
+# RSS and the memory traced by tracemalloc are sampled every --sample-seconds. Their growth from the end of the warmup (by when the
+# caches have filled up) to the end of the run must stay under the limits. Otherwise the allocations which grew the most are
+# listed and it exits with 1
+# Every journey has already ended so that tickets are moved to done_folder right away, as they would be over months of running
+
+import argparse
+from datetime import datetime, timedelta
+import gc
+import os
+from pathlib import Path
+import random
+import sys
+import tempfile
+import time
+import tracemalloc
+
+from watchdog.events import FileCreatedEvent
+
+from ConfigurationHandler import _ConfigurationHandler
+from benchmarks.fixtures import irctc_ticket_text, make_route, write_pdf
+from benchmarks.pipeline import CallCounter, Faults, FakeRailRadar, install_fakes
+
+
+# Resident set size of this process. psutil is used when it's installed, otherwise it's read from /proc (only on Linux)
+def rss_bytes() -> int | None:
+    try:
+        import psutil
+
+        return psutil.Process().memory_info().rss
+    except ImportError:
+        pass
+
+    try:
+        with open("/proc/self/statm") as statm:
+            return int(statm.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError):
+        return None
+
+
+def write_ticket(ticket_fp: Path, i: int, routes: dict[str, list[dict]], ai_share: float, rng: random.Random) -> None:
+    if rng.random() < ai_share:
+        write_pdf(ticket_fp, f"Boarding pass {i}\nSome Airline AB 123\nDEL -> BOM")
+        return
+
+    train_number = rng.choice(list(routes))
+    route = routes[train_number]
+    boarding = rng.randrange(0, len(route) - 1)
+    destination = rng.randrange(boarding + 1, len(route))
+    write_pdf(ticket_fp, irctc_ticket_text(f"{8000000000 + i}", train_number, route[boarding], route[destination],
+                                           datetime.now() - timedelta(days=3), [("john doe", "CNF/B2/34/LOWER")]))
+
+
+def megabytes(size: int | None) -> str:
+    return "n/a" if size is None else f"{size / 2 ** 20:.1f} MB"
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description="Memory growth of the daemon over a long stream of tickets against local stand-ins of the APIs")
+    parser.add_argument("--minutes", type=float, default=60)
+    parser.add_argument("--warmup-minutes", type=float, default=None,
+                        help="Growth is measured from the end of this. A tenth of --minutes by default")
+    parser.add_argument("--rate", type=float, default=20,
+                        help="New tickets per second. The stream goes no faster than the tickets are processed")
+    parser.add_argument("--sample-seconds", type=float, default=30)
+    parser.add_argument("--max-rss-growth-mb", type=float, default=32)
+    parser.add_argument("--max-traced-growth-mb", type=float, default=8)
+    parser.add_argument("--trace-frames", type=int, default=1,
+                        help="Frames kept by tracemalloc per allocation. More show where an allocation came from but slow the run down")
+    parser.add_argument("--top", type=int, default=15,
+                        help="Allocations to list which grew the most")
+    parser.add_argument("--trains", type=int, default=2000,
+                        help="Number of different trains the IRCTC tickets are for")
+    parser.add_argument("--ai-share", type=float, default=0.1,
+                        help="Share of the tickets which aren't IRCTC tickets and go to the AI model")
+    parser.add_argument("--google-latency-ms", type=float, default=5)
+    parser.add_argument("--railradar-latency-ms", type=float, default=10)
+    parser.add_argument("--model-latency-ms", type=float, default=50)
+    parser.add_argument("--error-rate", type=float, default=0,
+                        help="Share of the calls to every stand-in which fail")
+    parser.add_argument("--retries", type=int, default=3)
+    args = parser.parse_args()
+    args.use_async = False
+
+    import TicketFolderHandler
+
+    duration = args.minutes * 60
+    warmup = duration / 10 if args.warmup_minutes is None else args.warmup_minutes * 60
+    counter = CallCounter()
+    rng = random.Random(0)
+
+    with tempfile.TemporaryDirectory() as temp_folder:
+        root = Path(temp_folder)
+        (root / "tickets").mkdir()
+        routes = {str(10000 + i): make_route(str(10000 + i), rng.randrange(8, 40), rng)
+                  for i in range(args.trains)}
+        railradar = FakeRailRadar(routes, Faults(
+            args.railradar_latency_ms / 1000, args.error_rate), counter)
+
+        config, fakes = install_fakes(root, railradar, args, counter, -3)
+        config.file_transfer_polling_interval = timedelta(milliseconds=1)
+
+        config_handler = _ConfigurationHandler()
+        config_handler.config = config
+        handler = TicketFolderHandler.TicketFolderHandler(
+            config_handler, scan=False)
+
+        tracemalloc.start(args.trace_frames)
+        baseline = None
+
+        print(f"{"minutes":>8} {"tickets":>8} {"rss":>12} {"traced":>12}")
+        start = time.monotonic()
+        next_sample = start
+        tickets = 0
+        while (now := time.monotonic()) - start < duration:
+            if now >= next_sample:
+                gc.collect()
+                sample = (now - start, tickets, rss_bytes(),
+                          tracemalloc.get_traced_memory()[0])
+                print(f"{sample[0] / 60:>8.1f} {tickets:>8} {megabytes(sample[2]):>12} {megabytes(sample[3]):>12}", flush=True)
+                if baseline is None and now - start >= warmup:
+                    baseline = (sample, tracemalloc.take_snapshot())
+                next_sample += args.sample_seconds
+
+            ticket_fp = config.ticket_folder / f"ticket_{tickets:08d}.pdf"
+            write_ticket(ticket_fp, tickets, routes, args.ai_share, rng)
+            handler.dispatch(FileCreatedEvent(str(ticket_fp)))
+            fakes["calendar"].forget()
+            tickets += 1
+
+            time.sleep(max(0.0, start + tickets / args.rate - time.monotonic()))
+
+        gc.collect()
+        end = (time.monotonic() - start, tickets,
+               rss_bytes(), tracemalloc.get_traced_memory()[0])
+        print(f"{end[0] / 60:>8.1f} {tickets:>8} {megabytes(end[2]):>12} {megabytes(end[3]):>12}")
+        snapshot = tracemalloc.take_snapshot()
+        tracemalloc.stop()
+
+        railradar.server.shutdown()
+        handler.stop()
+
+    if baseline is None:
+        print("\nThe run ended before the warmup did. Nothing to compare")
+        return
+
+    (_, base_tickets, base_rss, base_traced), base_snapshot = baseline
+    rss_growth = None if end[2] is None or base_rss is None else end[2] - base_rss
+    traced_growth = end[3] - base_traced
+    per_thousand = 1000 / max(1, tickets - base_tickets)
+
+    print(f"\n{tickets} tickets at {tickets / end[0]:.1f} tickets/s. After the warmup ({base_tickets} tickets):")
+    print(f"  rss     {megabytes(rss_growth):>10} (limit {args.max_rss_growth_mb:.0f} MB)"
+          + ("" if rss_growth is None else f"  {rss_growth * per_thousand / 1024:.1f} KB per 1000 tickets"))
+    print(f"  traced  {megabytes(traced_growth):>10} (limit {args.max_traced_growth_mb:.0f} MB)"
+          f"  {traced_growth * per_thousand / 1024:.1f} KB per 1000 tickets")
+
+    failed = traced_growth > args.max_traced_growth_mb * 2 ** 20 or (
+        rss_growth is not None and rss_growth > args.max_rss_growth_mb * 2 ** 20)
+    if args.top and (failed or traced_growth > 0):
+        filters = [tracemalloc.Filter(False, tracemalloc.__file__)]
+        print("\nGrew the most:")
+        for stat in snapshot.filter_traces(filters).compare_to(base_snapshot.filter_traces(filters), "traceback")[:args.top]:
+            print(f"{stat.size_diff / 1024:+.1f} KB in {stat.count_diff:+} blocks")
+            print("\n".join(f"    {line}" for line in stat.traceback.format()))
+
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
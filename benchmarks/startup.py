@@ -0,0 +1,62 @@
+# Import time of main.py, broken down per module, with a target for the whole import
+# Run from the project folder: python -m benchmarks.startup [--target-ms N] [--top N]
+# The daemon itself logs how long it took to start watching the ticket folder ("Took ... seconds to get here") and exports it as
+# the ttc_time_to_watching_seconds metric
+
+import argparse
+import subprocess
+import sys
+
+# Modules which should only be imported once they're needed. None of them must show up while importing main
+LAZY_MODULES = ["google", "googleapiclient", "pypdf",
+                "requests", "plyer", "cProfile", "tracemalloc"]
+
+
+def import_times(module: str) -> list[tuple[str, int, int]]:
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        capture_output=True, text=True, check=True
+    )
+
+    # Lines look like "import time:       self [us] |  cumulative | imported package"
+    times = []
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        own, cumulative, name = line.removeprefix(
+            "import time:").split("|")
+        times.append((name.strip(), int(own), int(cumulative)))
+    return times
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description="Per module import time of main.py")
+    parser.add_argument("--target-ms", type=float, default=150,
+                        help="Fail if importing main takes longer than this")
+    parser.add_argument("--top", type=int, default=20)
+    parser.add_argument("--runs", type=int, default=5,
+                        help="The fastest of these many runs is reported")
+    args = parser.parse_args()
+
+    runs = [import_times("main") for _ in range(args.runs)]
+    times = min(runs, key=lambda run: next(
+        cumulative for name, _, cumulative in run if name == "main"))
+
+    print(f"{"module":<50} {"self ms":>10} {"cumulative ms":>15}")
+    for name, own, cumulative in sorted(times, key=lambda entry: entry[1], reverse=True)[:args.top]:
+        print(f"{name:<50} {own / 1000:>10.2f} {cumulative / 1000:>15.2f}")
+
+    total = next(cumulative for name, _, cumulative in times if name == "main") / 1000
+    print(f"\nimport main: {total:.1f} ms (target {args.target_ms:.0f} ms)")
+
+    eager = sorted({name.strip().split(".")[0] for name, _, _ in times} & set(LAZY_MODULES))
+    if eager:
+        print(f"Imported eagerly but should be lazy: {", ".join(eager)}")
+
+    if total > args.target_ms or eager:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,11 +1,16 @@
+import atexit
+from collections.abc import Iterator
+from contextlib import contextmanager
 from enum import Enum, IntEnum, auto
+import os
 from pathlib import Path
-
-from plyer import notification
+import queue
+import threading
+import time
 
 from Logger import LogLevel, log
 
-from typing import TYPE_CHECKING, Type
+from typing import TYPE_CHECKING, Self, Type
 
 if TYPE_CHECKING:
     from Configuration import Configuration
@@ -15,6 +20,18 @@ class ReminderNotificationType(IntEnum):
     email = auto()
 
 
+# How the ticket folder is watched. polling is for network mounted and synced folders where the OS never reports new files
+class WatchMode(IntEnum):
+    native = auto()
+    polling = auto()
+
+
+class CacheCompression(IntEnum):
+    none = auto()
+    gzip = auto()
+    zstd = auto()  # Needs the zstandard package
+
+
 class CalendarEventColor(IntEnum):
     Lavendar = 1
     Sage = 2
@@ -39,8 +56,74 @@ def calculate_backoff(attempt: int) -> float:
     return 2 ** attempt
 
 
+# Notifications are put on a queue and shown from a background thread so that the ticket being processed isn't held up by them
+# Notifications arriving within _coalesce_window of each other are shown together. Those sharing a title become a single
+# notification, so a burst of tickets makes a handful of popups instead of one per ticket
+class _Notifier(threading.Thread):
+    _coalesce_window = 2  # seconds
+
+    def __init__(self: Self) -> None:
+        super().__init__(name="notifier", daemon=True)
+        self.notifications: queue.Queue[tuple[str, str, "Configuration"]] = queue.Queue()
+
+    def run(self: Self) -> None:
+        while True:
+            batch = [self.notifications.get()]
+            deadline = time.monotonic() + self._coalesce_window
+            while (remaining := deadline - time.monotonic()) > 0:
+                try:
+                    batch.append(self.notifications.get(timeout=remaining))
+                except queue.Empty:
+                    break
+
+            try:
+                self._show(batch)
+            finally:
+                for _ in batch:
+                    self.notifications.task_done()
+
+    @staticmethod
+    def _show(batch: list[tuple[str, str, "Configuration"]]) -> None:
+        by_title: dict[str, list[str]] = {}
+        for title, message, _ in batch:
+            by_title.setdefault(title, []).append(message)
+
+        config = batch[-1][2]
+        for title, messages in by_title.items():
+            if len(messages) == 1:
+                _show_notification(title, messages[0], config)
+            else:
+                _show_notification(f"{title} ({len(messages)})",
+                                   f"{messages[0]} and {len(messages) - 1} more", config)
+
+
+_notifier: _Notifier | None = None
+_notifier_lock = threading.Lock()
+
+
 def notify(title: str, message: str, config: "Configuration") -> None:
+    global _notifier
+
+    if _notifier is None:
+        with _notifier_lock:
+            if _notifier is None:
+                _notifier = _Notifier()
+                _notifier.start()
+
+    _notifier.notifications.put((title, message, config))
+
+
+# Blocks till every notification so far has been shown. Also runs when the program exits
+@atexit.register
+def flush_notifications() -> None:
+    if _notifier is not None and _notifier.is_alive():
+        _notifier.notifications.join()
+
+
+def _show_notification(title: str, message: str, config: "Configuration") -> None:
     try:
+        from plyer import notification
+
         notification.notify(  # type: ignore
             title=title, message=message, app_name="Travel Ticket Calendar", timeout=10
         )
@@ -48,5 +131,28 @@ def notify(title: str, message: str, config: "Configuration") -> None:
         log(LogLevel.Warning, config, f"Failure to send notification: {error}")
 
 
+# Exclusive lock across processes, held on lock_fp for as long as the with block runs
+@contextmanager
+def file_lock(lock_fp: Path) -> Iterator[None]:
+    lock_fp.parent.mkdir(parents=True, exist_ok=True)
+    with open(lock_fp, "a+b") as lock_file:
+        if os.name == "nt":
+            import msvcrt
+            lock_file.seek(0)
+            msvcrt.locking(lock_file.fileno(), msvcrt.LK_LOCK, 1)
+            try:
+                yield
+            finally:
+                lock_file.seek(0)
+                msvcrt.locking(lock_file.fileno(), msvcrt.LK_UNLCK, 1)
+        else:
+            import fcntl
+            fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file.fileno(), fcntl.LOCK_UN)
+
+
 def stringify_enum(enum: Type[Enum]) -> str:
     return ", ".join([val.name for val in enum])
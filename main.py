@@ -1,45 +1,253 @@
-from datetime import datetime
+import time
+
+_started_at = time.perf_counter()
+
+import argparse
+from collections import Counter
+import json
+from pathlib import Path
 import sys
 
+from AiModelHandler import Model
+from CacheSweeper import CacheSweeper
 from Configuration import Configuration
-from ConfigurationHandler import handler as config_handler
-from Logger import LogLevel, log
+from ConfigurationHandler import _ConfigurationHandler, get_handler
+from DoneScheduler import DoneScheduler
+from JobQueue import JobQueue
+from FileCache import FileCache
+from FolderWatch import FolderWatch
+from Logger import LogLevel, flush, log, set_console
+from Metrics import MetricsExporter, metrics
 from TicketFolderHandler import TicketFolderHandler
+from common import WatchMode
 
-from watchdog.observers import Observer
 
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        description="Adds your travel tickets to Google Calendar as they land in the ticket folder")
+    parser.add_argument("--profile", action="store_true",
+                        help="Profile the startup scan of the ticket folder, write the reports to profile_folder and exit")
+    parser.add_argument("--profile-minutes", type=float, default=0, metavar="N",
+                        help="With --profile, also profile N minutes of watching the ticket folder after the startup scan")
+    parser.add_argument("--once", type=Path, metavar="FOLDER",
+                        help="Process the tickets in FOLDER, print a JSON summary and exit instead of watching the ticket folder")
+    parser.add_argument("--recursive", action="store_true",
+                        help="With --once, also process the tickets in the subfolders of FOLDER")
+    parser.add_argument("--workers", type=int, default=4, metavar="N",
+                        help="With --once, process up to N tickets at a time")
+    parser.add_argument("--summary", type=Path, metavar="FILE",
+                        help="With --once, write the JSON summary to FILE instead of stdout")
+    parser.add_argument("--tenant", metavar="NAME",
+                        help="With --once, add the tickets to the calendar of the tenant NAME")
+    parser.add_argument("--worker", action="store_true",
+                        help="Process tickets from the job queue instead of watching the ticket folder")
+    parser.add_argument("--processes", type=int, default=1, metavar="N",
+                        help="With --worker, run N worker processes")
+    parser.add_argument("--queue-status", action="store_true",
+                        help="Print the number of jobs in the job queue in each state and the dead letters as JSON and exit")
+    parser.add_argument("--retry-dead", action="store_true",
+                        help="Put the dead letters of the job queue back in the queue and exit")
+    return parser.parse_args()
+
+
+# Exits with 1 if any ticket failed to be parsed or added to the calendar
+# Journeys which haven't ended yet aren't scheduled to be marked as done, since nothing keeps running to do that. The daemon
+# marks those in its ticket folder once it comes across them
+def run_once(args: argparse.Namespace, config_handler: _ConfigurationHandler) -> None:
+    config = config_handler.config
+    folder: Path = args.once
+
+    if not folder.is_dir():
+        log(LogLevel.Error, config, f"'{folder}' isn't a folder. Exiting...")
+        flush()
+        sys.exit(2)
+
+    if args.tenant is not None and args.tenant not in [tenant["name"] for tenant in config.tenant]:
+        log(LogLevel.Error, config,
+            f"There's no tenant named '{args.tenant}'. Exiting...")
+        flush()
+        sys.exit(2)
+
+    handler = TicketFolderHandler(
+        config_handler, scan=False, tenant=args.tenant, schedule_done=False)
+    done_folder = handler.config.done_folder.resolve()
+    ticket_fps = sorted(ticket_fp for ticket_fp in (folder.rglob("*.pdf") if args.recursive else folder.glob("*.pdf"))
+                        if not ticket_fp.resolve().is_relative_to(done_folder))
+
+    results = handler.process_batch(ticket_fps, max(1, args.workers))
+
+    summary = json.dumps({
+        "seconds": round(time.perf_counter() - _started_at, 3),
+        "results": Counter(result.result for result in results),
+        "failed": sum(result.failed for result in results),
+        "tickets": [{
+            "ticket": str(result.ticket_fp),
+            "result": result.result,
+            "link": result.link,
+            "seconds": round(result.seconds, 3),
+        } for result in results],
+    }, indent=2)
+
+    MetricsExporter.write_textfile(config)
+    flush()
+    if args.summary is None:
+        print(summary)
+    else:
+        args.summary.write_text(summary + "\n")
+
+    if any(result.failed for result in results):
+        sys.exit(1)
+
+
+def queue_status(args: argparse.Namespace, config_handler: _ConfigurationHandler) -> None:
+    queue = JobQueue(config_handler.config)
+
+    if args.retry_dead:
+        log(LogLevel.Status, config_handler.config,
+            f"Put {queue.retry_dead()} dead letters back in the queue")
+        flush()
+
+    if args.queue_status:
+        print(json.dumps({
+            "queue": str(queue.db_fp),
+            "depth": queue.depth(),
+            "dead_letters": queue.dead_letters(),
+        }, indent=2))
 
-def cache_cleanup(config: Configuration) -> None:
-    try:
-        for file in config.cache_folder.iterdir():
-            if file.is_file() and datetime.now() - datetime.fromtimestamp(file.stat().st_mtime) > config.cache_data_refresh_time:
-                file.unlink(missing_ok=True)
-    except Exception as error:
-        log(LogLevel.Warning, config,
-            f"Failure to cleanup outdated cache file: {error}")
 
 def main() -> None:
-    cache_cleanup(config_handler.config)
+    args = parse_args()
+    # --once keeps stdout for its JSON summary
+    if args.once is not None:
+        set_console(sys.stderr)
+    config_handler = get_handler()
+
+    if args.once is not None:
+        run_once(args, config_handler)
+        return
+
+    if args.queue_status or args.retry_dead:
+        queue_status(args, config_handler)
+        return
 
-    observer = Observer()
+    if args.worker:
+        from JobWorker import run_workers
 
-    observer.schedule(
-        TicketFolderHandler(config_handler),
-        str(config_handler.config.ticket_folder),
-        recursive=True
-    )
+        run_workers(args.processes, config_handler.config)
+        return
+
+    profiler = None
+    if args.profile:
+        from Profiler import Profiler
+
+        profiler = Profiler()
+        profiler.start(config_handler.config)
+
+    cache_sweeper = CacheSweeper(config_handler.config)
+    cache_sweeper.start()
+
+    metrics_exporter = MetricsExporter(config_handler.config)
+    if MetricsExporter.is_enabled(config_handler.config):
+        metrics_exporter.start()
+
+    if config_handler.config.watch_mode == WatchMode.polling:
+        from ScandirObserver import ScandirObserver
+
+        observer = ScandirObserver(config_handler)
+    else:
+        from watchdog.observers import Observer
+
+        observer = Observer()
+
+    # A handler per tenant, all of them sharing the AI model and the done scheduler. Otherwise just the one handler
+    # With the job queue the handlers only queue the tickets and worker processes take it from there
+    config = config_handler.config
+    done_scheduler = None
+    supervisor = None
+    if config.job_queue:
+        from JobWorker import WorkerSupervisor
+
+        queue = JobQueue(config)
+        handlers = [TicketFolderHandler(config_handler, tenant=tenant, queue=queue)
+                    for tenant in ([tenant["name"] for tenant in config.tenant] or [None])]
+        supervisor = WorkerSupervisor(config.job_queue_workers, config)
+        supervisor.start()
+        log(LogLevel.Status, config,
+            f"Queueing tickets in {queue.db_fp} for {config.job_queue_workers} worker processes")
+    elif config.tenant:
+        model = Model()
+        done_scheduler = DoneScheduler(config)
+        done_scheduler.start()
+        handlers = [TicketFolderHandler(config_handler, tenant=tenant["name"], model=model, done_scheduler=done_scheduler)
+                    for tenant in config.tenant]
+    else:
+        handlers = [TicketFolderHandler(config_handler)]
+
+    # A watch per handler, leaving out its done_folder unless the observer does that itself
+    folder_watches = [FolderWatch(observer, handler, config.watch_mode == WatchMode.polling)
+                      for handler in handlers]
+    for folder_watch in folder_watches:
+        folder_watch.schedule()
+
+    def on_config_change(old: Configuration, new: Configuration, changed: set[str]) -> None:
+        cache_sweeper.config = new
+        metrics_exporter.config = new
+        if done_scheduler is not None:
+            done_scheduler.config = new
+        if supervisor is not None:
+            supervisor.config = new
+
+        if [tenant["name"] for tenant in old.tenant] != [tenant["name"] for tenant in new.tenant]:
+            log(LogLevel.Warning, new,
+                "Tenants were added or removed. That takes effect on the next restart")
+
+        # The handlers have already picked up their new configuration by now
+        for folder_watch, handler in zip(folder_watches, handlers):
+            folder_watch.update(handler.config)
+
+    config_handler.subscribe(on_config_change)
 
     try:
         observer.start()
     except FileNotFoundError as error:
-        log(LogLevel.Error, config_handler.config,
-            f"'{config_handler.config.ticket_folder}' doesn't exist hence cannot monitor it {error}. Exiting...")
+        log(LogLevel.Error, config,
+            f"'{", ".join(str(folder_watch.ticket_folder) for folder_watch in folder_watches)}' doesn't exist hence cannot monitor it {error}. Exiting...")
         sys.exit(-1)
 
+    time_to_watching = time.perf_counter() - _started_at
+    metrics.observe("time_to_watching_seconds", time_to_watching)
+    log(LogLevel.Status, config,
+        f"Watching '{"', '".join(str(folder_watch.ticket_folder) for folder_watch in folder_watches)}'. Took {time_to_watching:.2f} seconds to get here")
+
+    config_handler.watch()
+
+    # The reports are written even when profiling is cut short with Ctrl+C
     try:
+        if profiler is not None:
+            time.sleep(args.profile_minutes * 60)
+            observer.stop()
         observer.join()
     except KeyboardInterrupt:
         log(LogLevel.Status, config_handler.config, "Stopping")
+    finally:
+        if profiler is not None:
+            profiler.stop(config_handler.config)
+
+    config_handler.stop_watching()
+    if supervisor is not None:
+        supervisor.stop()
+    cache_sweeper.stop()
+    for handler in handlers:
+        handler.stop()
+    if done_scheduler is not None:
+        done_scheduler.stop()
+        done_scheduler.join()
+    if metrics_exporter.is_alive():
+        metrics_exporter.stop()
+
+    for namespace, stats in FileCache.stats().items():
+        log(LogLevel.Status, config_handler.config,
+            f"Cache '{namespace}': {stats.memory_hits} memory hits, {stats.disk_hits} disk hits, {stats.misses} misses, {stats.evictions} evictions")
 
 
 if __name__ == "__main__":